@@ -1,39 +1,385 @@
 import datetime
-from typing import Optional, cast
+import json
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, cast
 
 import frappe
 from frappe.query_builder import DocType
-from pypika import Order
+from frappe.query_builder.functions import Count
+from frappe.realtime import get_doctype_room
+from frappe.utils import add_to_date, get_datetime, now_datetime
+from pypika import Criterion, Order
 from pypika.queries import QueryBuilder
-from result import is_ok
+from result import is_err
+from rq import get_current_job
 
 from ksa_compliance import logger
+from ksa_compliance import submission_engine
+from ksa_compliance.batch_context import BatchContext
+from ksa_compliance.group_commit import GroupCommit
 from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields import (
     SalesInvoiceAdditionalFields,
 )
+from ksa_compliance.ksa_compliance.doctype.zatca_sync_run.zatca_sync_run import ZATCASyncRun
+
+SYNC_JOB_TIMEOUT = 3480  # 58 minutes, so that we can run it hourly
+
+# Time left before a sync job's timeout to stop and checkpoint
+DEADLINE_MARGIN_SECONDS = 120
+
+# How long after its job's timeout an unfinished sync is considered stalled
+STALLED_SYNC_GRACE_SECONDS = 10 * 60
+
+SYNC_PROGRESS_EVENT = 'zatca_sync_progress'
+
+
+@dataclass
+class SyncProgress:
+    counts: Counter = field(default_factory=Counter)
+    """The number of invoices by result: integration status, 'Not Sent' or 'Failed'"""
+
+    last_creation: Optional[datetime.datetime] = None
+    last_name: Optional[str] = None
+    """The last invoice processed. The sync continues after it"""
+
+    is_complete: bool = True
+
+
+@dataclass
+class SyncShard:
+    """
+    Invoices that can be synced independently of all others: those of a business settings, or the precomputed
+    invoices of an EGS. Each has its own hash chain and credentials
+    """
+
+    key: str
+    business_settings: Optional[str] = None
+    egs: Optional[str] = None
+    company: Optional[str] = None
 
 
 @frappe.whitelist()
-def add_batch_to_background_queue(check_date=datetime.date.today()):
+def add_batch_to_background_queue(check_date=datetime.date.today()) -> Optional[str]:
     try:
         logger.info('Start Enqueue E-Invoices')
-        frappe.enqueue(
-            'ksa_compliance.background_jobs.sync_e_invoices',
-            check_date=check_date,
-            queue='long',
-            timeout=3480,  # 58 minutes, so that we can run it hourly
-            job_name='Sync E-Invoices',
-            deduplicate=True,
-            job_id=f'Sending invoices {check_date}',
-        )
+        return enqueue_sync_jobs(check_date)
     except Exception as ex:
         logger.error('An error occurred queueing the job', exc_info=ex)
 
 
+def enqueue_sync_jobs(check_date: Optional[datetime.datetime | datetime.date | str] = None) -> str:
+    """
+    Fans the sync out into one job per shard (see [SyncShard]), so that the invoices of different companies and EGS
+    units are synced in parallel by different workers. Each job's progress is tracked in a 'ZATCA Sync Run', and the
+    runs of all jobs share a run ID. Once all jobs are done, a coordinator job reports the combined result.
+
+    A shard that's still being synced by a previous run is skipped, unless its sync has stalled (e.g. its job was
+    killed). A stalled sync is resumed from its last checkpoint as part of this run.
+
+    Returns the run ID
+    """
+    run_id = frappe.generate_hash(length=10)
+    sync_runs = []
+    for shard in get_sync_shards():
+        sync_run = ZATCASyncRun.get_active(shard.key)
+        if sync_run and not _is_stalled(sync_run):
+            logger.info(f'Sync of {shard.key} is already running ({sync_run.name})')
+            continue
+
+        if sync_run:
+            logger.info(f'Resuming stalled sync of {shard.key} ({sync_run.name}) after {sync_run.last_name}')
+            sync_run.db_set({'run_id': run_id, 'status': 'Queued', 'continuations': sync_run.continuations + 1})
+        else:
+            sync_run = cast(ZATCASyncRun, frappe.new_doc('ZATCA Sync Run'))
+            sync_run.update(
+                {
+                    'run_id': run_id,
+                    'shard': shard.key,
+                    'business_settings': shard.business_settings,
+                    'egs': shard.egs,
+                    'company': shard.company,
+                    'check_date': _to_datetime(check_date),
+                }
+            )
+            sync_run.insert(ignore_permissions=True)
+        sync_runs.append(sync_run)
+
+    # Jobs need to see their sync runs
+    frappe.db.commit()
+    for sync_run in sync_runs:
+        _enqueue_sync_run(sync_run)
+
+    logger.info(f'Sync run {run_id}: enqueued {len(sync_runs)} jobs')
+    return run_id
+
+
+def get_sync_shards() -> List[SyncShard]:
+    companies = dict(frappe.get_all('ZATCA Business Settings', fields=['name', 'company'], as_list=True))
+    shards = [
+        SyncShard(key=f'ZATCA Business Settings {name}', business_settings=name, company=companies[name])
+        for name in frappe.get_all('ZATCA Business Settings', {'status': 'Active'}, pluck='name', order_by='creation')
+    ]
+    shards += [
+        SyncShard(key=f'ZATCA EGS {egs.name}', egs=egs.name, company=companies.get(egs.business_settings))
+        for egs in frappe.get_all('ZATCA EGS', fields=['name', 'business_settings'], order_by='creation')
+    ]
+    return shards
+
+
+def sync_shard(sync_run: str):
+    """
+    Syncs the shard of [sync_run], starting after its checkpoint. If the job gets close to its timeout, it stops after
+    the current batch and enqueues a new job to continue. Progress is published to the Sync Invoices page after every
+    batch
+    """
+    run = cast(ZATCASyncRun, frappe.get_doc('ZATCA Sync Run', sync_run))
+    if run.status != 'Queued':
+        logger.info(f'Sync run {run.name} is {run.status}, nothing to do')
+        return
+
+    shard = SyncShard(run.shard, run.business_settings, run.egs, run.company)
+    previous_counts = run.get_counts()
+    start_after = run.last_creation or run.check_date
+    run.db_set(
+        {
+            'status': 'Running',
+            'started_at': run.started_at or now_datetime(),
+            'total': run.processed + count_pending(start_after, shard, run.last_name),
+        },
+        commit=True,
+    )
+    _publish_progress(run.run_id, get_shard_status(run))
+
+    def on_progress(progress: SyncProgress):
+        run.checkpoint(previous_counts + progress.counts, progress.last_creation, progress.last_name)
+        # Published once the checkpoint is committed
+        _publish_progress(run.run_id, get_shard_status(run), after_commit=True)
+
+    try:
+        progress = sync_e_invoices(
+            start_after,
+            shard=shard,
+            after_name=run.last_name,
+            deadline=_get_job_deadline(),
+            on_progress=on_progress,
+            should_stop=lambda: _is_cancelled(run.name),
+        )
+    except Exception as e:
+        logger.error(f'Sync run {run.run_id}: syncing {shard.key} failed', exc_info=True)
+        frappe.db.rollback()
+        run.db_set({'status': 'Failed', 'error': str(e) or type(e).__name__}, commit=True)
+        _publish_progress(run.run_id, get_shard_status(run))
+        _finish_sync_run_if_done(run.run_id)
+        raise
+
+    if _is_cancelled(run.name):
+        logger.info(f'Sync run {run.run_id}: syncing {shard.key} was cancelled after {run.last_name}')
+        run.status = 'Cancelled'
+        _publish_progress(run.run_id, get_shard_status(run))
+        return
+
+    if progress.is_complete:
+        run.db_set({'status': 'Finished', 'finished_at': now_datetime()}, commit=True)
+        _publish_progress(run.run_id, get_shard_status(run))
+        _finish_sync_run_if_done(run.run_id)
+        return
+
+    run.db_set({'status': 'Queued', 'continuations': run.continuations + 1}, commit=True)
+    logger.info(f'Sync run {run.run_id}: continuing {shard.key} in a new job after {run.last_name}')
+    _publish_progress(run.run_id, get_shard_status(run))
+    _enqueue_sync_run(run)
+
+
+@frappe.whitelist()
+def cancel_sync_run(run_id: str) -> dict:
+    """
+    Cancels the jobs of a sync run. Queued jobs don't start, and running jobs stop after their current batch. Invoices
+    already sent stay sent
+    """
+    frappe.only_for('System Manager')
+    for name in frappe.get_all(
+        'ZATCA Sync Run', {'run_id': run_id, 'status': ('in', ['Queued', 'Running'])}, pluck='name'
+    ):
+        frappe.db.set_value('ZATCA Sync Run', name, {'status': 'Cancelled', 'finished_at': now_datetime()})
+    frappe.db.commit()
+
+    status = get_sync_run_status(run_id)
+    for shard_status in status['shards'].values():
+        _publish_progress(run_id, shard_status)
+    _finish_sync_run_if_done(run_id)
+    return status
+
+
+def report_sync_run(run_id: str) -> dict:
+    """The coordinator job: logs the combined result of a sync run once all its jobs are done"""
+    status = get_sync_run_status(run_id)
+    logger.info(f'Sync run {run_id}: {status["status"]}, {dict(status["counts"])}')
+    failed = [key for key, shard in status['shards'].items() if shard['status'] == 'Failed']
+    if failed:
+        frappe.log_error(
+            title='ZATCA Sync Failed',
+            message=f'Sync run {run_id} failed for: {", ".join(failed)}. Invoice counts: {dict(status["counts"])}',
+        )
+    return status
+
+
+@frappe.whitelist()
+def get_sync_run_status(run_id: Optional[str] = None) -> dict:
+    """Returns the combined status of a sync run (the latest one by default) and the progress of each of its jobs"""
+    run_id = run_id or frappe.db.get_value('ZATCA Sync Run', {}, 'run_id', order_by='creation desc')
+    shards = {}
+    if run_id:
+        for sync_run in frappe.get_all(
+            'ZATCA Sync Run',
+            {'run_id': run_id},
+            ['name', 'shard', 'company', 'status', 'counts', 'processed', 'total', 'started_at', 'finished_at'],
+            order_by='creation',
+        ):
+            shards[sync_run.shard] = get_shard_status(sync_run)
+    return {'run_id': run_id, **summarize_sync_run(shards)}
+
+
+def get_shard_status(sync_run: ZATCASyncRun | frappe._dict) -> dict:
+    """Returns the progress of a sync run's job: invoice counts, throughput (invoices per second) and ETA (seconds)"""
+    counts = json.loads(sync_run.counts) if isinstance(sync_run.counts, str) else sync_run.counts
+    processed = sync_run.processed or 0
+    rate = 0.0
+    if sync_run.started_at and processed:
+        finished_at = get_datetime(sync_run.finished_at or now_datetime())
+        elapsed = (finished_at - get_datetime(sync_run.started_at)).total_seconds()
+        rate = processed / elapsed if elapsed else 0.0
+
+    is_active = sync_run.status in ('Queued', 'Running')
+    remaining = max(0, (sync_run.total or 0) - processed) if is_active else 0
+    return {
+        'sync_run': sync_run.name,
+        'shard': sync_run.shard,
+        'company': sync_run.company,
+        'status': sync_run.status,
+        'counts': counts or {},
+        'processed': processed,
+        'remaining': remaining,
+        'rate': rate if is_active else 0.0,
+        'eta': round(remaining / rate) if is_active and rate else None,
+    }
+
+
+def summarize_sync_run(shards: Dict[str, dict]) -> dict:
+    counts = Counter()
+    for shard in shards.values():
+        counts.update(shard.get('counts', {}))
+
+    statuses = {shard['status'] for shard in shards.values()}
+    if not shards:
+        status = 'Not Started'
+    elif statuses & {'Queued', 'Running'}:
+        status = 'Running'
+    elif 'Failed' in statuses:
+        status = 'Failed'
+    elif 'Cancelled' in statuses:
+        status = 'Cancelled'
+    else:
+        status = 'Finished'
+
+    remaining = sum(shard.get('remaining', 0) for shard in shards.values())
+    rate = sum(shard.get('rate', 0.0) for shard in shards.values())
+    return {
+        'status': status,
+        'counts': counts,
+        'processed': sum(shard.get('processed', 0) for shard in shards.values()),
+        'remaining': remaining,
+        'rate': rate,
+        'eta': round(remaining / rate) if rate else None,
+        'shards': shards,
+    }
+
+
+def _publish_progress(run_id: str, shard_status: dict, after_commit: bool = False) -> None:
+    # Sent to users who can read sync runs and have subscribed to them, like the Sync Invoices page
+    frappe.publish_realtime(
+        SYNC_PROGRESS_EVENT,
+        {'run_id': run_id, **shard_status},
+        room=get_doctype_room('ZATCA Sync Run'),
+        after_commit=after_commit,
+    )
+
+
+def _is_cancelled(sync_run: str) -> bool:
+    # Reads within a transaction may not see a cancellation until the sync commits its current group
+    return frappe.db.get_value('ZATCA Sync Run', sync_run, 'status') == 'Cancelled'
+
+
+def _enqueue_sync_run(sync_run: ZATCASyncRun) -> None:
+    frappe.enqueue(
+        'ksa_compliance.background_jobs.sync_shard',
+        sync_run=sync_run.name,
+        queue='long',
+        timeout=SYNC_JOB_TIMEOUT,
+        job_name=f'Sync E-Invoices ({sync_run.shard})',
+        # Continuations are enqueued by the job they continue, which is still running at that point
+        job_id=f'Sync E-Invoices {sync_run.name} {sync_run.continuations}',
+        deduplicate=True,
+    )
+
+
+def _finish_sync_run_if_done(run_id: str) -> None:
+    if get_sync_run_status(run_id)['status'] not in ('Finished', 'Failed', 'Cancelled'):
+        return
+
+    # The last two jobs can finish at the same time. Deduplication makes sure we only report once
+    frappe.enqueue(
+        'ksa_compliance.background_jobs.report_sync_run',
+        run_id=run_id,
+        queue='short',
+        job_name=f'Report Sync Run {run_id}',
+        deduplicate=True,
+        job_id=f'Report Sync Run {run_id}',
+    )
+
+
+def _is_stalled(sync_run: ZATCASyncRun) -> bool:
+    # Checkpoints update the modified timestamp after every batch, and a job never runs longer than its timeout
+    stalled_after = add_to_date(now_datetime(), seconds=-(SYNC_JOB_TIMEOUT + STALLED_SYNC_GRACE_SECONDS))
+    return get_datetime(sync_run.modified) < stalled_after
+
+
+def _get_job_deadline() -> float:
+    """Returns the time.monotonic() by which the current job should be done, leaving time to checkpoint"""
+    job = get_current_job()
+    timeout = job.timeout if job and job.timeout else SYNC_JOB_TIMEOUT
+    return time.monotonic() + timeout - DEADLINE_MARGIN_SECONDS
+
+
+def _to_datetime(check_date: Optional[datetime.datetime | datetime.date | str]) -> Optional[datetime.datetime]:
+    if isinstance(check_date, datetime.date) and not isinstance(check_date, datetime.datetime):
+        return datetime.datetime.combine(check_date, datetime.time.min)
+    return get_datetime(check_date) if check_date else None
+
+
 def sync_e_invoices(
-    check_date: Optional[datetime.datetime | datetime.date] = None, batch_size: int = 100, dry_run: bool = False
-):
+    check_date: Optional[datetime.datetime | datetime.date | str] = None,
+    batch_size: int = 100,
+    dry_run: bool = False,
+    shard: Optional[SyncShard] = None,
+    on_progress: Optional[Callable[[SyncProgress], None]] = None,
+    after_name: Optional[str] = None,
+    deadline: Optional[float] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> SyncProgress:
+    """
+    Sends pending invoices to ZATCA, all of them or those of [shard], created after [check_date] (and after
+    [after_name] if created at [check_date]).
+
+    Reports progress to [on_progress] after every batch, right before the batch is committed. If a [deadline]
+    (time.monotonic()) is given, stops early once the next batch might not finish in time. Also stops early once
+    [should_stop] returns True, which is checked before every batch. The returned progress says whether all invoices
+    were synced
+    """
     prefix = '[Dry run] ' if dry_run else ''
+    if shard:
+        prefix += f'[{shard.key}] '
     logger.info(f'{prefix}Syncing with ZATCA in batches of {batch_size}')
     if check_date:
         logger.info(f'{prefix}Limiting sync to >= date: {check_date}')
@@ -47,50 +393,164 @@ def sync_e_invoices(
     # If we kept the offset at 0, the loop would never terminate in dry_run mode because we never update status.
     #
     # The solution is to use the creation date itself as an offset/filter. We sort by it ascending, so after every
-    # batch we can query for fields whose creation > the last creation in the previous batch
-    if isinstance(check_date, datetime.date):
-        offset = cast(Optional[datetime.datetime], datetime.datetime.combine(check_date, datetime.time.min))
-    else:
-        offset = cast(Optional[datetime.datetime], check_date)
-
+    # batch we can query for fields after the last one in the previous batch. The name breaks ties between fields
+    # created at the same time
+    progress = SyncProgress(last_creation=_to_datetime(check_date), last_name=after_name)
+    group = GroupCommit.from_config()
+    longest_batch = 0.0
     while True:
-        query = build_query(offset, batch_size)
+        if should_stop and should_stop():
+            logger.info(f'{prefix}Stopping as requested after {progress.last_name}')
+            progress.is_complete = False
+            break
+
+        if deadline and time.monotonic() + 2 * longest_batch > deadline:
+            logger.info(f'{prefix}Stopping before the deadline after {progress.last_name}')
+            progress.is_complete = False
+            break
+
+        batch_start = time.monotonic()
+        query = build_query(progress.last_creation, batch_size, shard, progress.last_name)
         additional_field_docs = query.run(as_dict=True)
         if not additional_field_docs:
             break
 
-        logger.info(f'{prefix}Syncing {len(additional_field_docs)} after date/time {offset}')
-        offset = additional_field_docs[-1].creation
+        logger.info(f'{prefix}Syncing {len(additional_field_docs)} after date/time {progress.last_creation}')
+        progress.last_creation = additional_field_docs[-1].creation
+        progress.last_name = additional_field_docs[-1].name
 
-        for doc in additional_field_docs:
-            try:
+        if dry_run:
+            for doc in additional_field_docs:
                 logger.info(f'{prefix}Submitting {doc.name}')
-                if dry_run:
-                    continue
+            continue
 
-                adf_doc = cast(
-                    SalesInvoiceAdditionalFields, frappe.get_doc('Sales Invoice Additional Fields', doc.name)
-                )
-                result = adf_doc.submit_to_zatca()
-                message = result.ok_value if is_ok(result) else result.err_value
-                logger.info(f'{prefix}{doc.name}: {message}')
-                frappe.db.commit()
-            except Exception:
-                logger.error(f'{prefix}Error submitting {doc.name}', exc_info=True)
-                frappe.db.rollback()
+        progress.counts.update(submit_batch([doc.name for doc in additional_field_docs], group))
+        if on_progress:
+            on_progress(progress)
+        # The checkpoint is committed with the group it's part of, or a later one
+        group.commit_if_due()
+        longest_batch = max(longest_batch, time.monotonic() - batch_start)
 
-    logger.info(f'{prefix}Sync Done')
+    if not dry_run:
+        group.commit()
+    logger.info(f'{prefix}Sync Done: {dict(progress.counts)} in {group.commits} commits')
+    return progress
 
 
-def build_query(check_date: Optional[datetime.datetime], limit: int) -> QueryBuilder:
-    batch_status = ['Ready For Batch', 'Resend', 'Corrected']
+def submit_batch(names: List[str], group: GroupCommit) -> Counter:
+    """
+    Sends a batch of sales invoice additional fields to ZATCA concurrently (see [ksa_compliance.submission_engine]).
+    Results are committed in groups (see [ksa_compliance.group_commit]), and each invoice's result is applied under a
+    savepoint, so that a failure only discards that invoice's changes. Returns the number of invoices by result
+    """
+    counts = Counter()
+    docs: Dict[str, SalesInvoiceAdditionalFields] = {}
+    for name in names:
+        try:
+            docs[name] = cast(SalesInvoiceAdditionalFields, frappe.get_doc('Sales Invoice Additional Fields', name))
+        except Exception:
+            logger.error(f'Error loading {name}', exc_info=True)
+            counts['Failed'] += 1
+
+    context = BatchContext.load(docs.values())
+    submissions = []
+    for name, doc in docs.items():
+        try:
+            result = doc.prepare_submission(context)
+            if is_err(result):
+                logger.info(f'{name}: {result.err_value}')
+                counts['Not Sent'] += 1
+                continue
+
+            submissions.append(result.ok_value)
+        except Exception:
+            logger.error(f'Error preparing {name} for submission', exc_info=True)
+            counts['Failed'] += 1
+
+    for submission, response in submission_engine.send_all(submissions):
+        if not response.sent:
+            logger.info(f'{submission.key}: {response.result.err_value.error}')
+            counts['Not Sent'] += 1
+            continue
+
+        try:
+            with group.invoice():
+                integration_status = docs[submission.key].apply_submission_response(response, group)
+            logger.info(f'{submission.key}: Invoice sent to ZATCA. Integration status: {integration_status}')
+            counts[integration_status] += 1
+        except Exception:
+            logger.error(f'Error submitting {submission.key}', exc_info=True)
+            counts['Failed'] += 1
+
+    return counts
+
+
+def build_query(
+    check_date: Optional[datetime.datetime],
+    limit: int,
+    shard: Optional[SyncShard] = None,
+    after_name: Optional[str] = None,
+) -> QueryBuilder:
+    """
+    Selects the next batch of sales invoice additional fields to sync: those created after [check_date] (and after
+    [after_name] if they were created at [check_date]), in (creation, name) order.
+
+    The sync index (docstatus, creation, name, integration_status, next_attempt_at) serves this query without a sort:
+    drafts are read in index order until [limit] of them match, and the status and next attempt are checked from the
+    index itself.
+    """
+    doctype = DocType('Sales Invoice Additional Fields')
+    query = _build_pending_query(doctype, check_date, shard, after_name).select(doctype.name, doctype.creation)
+    query = query.orderby(doctype.creation, order=Order.asc).orderby(doctype.name, order=Order.asc).limit(limit)
+    return query
+
+
+def count_pending(
+    check_date: Optional[datetime.datetime], shard: Optional[SyncShard] = None, after_name: Optional[str] = None
+) -> int:
+    """Returns the number of invoices [build_query] would go through"""
     doctype = DocType('Sales Invoice Additional Fields')
+    return _build_pending_query(doctype, check_date, shard, after_name).select(Count('*')).run()[0][0]
+
+
+def _build_pending_query(
+    doctype: DocType, check_date: Optional[datetime.datetime], shard: Optional[SyncShard], after_name: Optional[str]
+) -> QueryBuilder:
+    batch_status = ['Ready For Batch', 'Resend', 'Corrected']
     query = (
         frappe.qb.from_(doctype)
-        .select(doctype.name, doctype.creation)
         .where((doctype.integration_status.isin(batch_status)) & (doctype.docstatus == 0))
+        .where(doctype.next_attempt_at <= now_datetime())
     )
-    if check_date:
+    if shard:
+        query = query.where(_build_shard_filter(doctype, shard))
+    if check_date and after_name:
+        # Equivalent to (creation, name) > (check_date, after_name). Spelled out because MariaDB doesn't use row
+        # comparisons for index ranges
+        query = query.where(
+            (doctype.creation >= check_date) & ((doctype.creation > check_date) | (doctype.name > after_name))
+        )
+    elif check_date:
         query = query.where(doctype.creation > check_date)
-    query = query.orderby(doctype.creation, order=Order.asc).limit(limit)
     return query
+
+
+def _build_shard_filter(doctype: DocType, shard: SyncShard) -> Criterion:
+    # Sales invoice additional fields don't have a company, so we go through the invoices (or precomputed invoices)
+    if shard.egs:
+        device_id = frappe.db.get_value('ZATCA EGS', shard.egs, 'unit_common_name')
+        precomputed_invoice = DocType('ZATCA Precomputed Invoice')
+        device_invoices = (
+            frappe.qb.from_(precomputed_invoice)
+            .select(precomputed_invoice.name)
+            .where(precomputed_invoice.device_id == device_id)
+        )
+        return (doctype.precomputed == 1) & doctype.precomputed_invoice.isin(device_invoices)
+
+    company = frappe.db.get_value('ZATCA Business Settings', shard.business_settings, 'company')
+    company_invoices = []
+    for invoice_doctype in ('Sales Invoice', 'POS Invoice', 'Payment Entry'):
+        invoice = DocType(invoice_doctype)
+        invoices = frappe.qb.from_(invoice).select(invoice.name).where(invoice.company == company)
+        company_invoices.append((doctype.invoice_doctype == invoice_doctype) & doctype.sales_invoice.isin(invoices))
+    return (doctype.precomputed == 0) & Criterion.any(company_invoices)
@@ -0,0 +1,130 @@
+"""
+Records needed to prepare a batch of invoices for submission to ZATCA, loaded once per batch.
+
+Preparing a single invoice needs its business settings, its source invoice, its customer and, for precomputed invoices,
+its EGS. Loading those one invoice at a time costs several queries per invoice. [BatchContext] loads them for the whole
+batch with one IN query per doctype, and loads each business settings and EGS document only once.
+"""
+
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple, cast
+
+import frappe
+from frappe.model.document import Document
+
+from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import ZATCABusinessSettings
+from ksa_compliance.ksa_compliance.doctype.zatca_egs.zatca_egs import ZATCAEGS
+
+if TYPE_CHECKING:
+    from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields import (
+        SalesInvoiceAdditionalFields,
+    )
+
+
+class BatchContext:
+    def __init__(self):
+        self.invoices: Dict[Tuple[str, str], frappe._dict] = {}
+        """Company and customer of each (invoice doctype, invoice name)"""
+
+        self.settings: Dict[str, ZATCABusinessSettings] = {}
+        """Active business settings by company"""
+
+        self.customers: Dict[str, frappe._dict] = {}
+        """The customer fields needed to decide the invoice type (see is_b2b_customer), by customer name"""
+
+        self.device_ids: Dict[str, str] = {}
+        """Device ID by precomputed invoice"""
+
+        self.egs: Dict[str, ZATCAEGS] = {}
+        """EGS by precomputed invoice"""
+
+        self._passwords: Dict[Tuple[str, str, str], str] = {}
+
+    @staticmethod
+    def load(docs: Iterable['SalesInvoiceAdditionalFields']) -> 'BatchContext':
+        context = BatchContext()
+        docs = list(docs)
+        context._load_invoices(docs)
+        context._load_settings()
+        context._load_customers()
+        context._load_egs([doc.precomputed_invoice for doc in docs if doc.precomputed_invoice])
+        return context
+
+    def get_invoice(self, doctype: str, name: str) -> Optional[frappe._dict]:
+        return self.invoices.get((doctype, name))
+
+    def get_settings(self, doctype: str, name: str) -> Optional[ZATCABusinessSettings]:
+        """The equivalent of [ZATCABusinessSettings.for_invoice]"""
+        invoice = self.get_invoice(doctype, name)
+        return self.settings.get(invoice.company) if invoice else None
+
+    def get_customer(self, name: str) -> Optional[frappe._dict]:
+        return self.customers.get(name)
+
+    def get_egs(self, precomputed_invoice: str) -> Optional[ZATCAEGS]:
+        return self.egs.get(precomputed_invoice)
+
+    def get_password(self, doc: Document, fieldname: str) -> str:
+        key = (doc.doctype, doc.name, fieldname)
+        if key not in self._passwords:
+            self._passwords[key] = doc.get_password(fieldname)
+        return self._passwords[key]
+
+    def _load_invoices(self, docs: List['SalesInvoiceAdditionalFields']) -> None:
+        names_by_doctype: Dict[str, set] = {}
+        for doc in docs:
+            names_by_doctype.setdefault(doc.invoice_doctype, set()).add(doc.sales_invoice)
+
+        for doctype, names in names_by_doctype.items():
+            customer_field = 'party as customer' if doctype == 'Payment Entry' else 'customer'
+            for invoice in frappe.get_all(doctype, {'name': ('in', list(names))}, ['name', 'company', customer_field]):
+                self.invoices[(doctype, invoice.name)] = invoice
+
+    def _load_settings(self) -> None:
+        # Business settings are cached by company (see ZATCABusinessSettings.for_company)
+        companies = {invoice.company for invoice in self.invoices.values() if invoice.company}
+        for company in companies:
+            settings = ZATCABusinessSettings.for_company(company)
+            if settings:
+                self.settings[company] = settings
+
+    def _load_customers(self) -> None:
+        names = list({invoice.customer for invoice in self.invoices.values() if invoice.customer})
+        if not names:
+            return
+
+        for customer in frappe.get_all('Customer', {'name': ('in', names)}, ['name', 'custom_vat_registration_number']):
+            customer.custom_additional_ids = []
+            self.customers[customer.name] = customer
+
+        for additional_id in frappe.get_all(
+            'Additional Buyer IDs',
+            {'parenttype': 'Customer', 'parentfield': 'custom_additional_ids', 'parent': ('in', names)},
+            ['parent', 'type_name', 'type_code', 'value'],
+            order_by='idx',
+        ):
+            if additional_id.parent in self.customers:
+                self.customers[additional_id.parent].custom_additional_ids.append(additional_id)
+
+    def _load_egs(self, precomputed_invoices: List[str]) -> None:
+        if not precomputed_invoices:
+            return
+
+        self.device_ids = dict(
+            frappe.get_all(
+                'ZATCA Precomputed Invoice',
+                {'name': ('in', precomputed_invoices)},
+                ['name', 'device_id'],
+                as_list=True,
+            )
+        )
+        egs_by_device = {
+            egs.unit_common_name: cast(ZATCAEGS, frappe.get_doc('ZATCA EGS', egs.name))
+            for egs in frappe.get_all(
+                'ZATCA EGS',
+                {'unit_common_name': ('in', list(set(self.device_ids.values())))},
+                ['name', 'unit_common_name'],
+            )
+        }
+        for precomputed_invoice, device_id in self.device_ids.items():
+            if device_id in egs_by_device:
+                self.egs[precomputed_invoice] = egs_by_device[device_id]
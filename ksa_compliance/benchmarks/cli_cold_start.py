@@ -0,0 +1,78 @@
+"""
+Measures ZATCA CLI cold-start time with and without JVM tuning (see [ksa_compliance.zatca_cli_jvm]).
+
+Usage:
+    bench --site <site> execute ksa_compliance.benchmarks.cli_cold_start.execute \
+        --kwargs "{'zatca_cli_path': '/path/to/zatca-cli/bin/zatca-cli', 'java_home': '/path/to/jre', 'runs': 10}"
+
+Each configuration runs 'zatca-cli -v' [runs] times after one warm-up run (to take the OS file cache out of the
+picture) and reports the median, p90 and min wall time.
+"""
+
+import os
+import shlex
+import statistics
+import subprocess
+import time
+from typing import List, Optional
+
+from ksa_compliance.zatca_cli_jvm import (
+    ONE_SHOT_JVM_OPTIONS,
+    SMALL_COMMAND_JVM_OPTIONS,
+    generate_cds_archive,
+    get_cds_archive_path,
+)
+
+
+def execute(zatca_cli_path: str, java_home: Optional[str] = None, runs: int = 10) -> None:
+    archive = get_cds_archive_path(zatca_cli_path)
+    if not os.path.isfile(archive):
+        print(f'Generating class data sharing archive: {archive}')
+        result = generate_cds_archive(zatca_cli_path, java_home)
+        if result.is_err():
+            print(f'Failed: {result.err_value}')
+
+    # 'zatca-cli -v' runs with the same flags as signing
+    tuned_flags = ONE_SHOT_JVM_OPTIONS + SMALL_COMMAND_JVM_OPTIONS
+    configurations = {
+        'baseline': [],
+        'tuned flags': tuned_flags,
+        'CDS archive': ['-Xshare:on', f'-XX:SharedArchiveFile={archive}'],
+        'tuned flags + CDS archive': tuned_flags + ['-Xshare:on', f'-XX:SharedArchiveFile={archive}'],
+    }
+
+    print(f'{"configuration":<28}{"median (ms)":>14}{"p90 (ms)":>12}{"min (ms)":>12}')
+    baseline = None
+    for name, options in configurations.items():
+        timings = _measure(zatca_cli_path, java_home, options, runs)
+        if timings is None:
+            print(f'{name:<28}{"failed":>14}')
+            continue
+
+        median = statistics.median(timings)
+        p90 = sorted(timings)[max(0, int(len(timings) * 0.9) - 1)]
+        baseline = baseline or median
+        speedup = f'  ({baseline / median:.2f}x)' if name != 'baseline' else ''
+        print(f'{name:<28}{median:>14.0f}{p90:>12.0f}{min(timings):>12.0f}{speedup}')
+
+
+def _measure(zatca_cli_path: str, java_home: Optional[str], options: List[str], runs: int) -> Optional[List[float]]:
+    env = os.environ.copy()
+    env.pop('JAVA_TOOL_OPTIONS', None)
+    if java_home:
+        env['JAVA_HOME'] = java_home
+    if options:
+        env['JAVA_TOOL_OPTIONS'] = shlex.join(options)
+
+    timings = []
+    for i in range(runs + 1):
+        start = time.perf_counter()
+        proc = subprocess.run([zatca_cli_path, '-v'], capture_output=True, env=env)
+        elapsed = (time.perf_counter() - start) * 1000
+        if proc.returncode != 0:
+            # -Xshare:on fails loudly if the archive can't be used, which is what we want to know here
+            print(proc.stderr.decode('utf-8', errors='replace'))
+            return None
+        if i > 0:
+            timings.append(elapsed)
+    return timings
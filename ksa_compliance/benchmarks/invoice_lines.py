@@ -0,0 +1,94 @@
+"""
+Measures building the lines and tax totals of large invoices (see [ksa_compliance.output_models.line_items]).
+
+Usage:
+    bench --site <site> execute ksa_compliance.benchmarks.invoice_lines.execute \
+        --kwargs "{'taxes_and_charges': 'KSA VAT 15% - C', 'item_tax_templates': ['KSA VAT Zero - C']}"
+
+Builds unsaved sales invoices of 10, 1,000 and 10,000 lines (or [sizes]) in memory, and times each step of turning
+their items into invoice lines the way [ksa_compliance.output_models.e_invoice_output_model.Einvoice] does:
+1. Appending the items to the lines
+2. Resolving the tax category of every line ([create_tax_categories])
+3. Totaling the lines per tax category ([create_tax_total])
+4. Reading every field of every line, the way the invoice XML template does
+
+Lines are spread over [taxes_and_charges] and [item_tax_templates], which must exist on the site. With no item tax
+templates, every line uses the invoice's template. Nothing is written to the database.
+"""
+
+import random
+import statistics
+import time
+from typing import Callable, List, Optional, Sequence
+
+import frappe
+from frappe.model.document import Document
+
+from ksa_compliance.output_models.line_items import LINE_COLUMNS, LineItems
+from ksa_compliance.output_models.tax import create_tax_categories, create_tax_total
+
+STEPS = ('append', 'tax categories', 'tax total', 'read')
+
+
+def execute(
+    taxes_and_charges: str,
+    item_tax_templates: Optional[List[str]] = None,
+    sizes: Sequence[int] = (10, 1_000, 10_000),
+    repeat: int = 5,
+    seed: int = 42,
+):
+    rng = random.Random(seed)
+    print(f'{"lines":>8}' + ''.join(f'{step + " (ms)":>22}' for step in STEPS))
+    for size in sizes:
+        doc = _make_invoice(size, taxes_and_charges, item_tax_templates or [], rng)
+        timings = {step: [] for step in STEPS}
+        for _ in range(repeat):
+            item_lines = LineItems()
+            _time(timings['append'], lambda: item_lines.append_sales_invoice_items(doc.items, False))
+            tax_categories = _time(timings['tax categories'], lambda: create_tax_categories(doc, item_lines, False))
+            _time(timings['tax total'], lambda: create_tax_total(tax_categories, item_lines))
+            _time(timings['read'], lambda: _read(item_lines))
+
+        print(f'{size:>8,}' + ''.join(f'{statistics.median(timings[step]):>22.2f}' for step in STEPS))
+
+
+def _make_invoice(size: int, taxes_and_charges: str, item_tax_templates: List[str], rng: random.Random) -> Document:
+    doc = frappe.new_doc('Sales Invoice')
+    doc.taxes_and_charges = taxes_and_charges
+    for idx in range(1, size + 1):
+        qty = float(rng.randint(1, 20))
+        rate = round(rng.uniform(1, 500), 2)
+        discount_amount = round(rate * 0.1, 2) if rng.random() < 0.2 else 0.0
+        net_amount = round((rate - discount_amount) * qty, 2)
+        doc.append(
+            'items',
+            {
+                'item_code': f'BENCH-{idx}',
+                'item_name': f'Bench Item {idx}',
+                'uom': 'Nos',
+                'qty': qty,
+                'rate': rate,
+                'amount': net_amount,
+                'net_amount': net_amount,
+                'discount_amount': discount_amount,
+                'discount_percentage': 10.0 if discount_amount else 0.0,
+                'tax_rate': 15.0,
+                'tax_amount': round(net_amount * 0.15, 2),
+                'item_tax_template': rng.choice([None, *item_tax_templates]) if item_tax_templates else None,
+            },
+        )
+    return doc
+
+
+def _read(item_lines: LineItems) -> None:
+    for line in item_lines:
+        for column in LINE_COLUMNS:
+            line[column]
+        line.tax_category
+
+
+def _time(timings: List[float], fn: Callable):
+    start = time.perf_counter()
+    result = fn()
+    timings.append((time.perf_counter() - start) * 1000)
+    return result
@@ -0,0 +1,100 @@
+"""
+Measures end-to-end submission throughput against the Fatoora simulator (see [ksa_compliance.fatoora_simulator]).
+
+Usage:
+    bench --site <site> execute ksa_compliance.benchmarks.submission_load.execute \
+        --kwargs "{'invoices': 2000, 'groups': 2, 'concurrency': 8, 'latency_ms': 150}"
+
+Starts the simulator in-process with the given latency and failure rates, unless [server] is set to a running one
+(e.g. one started by 'bench zatca-simulator'). Then sends [invoices] invoices through the same path as the batch sync
+([ksa_compliance.submission_engine.send_all]), including the gateway's rate limiter and circuit breaker, spread over
+[groups] business settings with [concurrency] calls in flight each. Reports throughput and the responses by status
+code.
+
+The rate limiter and circuit breaker state is shared through Redis, so a run against a real site's ZATCA server URL
+would affect its live submissions. Only point [server] to a simulator.
+"""
+
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import List, Optional
+
+from ksa_compliance import submission_engine
+from ksa_compliance.fatoora_simulator import FatooraSimulator, SimulatorConfig
+from ksa_compliance.zatca_api import ZatcaSendMode
+
+INVOICE_XML = '<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2">{}</Invoice>'
+
+
+def execute(
+    invoices: int = 1000,
+    groups: int = 1,
+    concurrency: int = 4,
+    standard_ratio: float = 0.5,
+    server: Optional[str] = None,
+    latency_ms: float = 100,
+    rejection_rate: float = 0.0,
+    warning_rate: float = 0.0,
+    error_rate: float = 0.0,
+    throttle_rate: float = 0.0,
+    rate_limit: float = 0.0,
+    seed: int = 42,
+):
+    simulator = None
+    if not server:
+        config = SimulatorConfig(latency_ms, rejection_rate, warning_rate, error_rate, throttle_rate, rate_limit, seed)
+        simulator = FatooraSimulator(('127.0.0.1', 0), config)
+        threading.Thread(target=simulator.serve_forever, daemon=True).start()
+        server = simulator.url
+        print(f'Simulating the ZATCA gateway on {server} with {config}')
+
+    try:
+        submissions = _make_submissions(server, invoices, groups, concurrency, standard_ratio, random.Random(seed))
+        status_codes = Counter()
+        not_sent = 0
+        start = time.perf_counter()
+        for _, response in submission_engine.send_all(submissions):
+            if response.sent:
+                status_codes[response.status_code] += 1
+            else:
+                not_sent += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        if simulator:
+            simulator.shutdown()
+            simulator.server_close()
+
+    sent = sum(status_codes.values())
+    print(f'Sent {sent:,} invoices in {elapsed:.1f}s: {sent / elapsed:.1f} invoices per second')
+    print(f'Held back by the rate limiter/circuit breaker: {not_sent:,}')
+    for status_code, count in sorted(status_codes.items()):
+        print(f'    {status_code}: {count:,}')
+
+
+def _make_submissions(
+    server: str, invoices: int, groups: int, concurrency: int, standard_ratio: float, rng: random.Random
+) -> List[submission_engine.Submission]:
+    submissions = []
+    for i in range(invoices):
+        group = f'Load Test {i % groups}'
+        invoice_uuid = str(uuid.UUID(int=rng.getrandbits(128)))
+        submissions.append(
+            submission_engine.Submission(
+                key=f'load-test-{i}',
+                group=group,
+                concurrency=concurrency,
+                server_url=server,
+                invoice_xml=INVOICE_XML.format(invoice_uuid),
+                invoice_uuid=invoice_uuid,
+                invoice_hash=uuid.UUID(int=rng.getrandbits(128)).hex,
+                invoice_type='Standard' if rng.random() < standard_ratio else 'Simplified',
+                # Each group has its own credentials, hence its own rate limit
+                security_token=group,
+                secret='secret',
+                mode=ZatcaSendMode.Production,
+            )
+        )
+    return submissions
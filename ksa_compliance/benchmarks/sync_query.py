@@ -0,0 +1,119 @@
+"""
+Measures the batch sync query (see [ksa_compliance.background_jobs.build_query]) on a synthetic table.
+
+Usage:
+    bench --site <site> execute ksa_compliance.benchmarks.sync_query.execute \
+        --kwargs "{'rows': 5000000, 'pending_ratio': 0.01}"
+
+Creates a scratch table with the sales invoice additional fields columns the query uses, and fills it with [rows]
+rows. [pending_ratio] of them are pending drafts and the rest are submitted. Then it pages through the pending rows
+the way the sync does, and reports the query plan and per-page timings for:
+1. The query before the sync index: offset by creation only, with no index
+2. The same query with the sync index
+3. The keyset (creation, name) query with the sync index, which is what the sync runs now
+
+MariaDB only. The table is dropped at the end unless [keep] is set.
+"""
+
+import statistics
+import time
+from typing import List
+
+import frappe
+
+TABLE = '_zatca_bench_siaf'
+INDEX = 'lava_bench_siaf_sync'
+CHUNK_SIZE = 100_000
+BATCH_STATUS = "('Ready For Batch', 'Resend', 'Corrected')"
+
+OFFSET_QUERY = f"""
+    SELECT name, creation FROM `{TABLE}`
+    WHERE integration_status IN {BATCH_STATUS} AND docstatus = 0 AND next_attempt_at <= NOW()
+        AND creation > %(creation)s
+    ORDER BY creation LIMIT %(limit)s
+"""
+
+KEYSET_QUERY = f"""
+    SELECT name, creation FROM `{TABLE}`
+    WHERE integration_status IN {BATCH_STATUS} AND docstatus = 0 AND next_attempt_at <= NOW()
+        AND creation >= %(creation)s AND (creation > %(creation)s OR name > %(name)s)
+    ORDER BY creation, name LIMIT %(limit)s
+"""
+
+
+def execute(
+    rows: int = 5_000_000, pending_ratio: float = 0.01, batch_size: int = 100, pages: int = 50, keep: bool = False
+):
+    if frappe.db.db_type != 'mariadb':
+        print('This benchmark only supports MariaDB')
+        return
+
+    _create_table(rows, pending_ratio)
+    try:
+        print(f'{"query":<32}{"median (ms)":>14}{"p90 (ms)":>12}{"max (ms)":>12}')
+        _run('offset, no index', OFFSET_QUERY, batch_size, pages)
+        print(f'Creating sync index on {rows:,} rows')
+        frappe.db.sql(
+            f'CREATE INDEX {INDEX} ON `{TABLE}` (docstatus, creation, name, integration_status, next_attempt_at)'
+        )
+        _run('offset, sync index', OFFSET_QUERY, batch_size, pages)
+        _run('keyset, sync index', KEYSET_QUERY, batch_size, pages)
+    finally:
+        if not keep:
+            frappe.db.sql_ddl(f'DROP TABLE IF EXISTS `{TABLE}`')
+
+
+def _create_table(rows: int, pending_ratio: float) -> None:
+    frappe.db.sql_ddl(f'DROP TABLE IF EXISTS `{TABLE}`')
+    frappe.db.sql_ddl(f"""
+        CREATE TABLE `{TABLE}` (
+            name VARCHAR(140) NOT NULL PRIMARY KEY,
+            creation DATETIME(6),
+            docstatus INT NOT NULL DEFAULT 0,
+            integration_status VARCHAR(140),
+            next_attempt_at DATETIME(6),
+            invoice_xml LONGTEXT
+        ) ENGINE=InnoDB
+    """)
+
+    # Rows are six seconds apart, so 5M rows span about a year. Every row gets a small XML so that rows aren't
+    # unrealistically narrow. seq_<from>_to_<to> is MariaDB's sequence engine
+    start = time.perf_counter()
+    for offset in range(0, rows, CHUNK_SIZE):
+        frappe.db.sql(
+            f"""
+            INSERT INTO `{TABLE}` (name, creation, docstatus, integration_status, next_attempt_at, invoice_xml)
+            SELECT
+                CONCAT('SIAF-', LPAD(seq, 10, '0')),
+                TIMESTAMP('2025-01-01') + INTERVAL seq * 6 SECOND,
+                IF(RAND(seq) < %(pending_ratio)s, 0, 1),
+                IF(RAND(seq) < %(pending_ratio)s, ELT(1 + seq %% 3, 'Ready For Batch', 'Resend', 'Corrected'), 'Accepted'),
+                IF(RAND(seq) < %(pending_ratio)s, TIMESTAMP('2025-01-01') + INTERVAL seq * 6 SECOND, NULL),
+                REPEAT('x', 2000)
+            FROM seq_{offset}_to_{min(rows, offset + CHUNK_SIZE) - 1}
+            """,
+            {'pending_ratio': pending_ratio},
+        )
+        frappe.db.commit()
+    frappe.db.sql_ddl(f'ANALYZE TABLE `{TABLE}`')
+
+    pending = frappe.db.sql(f'SELECT COUNT(*) FROM `{TABLE}` WHERE docstatus = 0')[0][0]
+    print(f'Created {rows:,} rows ({pending:,} pending) in {time.perf_counter() - start:.0f}s')
+
+
+def _run(label: str, query: str, batch_size: int, pages: int) -> None:
+    params = {'creation': '2024-01-01', 'name': '', 'limit': batch_size}
+    plan = frappe.db.sql(f'EXPLAIN {query}', params, as_dict=True)
+    timings: List[float] = []
+    for _ in range(pages):
+        start = time.perf_counter()
+        result = frappe.db.sql(query, params, as_dict=True)
+        timings.append((time.perf_counter() - start) * 1000)
+        if not result:
+            break
+        params['creation'], params['name'] = result[-1].creation, result[-1].name
+
+    p90 = sorted(timings)[max(0, int(len(timings) * 0.9) - 1)]
+    print(f'{label:<32}{statistics.median(timings):>14.1f}{p90:>12.1f}{max(timings):>12.1f}')
+    for step in plan:
+        print(f'    key={step.key} rows={step.rows} type={step.type} extra={step.Extra}')
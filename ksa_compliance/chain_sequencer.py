@@ -0,0 +1,126 @@
+"""
+Hands out positions in an invoice chain (invoice counter and previous invoice hash) while holding the chain's lock for
+as little as possible.
+
+Every invoice embeds its counter (ICV) and the hash of the invoice before it (PIH), so taking a position must be
+serialized to keep the chain gap-free. That's done by locking the chain's 'ZATCA Invoice Counting Settings' row
+(SELECT ... FOR UPDATE), and the lock is held until the transaction commits. Anything done after taking the lock
+holds up every other submission on the same chain.
+
+Invoices therefore go through a pipeline, where only the last step runs under the lock:
+1. Build: read the chain head without locking ([peek]) and build the invoice XML for the next position
+2. Sign (and validate) the XML
+3. Hand-off ([hand_off]): lock the chain and read the head again. If nobody took the position meanwhile, the signed
+   invoice is used as is. Otherwise, its ICV and PIH are moved to the actual next position and it's signed again,
+   still under the lock. Then the head is moved to the invoice
+
+The head is published to the cache once the hand-off commits, so that [peek] sees the latest committed head rather
+than the (possibly older) snapshot of the current transaction. A rolled back hand-off never reaches the cache, and
+the counter only moves in the database along with the invoice, so there are no gaps. A stale cached head is harmless
+as well: it costs the next submission a re-sign, whose hand-off publishes the right head again.
+
+A re-sign under the lock only happens when two submissions on the same chain race. With the native signer it costs
+a few milliseconds. With the CLI signer it costs a CLI invocation, which is what every submission used to cost.
+"""
+
+from dataclasses import astuple, dataclass
+from typing import Callable, Optional, Tuple
+
+import frappe
+
+from ksa_compliance import logger
+from ksa_compliance import zatca_signer
+from ksa_compliance.zatca_cli import SigningResult
+
+CHAIN_HEAD_CACHE_KEY = 'zatca_invoice_chain_head'
+
+
+@dataclass(frozen=True)
+class ChainHead:
+    """The last invoice of a chain. The next invoice takes [invoice_counter] + 1 and embeds [invoice_hash] as PIH"""
+
+    counting_settings_id: str
+    invoice_counter: int
+    invoice_hash: str
+
+    @property
+    def next_counter(self) -> int:
+        return self.invoice_counter + 1
+
+
+@dataclass(frozen=True)
+class PresignedInvoice:
+    """
+    An invoice built and signed ahead of its hand-off, e.g. as part of a chain signed in one go by the signing outbox.
+    The hand-off signs it again if the chain isn't at [expected_head] anymore
+    """
+
+    expected_head: ChainHead
+    invoice_xml: str
+    """The unsigned invoice XML, built for the position after [expected_head]"""
+
+    result: SigningResult
+
+
+def peek(business_settings_id: str) -> ChainHead:
+    """Returns the chain head without locking it. It may be taken by the time of [hand_off]"""
+    cached = frappe.cache.hget(CHAIN_HEAD_CACHE_KEY, business_settings_id)
+    if cached:
+        return ChainHead(*cached)
+
+    return _read_head(business_settings_id, for_update=False)
+
+
+def hand_off(
+    business_settings_id: str,
+    expected: ChainHead,
+    invoice_xml: str,
+    result: SigningResult,
+    sign: Callable[[str], SigningResult],
+) -> Tuple[ChainHead, SigningResult]:
+    """
+    Locks the chain and appends an invoice to it. [invoice_xml] is the unsigned invoice built for the position after
+    [expected], and [result] is its signing result.
+
+    Returns the head the invoice was appended to, and the signing result to use: [result] if the chain was still at
+    [expected], or the result of signing [invoice_xml] again at the actual next position otherwise. The lock is held
+    until the transaction commits
+    """
+    head = _read_head(business_settings_id, for_update=True)
+    if head != expected:
+        logger.info(
+            f'Invoice chain {business_settings_id} moved from {expected.invoice_counter} to {head.invoice_counter} '
+            f'while signing, signing again'
+        )
+        result = sign(zatca_signer.set_chain_position(invoice_xml, head.next_counter, head.invoice_hash))
+
+    new_head = ChainHead(head.counting_settings_id, head.next_counter, result.invoice_hash)
+    frappe.db.set_value(
+        'ZATCA Invoice Counting Settings',
+        head.counting_settings_id,
+        {'invoice_counter': new_head.invoice_counter, 'previous_invoice_hash': new_head.invoice_hash},
+    )
+    frappe.db.after_commit.add(lambda: _publish_head(business_settings_id, new_head))
+    return head, result
+
+
+def clear_cache(business_settings_id: Optional[str] = None) -> None:
+    """Drops the cached chain head, e.g. after the counting settings are changed by hand"""
+    if business_settings_id:
+        frappe.cache.hdel(CHAIN_HEAD_CACHE_KEY, business_settings_id)
+    else:
+        frappe.cache.delete_value(CHAIN_HEAD_CACHE_KEY)
+
+
+def _read_head(business_settings_id: str, for_update: bool) -> ChainHead:
+    counting_settings_id, invoice_counter, invoice_hash = frappe.db.get_values(
+        'ZATCA Invoice Counting Settings',
+        {'business_settings_reference': business_settings_id},
+        ['name', 'invoice_counter', 'previous_invoice_hash'],
+        for_update=for_update,
+    )[0]
+    return ChainHead(counting_settings_id, invoice_counter, invoice_hash)
+
+
+def _publish_head(business_settings_id: str, head: ChainHead) -> None:
+    frappe.cache.hset(CHAIN_HEAD_CACHE_KEY, business_settings_id, astuple(head))
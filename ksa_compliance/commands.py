@@ -0,0 +1,30 @@
+import click
+
+
+@click.command('zatca-simulator')
+@click.option('--host', default='127.0.0.1', help='Address to listen on')
+@click.option('--port', default=8280, type=int, help='Port to listen on')
+@click.option('--latency-ms', default=100.0, type=float, help='Mean response time in milliseconds')
+@click.option('--rejection-rate', default=0.0, type=float, help='Share of invoices rejected (400)')
+@click.option('--warning-rate', default=0.0, type=float, help='Share of invoices accepted with warnings (202)')
+@click.option('--error-rate', default=0.0, type=float, help='Share of requests failing with a server error (500)')
+@click.option('--throttle-rate', default=0.0, type=float, help='Share of requests throttled at random (429)')
+@click.option('--rate-limit', default=0.0, type=float, help='Requests per second above which requests get 429')
+@click.option('--seed', type=int, help='Random seed, for repeatable runs')
+def zatca_simulator(host, port, latency_ms, rejection_rate, warning_rate, error_rate, throttle_rate, rate_limit, seed):
+    """Run a local stand-in for the ZATCA gateway, for load testing"""
+    from ksa_compliance.fatoora_simulator import SimulatorConfig, serve
+
+    config = SimulatorConfig(
+        latency_ms=latency_ms,
+        rejection_rate=rejection_rate,
+        warning_rate=warning_rate,
+        error_rate=error_rate,
+        throttle_rate=throttle_rate,
+        rate_limit=rate_limit,
+        seed=seed,
+    )
+    serve(host, port, config)
+
+
+commands = [zatca_simulator]
@@ -0,0 +1,210 @@
+"""
+Rate limiting and circuit breaking for reporting/clearance calls to the Fatoora gateway.
+
+* A token bucket per server and credential limits the request rate. The rate adapts: it's halved whenever ZATCA
+  answers with 429 (too many requests), and grows back gradually with successful calls
+* A circuit breaker per server opens after consecutive failures (connection errors, 429 and 5xx). While it's open,
+  invoices aren't sent at all. Once the cooldown passes, a single request at a time is let through to probe the
+  gateway; its success closes the breaker and its failure opens it for another cooldown
+
+The state lives in Redis (the site cache), so it's shared by all workers. Updates are Lua scripts, so they're atomic.
+If Redis is unavailable, calls go through as if there were no limits.
+
+Both can be tuned in site config, e.g. "zatca_rate_limit": {"rate": 10, "burst": 20} and
+"zatca_circuit_breaker": {"failure_threshold": 10, "cooldown": 60}. A rate or failure threshold of 0 disables them.
+"""
+
+import hashlib
+import time
+from typing import Optional
+
+import frappe
+from result import Err, Ok, Result
+
+from ksa_compliance import logger
+from ksa_compliance.zatca_api import CONNECT_TIMEOUT, READ_TIMEOUT
+
+# Requests per second
+DEFAULT_RATE_LIMIT = {'rate': 20.0, 'burst': 40, 'min_rate': 1.0, 'rate_increase': 0.5}
+DEFAULT_CIRCUIT_BREAKER = {'failure_threshold': 5, 'cooldown': 30}
+
+# The longest a request waits for the rate limiter before giving up
+MAX_WAIT_SECONDS = 30
+
+# A probe that never reports back (e.g. its worker was killed) blocks other probes until it expires
+PROBE_TIMEOUT_SECONDS = CONNECT_TIMEOUT + READ_TIMEOUT
+
+# Gateway state of servers/credentials that are no longer used expires
+STATE_TTL_SECONDS = 24 * 60 * 60
+
+# Returns the number of seconds to wait before retrying, or 0 if a token was taken
+TAKE_TOKEN_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at', 'rate')
+local burst = tonumber(ARGV[2])
+local rate = tonumber(bucket[3]) or tonumber(ARGV[1])
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now), 'rate', tostring(rate))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+return tostring(wait)
+"""
+
+# Halves the rate and drops the remaining tokens on 429, otherwise increases the rate by a step. Returns the new rate
+ADJUST_RATE_SCRIPT = """
+local max_rate = tonumber(ARGV[2])
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or max_rate
+if ARGV[1] == 'decrease' then
+    rate = math.max(tonumber(ARGV[3]), rate / 2)
+    redis.call('HSET', KEYS[1], 'rate', tostring(rate), 'tokens', '0')
+else
+    rate = math.min(max_rate, rate + tonumber(ARGV[4]))
+    redis.call('HSET', KEYS[1], 'rate', tostring(rate))
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[5]))
+return tostring(rate)
+"""
+
+# Returns 1 if the breaker is closed, 2 if the caller should probe the gateway (half-open) and 0 if it's open
+ALLOW_SCRIPT = """
+local breaker = redis.call('HMGET', KEYS[1], 'state', 'opened_at')
+if breaker[1] ~= 'open' then
+    return 1
+end
+local time = redis.call('TIME')
+if tonumber(time[1]) - tonumber(breaker[2]) < tonumber(ARGV[1]) then
+    return 0
+end
+if redis.call('SET', KEYS[2], '1', 'NX', 'EX', tonumber(ARGV[2])) then
+    return 2
+end
+return 0
+"""
+
+# Records the outcome of a call. Returns the breaker state afterwards
+RECORD_SCRIPT = """
+if ARGV[1] == '1' then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return 'closed'
+end
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+local state = redis.call('HGET', KEYS[1], 'state')
+if state == 'open' or failures >= tonumber(ARGV[2]) then
+    local time = redis.call('TIME')
+    redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', time[1])
+    redis.call('DEL', KEYS[2])
+    state = 'open'
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+return state or 'closed'
+"""
+
+
+def acquire(server_url: str, security_token: str) -> Result[None, str]:
+    """
+    Waits until a call to [server_url] with [security_token] is allowed. Returns an error if the circuit breaker is
+    open or the rate limiter would make the call wait too long; the call shouldn't be made in that case
+    """
+    rate_limit = _get_config('zatca_rate_limit', DEFAULT_RATE_LIMIT)
+    circuit_breaker = _get_config('zatca_circuit_breaker', DEFAULT_CIRCUIT_BREAKER)
+    try:
+        if circuit_breaker['failure_threshold'] > 0:
+            allowed = _run(
+                ALLOW_SCRIPT,
+                [_breaker_key(server_url), _probe_key(server_url)],
+                [circuit_breaker['cooldown'], PROBE_TIMEOUT_SECONDS],
+            )
+            if not int(allowed):
+                return Err(f'ZATCA server {server_url} is unavailable. Sending is paused until it recovers')
+            if int(allowed) == 2:
+                logger.info(f'Probing ZATCA server {server_url}')
+
+        if rate_limit['rate'] <= 0:
+            return Ok(None)
+
+        deadline = time.monotonic() + MAX_WAIT_SECONDS
+        while True:
+            wait = float(
+                _run(
+                    TAKE_TOKEN_SCRIPT,
+                    [_bucket_key(server_url, security_token)],
+                    [rate_limit['rate'], rate_limit['burst'], STATE_TTL_SECONDS],
+                )
+            )
+            if wait <= 0:
+                return Ok(None)
+            if time.monotonic() + wait > deadline:
+                return Err(f'Rate limit for ZATCA server {server_url} exceeded')
+            time.sleep(wait)
+    except Exception:
+        logger.warning('Could not check ZATCA rate limit/circuit breaker, sending anyway', exc_info=True)
+        return Ok(None)
+
+
+def record(server_url: str, security_token: str, status_code: int) -> None:
+    """Records the outcome of a call that was allowed by [acquire]"""
+    rate_limit = _get_config('zatca_rate_limit', DEFAULT_RATE_LIMIT)
+    circuit_breaker = _get_config('zatca_circuit_breaker', DEFAULT_CIRCUIT_BREAKER)
+    try:
+        if circuit_breaker['failure_threshold'] > 0:
+            state = _run(
+                RECORD_SCRIPT,
+                [_breaker_key(server_url), _probe_key(server_url)],
+                [0 if is_gateway_failure(status_code) else 1, circuit_breaker['failure_threshold'], STATE_TTL_SECONDS],
+            )
+            if state == 'open':
+                logger.warning(f'Circuit breaker for ZATCA server {server_url} is open (status code {status_code})')
+
+        if rate_limit['rate'] > 0 and (status_code == 429 or not is_gateway_failure(status_code)):
+            rate = _run(
+                ADJUST_RATE_SCRIPT,
+                [_bucket_key(server_url, security_token)],
+                [
+                    'decrease' if status_code == 429 else 'increase',
+                    rate_limit['rate'],
+                    rate_limit['min_rate'],
+                    rate_limit['rate_increase'],
+                    STATE_TTL_SECONDS,
+                ],
+            )
+            if status_code == 429:
+                logger.warning(f'ZATCA server {server_url} is throttling requests. Rate reduced to {float(rate)}/s')
+    except Exception:
+        logger.warning('Could not update ZATCA rate limit/circuit breaker', exc_info=True)
+
+
+def is_gateway_failure(status_code: int) -> bool:
+    """Whether a status code means the gateway is unavailable or overloaded, as opposed to an answer about the invoice.
+    Status code 0 means no response"""
+    return status_code == 0 or status_code == 429 or status_code >= 500
+
+
+def _get_config(key: str, default: dict) -> dict:
+    return {**default, **(frappe.conf.get(key) or {})}
+
+
+def _run(script: str, keys: list, args: list) -> Optional[str | int]:
+    result = frappe.cache.register_script(script)(keys=[frappe.cache.make_key(key) for key in keys], args=args)
+    return result.decode() if isinstance(result, bytes) else result
+
+
+def _bucket_key(server_url: str, security_token: str) -> str:
+    # The token identifies the credential without putting it in Redis
+    credential = hashlib.sha256(security_token.encode()).hexdigest()[:16]
+    return f'zatca_gateway:bucket:{server_url}:{credential}'
+
+
+def _breaker_key(server_url: str) -> str:
+    return f'zatca_gateway:breaker:{server_url}'
+
+
+def _probe_key(server_url: str) -> str:
+    return f'zatca_gateway:probe:{server_url}'
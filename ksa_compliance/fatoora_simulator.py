@@ -0,0 +1,218 @@
+"""
+A local stand-in for the ZATCA (Fatoora) gateway, for load testing submission without the ZATCA sandbox.
+
+Run it with:
+    bench zatca-simulator --port 8280 --latency-ms 150 --rejection-rate 0.02 --throttle-rate 0.01
+
+and point a business settings (or the load generator, see [ksa_compliance.benchmarks.submission_load]) to
+http://localhost:8280/.
+
+Implements the endpoints [ksa_compliance.zatca_api] calls:
+- compliance: compliance CSID
+- production/csids: production CSID
+- compliance/invoices: compliance checks
+- invoices/reporting/single: reporting (simplified invoices)
+- invoices/clearance/single: clearance (standard invoices)
+
+Invoices aren't validated. Each request gets a response picked at random according to the configured rates: 429 (too
+many requests), 500 (server error), 400 with validation errors, 202 with validation warnings, or 200. Responses use
+the 'validationResults' shape ZATCA returns in practice (see [ReportOrClearInvoiceResult.from_json]). A request rate
+limit can be set as well, above which requests get 429 like ZATCA's throttling.
+"""
+
+import base64
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+PASS_MESSAGE = {
+    'type': 'INFO',
+    'code': 'XSD_ZATCA_VALID',
+    'category': 'XSD validation',
+    'message': 'Complied with UBL 2.1 standards in line with ZATCA specifications',
+    'status': 'PASS',
+}
+
+WARNING_MESSAGE = {
+    'type': 'WARNING',
+    'code': 'BR-KSA-08',
+    'category': 'KSA',
+    'message': 'The seller identification must exist only once with one of the scheme ID',
+    'status': 'WARNING',
+}
+
+ERROR_MESSAGE = {
+    'type': 'ERROR',
+    'code': 'BR-KSA-37',
+    'category': 'KSA',
+    'message': 'The seller address building number must contain 4 digits',
+    'status': 'ERROR',
+}
+
+
+@dataclass
+class SimulatorConfig:
+    latency_ms: float = 100
+    """Mean response time. Each response takes between half and one and a half of it"""
+
+    rejection_rate: float = 0.0
+    """Share of invoices rejected with validation errors (400)"""
+
+    warning_rate: float = 0.0
+    """Share of invoices accepted with validation warnings (202)"""
+
+    error_rate: float = 0.0
+    """Share of requests that fail with a server error (500)"""
+
+    throttle_rate: float = 0.0
+    """Share of requests throttled at random (429)"""
+
+    rate_limit: float = 0.0
+    """Requests per second above which requests are throttled (429). 0 for no limit"""
+
+    seed: Optional[int] = None
+
+
+class FatooraSimulator(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], config: SimulatorConfig):
+        super().__init__(address, _RequestHandler)
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self._tokens = config.rate_limit
+        self._refilled_at = time.monotonic()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def draw(self) -> Tuple[float, float]:
+        """Returns a random number to pick the response and the response's latency in seconds"""
+        with self.lock:
+            self.requests += 1
+            latency = self.config.latency_ms * self.random.uniform(0.5, 1.5) / 1000
+            return self.random.random(), latency
+
+    def is_over_rate_limit(self) -> bool:
+        if not self.config.rate_limit:
+            return False
+
+        with self.lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.config.rate_limit, self._tokens + (now - self._refilled_at) * self.config.rate_limit
+            )
+            self._refilled_at = now
+            if self._tokens < 1:
+                return True
+            self._tokens -= 1
+            return False
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    server: FatooraSimulator
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self._read_body()
+        pick, latency = self.server.draw()
+        time.sleep(latency)
+
+        path = self.path.strip('/')
+        if path in ('compliance', 'production/csids'):
+            return self._csid(path)
+        if path not in ('compliance/invoices', 'invoices/reporting/single', 'invoices/clearance/single'):
+            return self._send(404, {'message': f'Unknown path: {self.path}'})
+        if not self.headers.get('Authorization', '').startswith('Basic '):
+            return self._send(401, {'message': 'Unauthorized'})
+
+        config = self.server.config
+        if self.server.is_over_rate_limit():
+            return self._send(429, {'message': 'Too Many Requests'})
+
+        # Pick a response by walking the cumulative rates
+        for status_code, rate in ((429, config.throttle_rate), (500, config.error_rate)):
+            if pick < rate:
+                return self._send(status_code, {'message': 'Simulated failure', 'code': str(status_code)})
+            pick -= rate
+
+        is_clearance = path == 'invoices/clearance/single' or (
+            path == 'compliance/invoices' and self.headers.get('Clearance-Status') == '1'
+        )
+        if pick < config.rejection_rate:
+            return self._send(400, self._invoice_result(body, is_clearance, 'ERROR'))
+        pick -= config.rejection_rate
+        if pick < config.warning_rate:
+            return self._send(202, self._invoice_result(body, is_clearance, 'WARNING'))
+        return self._send(200, self._invoice_result(body, is_clearance, 'PASS'))
+
+    def log_message(self, format, *args):
+        # Logging every request slows the simulator down under load
+        pass
+
+    def _read_body(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            return {}
+
+    def _csid(self, path: str):
+        if path == 'compliance' and not self.headers.get('OTP'):
+            return self._send(400, {'errors': [{'code': 'Missing-OTP', 'message': 'OTP is required'}]})
+
+        token = base64.b64encode(f'simulated-certificate-{uuid.uuid4()}'.encode()).decode()
+        return self._send(
+            200,
+            {
+                'requestID': int(time.time() * 1000),
+                'dispositionMessage': 'ISSUED',
+                'binarySecurityToken': token,
+                'secret': uuid.uuid4().hex,
+                'errors': None,
+            },
+        )
+
+    @staticmethod
+    def _invoice_result(body: dict, is_clearance: bool, status: str) -> dict:
+        accepted = status != 'ERROR'
+        result = {
+            'validationResults': {
+                'infoMessages': [PASS_MESSAGE],
+                'warningMessages': [WARNING_MESSAGE] if status == 'WARNING' else [],
+                'errorMessages': [ERROR_MESSAGE] if status == 'ERROR' else [],
+                'status': status,
+            },
+        }
+        if is_clearance:
+            result['clearanceStatus'] = 'CLEARED' if accepted else 'NOT_CLEARED'
+            result['clearedInvoice'] = body.get('invoice') if accepted else None
+        else:
+            result['reportingStatus'] = 'REPORTED' if accepted else 'NOT_REPORTED'
+        return result
+
+    def _send(self, status_code: int, data: dict):
+        content = json.dumps(data).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def serve(host: str, port: int, config: SimulatorConfig) -> None:
+    with FatooraSimulator((host, port), config) as simulator:
+        print(f'Simulating the ZATCA gateway on {simulator.url} with {config}')
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            print(f'Served {simulator.requests} requests')
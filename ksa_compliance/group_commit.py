@@ -0,0 +1,131 @@
+"""
+Group commit for the batch sync.
+
+Committing after every invoice costs a few fsyncs per invoice, which dominates syncing large backlogs. Instead, the
+sync applies each invoice's response under a savepoint (so that a failure only discards that invoice's changes) and
+commits every N invoices or every T milliseconds, whichever comes first. Within a group, integration logs and the
+updates of invoices to be resent are buffered and written with one bulk statement each when the group is committed.
+
+Tuned through 'zatca_sync_group_commit' in site config, e.g. {"invoices": 200, "interval_ms": 2000}. Setting
+"invoices" to 1 commits after every invoice.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+import frappe
+from frappe.query_builder import DocType
+from frappe.utils import now_datetime
+from pypika.terms import Case
+
+from ksa_compliance.ksa_compliance.doctype.zatca_integration_log.zatca_integration_log import ZATCAIntegrationLog
+
+DEFAULT_GROUP_COMMIT = {'invoices': 100, 'interval_ms': 5000}
+
+SAVEPOINT = 'zatca_group_commit'
+
+INTEGRATION_LOG_FIELDS = (
+    'invoice_doctype',
+    'invoice_reference',
+    'invoice_additional_fields_reference',
+    'zatca_message',
+    'status',
+    'zatca_status',
+    'zatca_http_status_code',
+)
+
+
+class GroupCommit:
+    def __init__(self, max_invoices: int, interval_ms: int):
+        self.max_invoices = max(1, max_invoices)
+        self.interval_ms = interval_ms
+        self.commits = 0
+        self._pending = 0
+        self._started = time.monotonic()
+        self._integration_logs: List[Dict[str, Any]] = []
+        self._updates: List[Tuple[str, str, Dict[str, Any]]] = []
+
+    @staticmethod
+    def from_config() -> 'GroupCommit':
+        config = {**DEFAULT_GROUP_COMMIT, **(frappe.conf.get('zatca_sync_group_commit') or {})}
+        return GroupCommit(config['invoices'], config['interval_ms'])
+
+    @contextmanager
+    def invoice(self) -> Iterator[None]:
+        """
+        Wraps applying the result of one invoice. If it fails, its database changes and buffered writes are discarded
+        and the exception is re-raised. Either way, the group is committed if it's due
+        """
+        frappe.db.savepoint(SAVEPOINT)
+        marks = len(self._integration_logs), len(self._updates)
+        try:
+            yield
+        except Exception:
+            frappe.db.rollback(save_point=SAVEPOINT)
+            del self._integration_logs[marks[0] :]
+            del self._updates[marks[1] :]
+            raise
+        finally:
+            self._pending += 1
+            self.commit_if_due()
+
+    def add_integration_log(self, **fields) -> None:
+        """Buffers a ZATCA Integration Log with the given [INTEGRATION_LOG_FIELDS]"""
+        self._integration_logs.append(fields)
+
+    def update(self, doctype: str, name: str, values: Dict[str, Any]) -> None:
+        """Buffers an update of [name]. Updates of the same doctype must set the same fields"""
+        self._updates.append((doctype, name, values))
+
+    def commit_if_due(self) -> None:
+        elapsed_ms = (time.monotonic() - self._started) * 1000
+        if self._pending >= self.max_invoices or (self._pending and elapsed_ms >= self.interval_ms):
+            self.commit()
+
+    def commit(self) -> None:
+        """Writes the buffered changes and commits"""
+        self._flush_integration_logs()
+        self._flush_updates()
+        frappe.db.commit()
+        self.commits += 1
+        self._pending = 0
+        self._started = time.monotonic()
+
+    def _flush_integration_logs(self) -> None:
+        if not self._integration_logs:
+            return
+
+        now = now_datetime()
+        user = frappe.session.user
+        names = ZATCAIntegrationLog.make_names([log['invoice_reference'] for log in self._integration_logs])
+        values = [
+            (name, now, now, user, user, 0, *(log.get(field) for field in INTEGRATION_LOG_FIELDS))
+            for name, log in zip(names, self._integration_logs)
+        ]
+        fields = ['name', 'creation', 'modified', 'owner', 'modified_by', 'docstatus', *INTEGRATION_LOG_FIELDS]
+        frappe.db.bulk_insert('ZATCA Integration Log', fields, values)
+        self._integration_logs.clear()
+
+    def _flush_updates(self) -> None:
+        by_doctype: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for doctype, name, values in self._updates:
+            by_doctype.setdefault(doctype, {}).setdefault(name, {}).update(values)
+        self._updates.clear()
+
+        now = now_datetime()
+        for doctype, updates in by_doctype.items():
+            table = DocType(doctype)
+            query = (
+                frappe.qb.update(table)
+                .set(table.modified, now)
+                .set(table.modified_by, frappe.session.user)
+                .where(table.name.isin(list(updates)))
+            )
+            # One statement for the whole group: field = CASE name WHEN ... THEN ... END
+            for field in next(iter(updates.values())):
+                case = Case()
+                for name, values in updates.items():
+                    case = case.when(table.name == name, values[field])
+                query = query.set(table[field], case)
+            query.run()
@@ -164,7 +164,10 @@ doc_events = {
 # Scheduled Tasks
 # ---------------
 
-scheduler_events = {'hourly_long': ['ksa_compliance.background_jobs.sync_e_invoices']}
+scheduler_events = {
+    'hourly_long': ['ksa_compliance.background_jobs.enqueue_sync_jobs'],
+    'cron': {'* * * * *': ['ksa_compliance.signing_outbox.enqueue_pending']},
+}
 # "all": [
 # "ksa_compliance.tasks.all"
 # ],
@@ -13,10 +13,14 @@ from erpnext.accounts.doctype.pos_invoice.pos_invoice import POSInvoice
 from erpnext.accounts.doctype.sales_invoice.sales_invoice import SalesInvoice
 from erpnext.setup.doctype.branch.branch import Branch
 from frappe.utils.data import get_time, getdate
+from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields import (
+    SalesInvoiceAdditionalFields,
+)
 from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import ZATCABusinessSettings
 from ksa_compliance.ksa_compliance.doctype.zatca_phase_1_business_settings.zatca_phase_1_business_settings import (
     ZATCAPhase1BusinessSettings,
 )
+from ksa_compliance.ksa_compliance.doctype.zatca_signing_outbox.zatca_signing_outbox import ZATCASigningOutbox
 
 
 class ItemWiseTaxDetailRow(TypedDict):
@@ -150,7 +154,7 @@ def get_phase_2_print_format_details(sales_invoice: SalesInvoice | POSInvoice) -
                 has_branch_address = True
     seller_other_id, seller_other_id_name = _get_seller_other_id(sales_invoice, settings)
     buyer_other_id, buyer_other_id_name = _get_buyer_other_id(sales_invoice.customer)
-    siaf = frappe.get_last_doc('Sales Invoice Additional Fields', {'sales_invoice': sales_invoice.name})
+    siaf = _get_siaf(sales_invoice, settings)
     return {
         'settings': settings,
         'address': {
@@ -164,9 +168,31 @@ def get_phase_2_print_format_details(sales_invoice: SalesInvoice | POSInvoice) -
         'buyer_other_id': buyer_other_id,
         'buyer_other_id_name': buyer_other_id_name,
         'siaf': siaf,
+        'pending_signature': siaf.is_new(),
     }
 
 
+def _get_siaf(
+    sales_invoice: SalesInvoice | POSInvoice, settings: ZATCABusinessSettings
+) -> SalesInvoiceAdditionalFields:
+    """
+    Returns the latest additional fields of [sales_invoice]. Under deferred signing, an invoice doesn't have any until
+    its signing outbox entry is processed, so it's printed from unsaved additional fields that have its invoice type
+    and buyer details, but no QR code
+    """
+    if ZATCASigningOutbox.has_entry(sales_invoice.doctype, sales_invoice.name) and not frappe.db.exists(
+        'Sales Invoice Additional Fields', {'sales_invoice': sales_invoice.name}
+    ):
+        siaf = SalesInvoiceAdditionalFields.create_for_invoice(sales_invoice.name, sales_invoice.doctype)
+        siaf.set_invoice_details(settings)
+        return siaf
+
+    return cast(
+        SalesInvoiceAdditionalFields,
+        frappe.get_last_doc('Sales Invoice Additional Fields', {'sales_invoice': sales_invoice.name}),
+    )
+
+
 def _get_seller_other_id(sales_invoice: SalesInvoice | POSInvoice, settings: ZATCABusinessSettings) -> tuple:
     seller_other_ids = ['CRN', 'MOM', 'MLS', '700', 'SAG', 'OTH']
     seller_other_id, seller_other_id_name = None, None
@@ -6,6 +6,9 @@ frappe.ui.form.on("Sales Invoice Additional Fields", {
         if (frm.doc.integration_status === 'Rejected' && !frm.doc.precomputed_invoice && frm.doc.is_latest) {
             frm.add_custom_button(__('Fix Rejection'), () => fix_rejection(frm), null, 'primary');
         }
+        if (frm.doc.integration_status === 'Resend' && frm.doc.docstatus === 0) {
+            frm.add_custom_button(__('Retry Now'), () => retry_submission(frm));
+        }
     },
     download_xml: function (frm) {
         window.open("/api/method/ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields.download_xml?id=" + frm.doc.name);
@@ -41,6 +44,16 @@ frappe.ui.form.on("Sales Invoice Additional Fields", {
     }
 });
 
+async function retry_submission(frm) {
+    await frappe.call({
+        method: "ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields.retry_submission",
+        args: {
+            id: frm.doc.name,
+        },
+    });
+    frm.reload_doc();
+}
+
 async function fix_rejection(frm) {
     let invoice_link = `<a target="_blank" href="${frappe.router.make_url(['Form', 'Sales Invoice', frm.doc.sales_invoice])}">${frm.doc.sales_invoice}</a>`
     let message = __("<p>This will create a new Sales Invoice Additional Fields document for the invoice '{0}' and " +
@@ -6,7 +6,7 @@ import base64
 import html
 import uuid
 from io import BytesIO
-from typing import cast, Optional, Literal
+from typing import Callable, cast, Optional, Literal
 
 import frappe
 import frappe.utils.background_jobs
@@ -26,13 +26,18 @@ from pypdf import PdfWriter
 from result import is_err, Result, Err, Ok, is_ok
 
 from ksa_compliance import SALES_INVOICE_CODE, DEBIT_NOTE_CODE, CREDIT_NOTE_CODE, PREPAYMENT_INVOICE_CODE
+from ksa_compliance import chain_sequencer
 from ksa_compliance import logger
-from ksa_compliance import zatca_api as api
+from ksa_compliance import resend_schedule
+from ksa_compliance import submission_engine
 from ksa_compliance import zatca_cli as cli
+from ksa_compliance import zatca_signer
+from ksa_compliance import zatca_validator
+from ksa_compliance.batch_context import BatchContext
 from ksa_compliance.generate_xml import generate_xml_file
+from ksa_compliance.group_commit import GroupCommit
 from ksa_compliance.invoice import InvoiceMode, InvoiceType
 from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import ZATCABusinessSettings
-from ksa_compliance.ksa_compliance.doctype.zatca_egs.zatca_egs import ZATCAEGS
 from ksa_compliance.ksa_compliance.doctype.zatca_integration_log.zatca_integration_log import ZATCAIntegrationLog
 from ksa_compliance.ksa_compliance.doctype.zatca_precomputed_invoice.zatca_precomputed_invoice import (
     ZATCAPrecomputedInvoice,
@@ -67,6 +72,7 @@ class SalesInvoiceAdditionalFields(Document):
         allowance_indicator: DF.Check
         allowance_vat_category_code: DF.Data | None
         amended_from: DF.Link | None
+        attempt_count: DF.Int
         branch: DF.Link | None
         branch_commercial_registration_number: DF.Data | None
         buyer_additional_number: DF.Data | None
@@ -110,6 +116,7 @@ class SalesInvoiceAdditionalFields(Document):
         invoice_xml: DF.LongText | None
         is_latest: DF.Check
         last_attempt: DF.Datetime | None
+        next_attempt_at: DF.Datetime | None
         other_buyer_ids: DF.Table[AdditionalSellerIDs]
         payment_means_type_code: DF.Data | None
         precomputed: DF.Check
@@ -167,16 +174,52 @@ class SalesInvoiceAdditionalFields(Document):
     def before_insert(self):
         self.integration_status = 'Ready For Batch'
         self.is_latest = True
+        self.attempt_count = 0
+        self.next_attempt_at = now_datetime()
         # Mark any pre-existing sales invoice additional fields as no longer being latest
         frappe.db.set_value('Sales Invoice Additional Fields', {'sales_invoice': self.sales_invoice}, 'is_latest', 0)
 
         if self.precomputed:
             return
 
-        settings = ZATCABusinessSettings.for_invoice(self.sales_invoice, self.invoice_doctype)
-        if not settings:
-            fthrow(f'Missing ZATCA business settings for sales invoice: {self.sales_invoice}')
+        presigned = cast(Optional[chain_sequencer.PresignedInvoice], self.flags.presigned)
+        if presigned:
+            # Built and signed ahead of time by the signing outbox (see [build_for_chain_position])
+            settings = self._get_settings()
+            self.invoice_counter = presigned.expected_head.next_counter
+            self.previous_invoice_hash = presigned.expected_head.invoice_hash
+            self._finish_for_zatca(
+                settings, presigned.expected_head, presigned.invoice_xml, presigned.result, self._get_signer(settings)
+            )
+            return
+
+        settings = self._get_settings()
+        invoice_type = self.set_invoice_details(settings)
+        self._prepare_for_zatca(settings, invoice_type)
 
+    def build_for_chain_position(
+        self, invoice_counter: int, previous_invoice_hash: str
+    ) -> tuple[ZATCABusinessSettings, str]:
+        """
+        Fills in the invoice details and builds the unsigned invoice XML at the given position of the invoice chain,
+        without inserting. Returns the business settings and the XML.
+
+        The signing outbox uses this to sign a run of invoices as a chain ahead of time, then inserts each one with
+        flags.presigned set to a [chain_sequencer.PresignedInvoice]
+        """
+        settings = self._get_settings()
+        invoice_type = self.set_invoice_details(settings)
+        self.invoice_counter = invoice_counter
+        self.previous_invoice_hash = previous_invoice_hash
+        return settings, generate_xml_file(
+            Einvoice(sales_invoice_additional_fields_doc=self, invoice_type=invoice_type).result
+        )
+
+    def get_cert_path(self, settings: ZATCABusinessSettings) -> str:
+        return settings.compliance_cert_path if self.is_compliance_mode else settings.cert_path
+
+    def set_invoice_details(self, settings: ZATCABusinessSettings) -> InvoiceType:
+        """Fills in the invoice type and the buyer details from the invoice, and returns the invoice type"""
         sales_invoice = cast(
             SalesInvoice | POSInvoice | PaymentEntry, frappe.get_doc(self.invoice_doctype, self.sales_invoice)
         )
@@ -194,36 +237,68 @@ class SalesInvoiceAdditionalFields(Document):
 
         if settings.enable_branch_configuration:
             self._set_branch_details(sales_invoice)
+        return invoice_type
 
-        self._prepare_for_zatca(settings, invoice_type)
+    def _get_settings(self) -> ZATCABusinessSettings:
+        settings = ZATCABusinessSettings.for_invoice(self.sales_invoice, self.invoice_doctype)
+        if not settings:
+            fthrow(f'Missing ZATCA business settings for sales invoice: {self.sales_invoice}')
+        return settings
 
-    def _prepare_for_zatca(self, settings: ZATCABusinessSettings, invoice_type: InvoiceType):
-        counting_settings_id, pre_invoice_counter, pre_invoice_hash = frappe.db.get_values(
-            'ZATCA Invoice Counting Settings',
-            {'business_settings_reference': settings.name},
-            ['name', 'invoice_counter', 'previous_invoice_hash'],
-            for_update=True,
-        )[0]
+    def _get_signer(self, settings: ZATCABusinessSettings) -> Callable[[str], cli.SigningResult]:
+        cert_path = self.get_cert_path(settings)
+        if settings.uses_native_signer:
+            credentials = zatca_signer.load_credentials(cert_path, settings.private_key_path)
 
-        self.invoice_counter = pre_invoice_counter + 1
-        self.previous_invoice_hash = pre_invoice_hash
+            def sign(xml: str) -> cli.SigningResult:
+                return zatca_signer.sign_invoice_with_credentials(xml, credentials)
+        else:
 
-        einvoice = Einvoice(sales_invoice_additional_fields_doc=self, invoice_type=invoice_type)
+            def sign(xml: str) -> cli.SigningResult:
+                return cli.sign_invoice(
+                    settings.zatca_cli_path, settings.java_home, xml, cert_path, settings.private_key_path
+                )
+
+        return sign
+
+    def _prepare_for_zatca(self, settings: ZATCABusinessSettings, invoice_type: InvoiceType):
+        # Build, sign and validate for the current head of the invoice chain without locking it. The chain is only
+        # locked for the hand-off at the end (see [ksa_compliance.chain_sequencer])
+        expected_head = chain_sequencer.peek(settings.name)
+        self.invoice_counter = expected_head.next_counter
+        self.previous_invoice_hash = expected_head.invoice_hash
 
-        cert_path = settings.compliance_cert_path if self.is_compliance_mode else settings.cert_path
+        einvoice = Einvoice(sales_invoice_additional_fields_doc=self, invoice_type=invoice_type)
         invoice_xml = generate_xml_file(einvoice.result)
-        result = cli.sign_invoice(
-            settings.zatca_cli_path, settings.java_home, invoice_xml, cert_path, settings.private_key_path
-        )
+        sign = self._get_signer(settings)
+        self._finish_for_zatca(settings, expected_head, invoice_xml, sign(invoice_xml), sign)
 
+    def _finish_for_zatca(
+        self,
+        settings: ZATCABusinessSettings,
+        expected_head: chain_sequencer.ChainHead,
+        invoice_xml: str,
+        result: cli.SigningResult,
+        sign: Callable[[str], cli.SigningResult],
+    ):
+        """Validates the signed invoice, then appends it to the invoice chain after [expected_head]"""
         if settings.validate_generated_xml and not self.is_compliance_mode:
-            validation_result = cli.validate_invoice(
-                settings.zatca_cli_path,
-                settings.java_home,
-                result.signed_invoice_path,
-                settings.cert_path,
-                self.previous_invoice_hash,
-            )
+            validation_result = None
+            if settings.uses_native_validator:
+                # Falls back to the CLI (None) if the validation rules can't be found
+                validation_result = zatca_validator.validate_invoice(
+                    settings.zatca_cli_path, result.signed_invoice_xml, self.previous_invoice_hash
+                )
+            if validation_result is None:
+                validation_result = cli.validate_invoice(
+                    settings.zatca_cli_path,
+                    settings.java_home,
+                    result.signed_invoice_xml,
+                    settings.cert_path,
+                    self.previous_invoice_hash,
+                )
+            if validation_result is None:
+                validation_result = self._get_timed_out_validation_result(settings)
             self.validation_messages = '\n'.join(validation_result.messages)
             self.validation_errors = '\n'.join(validation_result.errors_and_warnings)
             if validation_result.details:
@@ -266,69 +341,178 @@ class SalesInvoiceAdditionalFields(Document):
                     )
                     fthrow(title=ft('ZATCA Validation Error'), msg=html_message)
 
+        # If another invoice took our place in the chain meanwhile, the hand-off signs the invoice again at the next
+        # one. Only the ICV, PIH and signature change, so the validation above still holds
+        head, result = chain_sequencer.hand_off(settings.name, expected_head, invoice_xml, result, sign)
+        self.invoice_counter = head.next_counter
+        self.previous_invoice_hash = head.invoice_hash
         self.invoice_hash = result.invoice_hash
         self.qr_code = result.qr_code
         self.invoice_xml = result.signed_invoice_xml
 
-        # To update counting settings data
         logger.info(
-            f'Changing invoice counter, hash from: {pre_invoice_counter}, {pre_invoice_hash} -> '
+            f'Changing invoice counter, hash from: {head.invoice_counter}, {head.invoice_hash} -> '
             f'{self.invoice_counter}, {self.invoice_hash}'
         )
-        frappe.db.set_value(
-            'ZATCA Invoice Counting Settings',
-            counting_settings_id,
-            {'invoice_counter': self.invoice_counter, 'previous_invoice_hash': self.invoice_hash},
-        )
+
+    def _get_timed_out_validation_result(self, settings: ZATCABusinessSettings) -> cli.ValidationResult:
+        # A CLI timeout says nothing about the invoice: it's not validated, rather than invalid. Invoices signed by the
+        # signing outbox are signed and validated again later, with the outbox backoff. Others go through unvalidated
+        if settings.uses_deferred_signing:
+            fthrow(
+                ft('The invoice was not validated, as the ZATCA CLI did not finish in time. It will be retried later'),
+                title=ft('ZATCA Validation Error'),
+            )
+
+        logger.warning(f'{self.sales_invoice}: The ZATCA CLI timed out, the invoice was not validated')
+        return cli.ValidationResult([ft('Not validated: the ZATCA CLI did not finish in time')], [], None)
 
     def submit_to_zatca(self) -> Result[str, str]:
-        settings = ZATCABusinessSettings.for_invoice(self.sales_invoice, self.invoice_doctype)
+        submission = self.prepare_submission()
+        if is_err(submission):
+            return Err(submission.err_value)
+
+        response = submission_engine.send(submission.ok_value)
+        if not response.sent:
+            # Held back by the rate limiter or circuit breaker. We stay as is to be picked up by the batch sync
+            return Err(response.result.err_value.error)
+
+        integration_status = self.apply_submission_response(response)
+        return Ok(f'Invoice sent to ZATCA. Integration status: {integration_status}')
+
+    def prepare_submission(self, context: Optional[BatchContext] = None) -> Result[submission_engine.Submission, str]:
+        """
+        Collects everything needed to send this invoice to ZATCA. Sending is split from applying the response so that
+        the batch sync can send invoices concurrently (see [ksa_compliance.submission_engine]).
+
+        The batch sync passes a [context] with the records of the whole batch, so that they're loaded once per batch
+        """
+        context = context or BatchContext.load([self])
+        settings = context.get_settings(self.invoice_doctype, self.sales_invoice)
         if not settings:
             return Err(f'Missing ZATCA business settings for sales invoice: {self.sales_invoice}')
 
-        inv_doc = cast(
-            SalesInvoice | POSInvoice | PaymentEntry, frappe.get_doc(self.invoice_doctype, self.sales_invoice)
-        )
-        buyer_doc = self._get_buyer_doc(inv_doc)
-        invoice_type = _get_invoice_type(settings, buyer_doc)
+        invoice = context.get_invoice(self.invoice_doctype, self.sales_invoice)
+        buyer = context.get_customer(invoice.customer)
+        if not buyer:
+            return Err(f'Could not find customer {invoice.customer} of sales invoice: {self.sales_invoice}')
+
+        invoice_type = _get_invoice_type(settings, buyer)
         signed_xml = self.get_signed_xml()
         if not signed_xml:
             return Err(_('Could not find signed XML'))
 
         if self.precomputed_invoice:
-            device_id = frappe.db.get_value('ZATCA Precomputed Invoice', self.precomputed_invoice, 'device_id')
-            egs = ZATCAEGS.for_device(device_id)
+            egs = context.get_egs(self.precomputed_invoice)
             if not egs:
+                device_id = context.device_ids.get(self.precomputed_invoice)
                 return Err(f"Could not find a ZATCA EGS for device '{device_id}'")
 
             token = egs.production_security_token
-            secret = egs.get_password('production_secret') if egs.production_secret else ''
+            secret = context.get_password(egs, 'production_secret') if egs.production_secret else ''
         else:
             token = settings.security_token if self.is_compliance_mode else settings.production_security_token
-            secret = settings.get_password('secret' if self.is_compliance_mode else 'production_secret')
+            secret = context.get_password(settings, 'secret' if self.is_compliance_mode else 'production_secret')
 
         if not token or not secret:
             return Err(f'Missing ZATCA token/secret for {self.name}')
 
-        integration_status = self._send_xml_via_api(
-            signed_xml, self.invoice_hash, invoice_type, settings.fatoora_server_url, token, secret
+        return Ok(
+            submission_engine.Submission(
+                key=self.name,
+                group=settings.name,
+                concurrency=settings.submission_concurrency,
+                server_url=settings.fatoora_server_url,
+                invoice_xml=signed_xml,
+                invoice_uuid=self.uuid,
+                invoice_hash=self.invoice_hash,
+                invoice_type=invoice_type,
+                security_token=token,
+                secret=secret,
+                mode=self.send_mode,
+            )
         )
 
-        # Regardless of what happened, save the side effects of the API call
-        self.save()
+    def apply_submission_response(
+        self, response: submission_engine.SubmissionResponse, group: Optional[GroupCommit] = None
+    ) -> ZatcaIntegrationStatus:
+        """
+        Records the response of sending this invoice to ZATCA, and submits this document unless it should be resent.
 
-        # Resend means we keep ourselves as draft to be picked up by the next run of the background job
+        Within a [group] commit, the integration log and the update of an invoice to be resent are buffered and written
+        in bulk when the group is committed
+        """
+        status = ''
+        integration_status = _get_integration_status(response.status_code)
+        if is_err(response.result):
+            # The IDE gets confused resolving types, so we help it along
+            error = cast(ReportOrClearInvoiceError, response.result.err_value)
+            zatca_message = error.response or error.error
+        else:
+            value = cast(ReportOrClearInvoiceResult, response.result.ok_value)
+            zatca_message = value.raw_response
+            status = value.status
+
+        if group:
+            group.add_integration_log(
+                invoice_doctype=self.invoice_doctype,
+                invoice_reference=self.sales_invoice,
+                invoice_additional_fields_reference=self.name,
+                zatca_message=zatca_message,
+                status=integration_status,
+                zatca_status=status,
+                zatca_http_status_code=response.status_code,
+            )
+        else:
+            self._add_integration_log_document(
+                zatca_message=zatca_message,
+                integration_status=integration_status,
+                zatca_status=status,
+                status_code=response.status_code,
+            )
+        self.integration_status = integration_status
+        self.last_attempt = now_datetime()
+        self.attempt_count = (self.attempt_count or 0) + 1
+        self.next_attempt_at = None
         if integration_status == 'Resend':
-            frappe.log_error(
-                title='ZATCA Resend Error',
-                message=f"Sending invoice {self.sales_invoice} through {self.name} failed with 'Resend' status.",
+            self.next_attempt_at = resend_schedule.get_next_attempt_at(self.attempt_count, self.last_attempt)
+
+        # Regardless of what happened, save the side effects of the API call. Submitting saves them as well, so within a
+        # group we only need to save if we're not submitting
+        if group and integration_status == 'Resend':
+            group.update(
+                self.doctype,
+                self.name,
+                {
+                    'integration_status': self.integration_status,
+                    'last_attempt': self.last_attempt,
+                    'attempt_count': self.attempt_count,
+                    'next_attempt_at': self.next_attempt_at,
+                },
             )
+        elif not group:
+            self.save()
+
+        # Resend means we keep ourselves as draft to be picked up by a later run of the background job, once the next
+        # attempt is due
+        if integration_status == 'Resend':
+            if self.next_attempt_at:
+                frappe.log_error(
+                    title='ZATCA Resend Error',
+                    message=f"Sending invoice {self.sales_invoice} through {self.name} failed with 'Resend' status.",
+                )
+            else:
+                frappe.log_error(
+                    title='ZATCA Resend Attempts Exhausted',
+                    message=f'Sending invoice {self.sales_invoice} through {self.name} failed {self.attempt_count} '
+                    f'times. It will not be retried automatically.',
+                )
         else:
             # Any case other than resend is submitted
             self.allow_submit = 1
             self.submit()
 
-        return Ok(f'Invoice sent to ZATCA. Integration status: {integration_status}')
+        return integration_status
 
     def before_submit(self):
         if not self.allow_submit:
@@ -423,51 +607,6 @@ class SalesInvoiceAdditionalFields(Document):
         self.buyer_province_state = address.state
         self.buyer_country_code = frappe.get_value('Country', address.country, 'code')
 
-    def _send_xml_via_api(
-        self, invoice_xml: str, invoice_hash: str, invoice_type: InvoiceType, server_url: str, token: str, secret: str
-    ) -> ZatcaIntegrationStatus:
-        if invoice_type == 'Standard':
-            result, status_code = api.clear_invoice(
-                server=server_url,
-                invoice_xml=invoice_xml,
-                invoice_uuid=self.uuid,
-                invoice_hash=invoice_hash,
-                security_token=token,
-                secret=secret,
-                mode=self.send_mode,
-            )
-        else:
-            result, status_code = api.report_invoice(
-                server=server_url,
-                invoice_xml=invoice_xml,
-                invoice_uuid=self.uuid,
-                invoice_hash=invoice_hash,
-                security_token=token,
-                secret=secret,
-                mode=self.send_mode,
-            )
-
-        status = ''
-        integration_status = _get_integration_status(status_code)
-        if is_err(result):
-            # The IDE gets confused resolving types, so we help it along
-            error = cast(ReportOrClearInvoiceError, result.err_value)
-            zatca_message = error.response or error.error
-        else:
-            value = cast(ReportOrClearInvoiceResult, result.ok_value)
-            zatca_message = value.raw_response
-            status = value.status
-
-        self._add_integration_log_document(
-            zatca_message=zatca_message,
-            integration_status=integration_status,
-            zatca_status=status,
-            status_code=status_code,
-        )
-        self.integration_status = integration_status
-        self.last_attempt = now_datetime()
-        return integration_status
-
     def _compute_sum_of_charges(self, taxes: list) -> float:
         total = 0.0
         if taxes:
@@ -607,6 +746,22 @@ def download_xml(id: str):
     frappe.response.display_content_as = 'attachment'
 
 
+@frappe.whitelist()
+def retry_submission(id: str):
+    """Schedules an invoice in 'Resend' status to be sent by the next sync, restarting its backoff"""
+    import frappe.permissions
+
+    if not frappe.permissions.has_permission('Sales Invoice Additional Fields', 'write'):
+        raise PermissionError()
+
+    siaf = cast(SalesInvoiceAdditionalFields, frappe.get_doc('Sales Invoice Additional Fields', id))
+    if siaf.docstatus != 0 or siaf.integration_status != 'Resend':
+        fthrow(ft("Only draft invoices in 'Resend' status can be retried"))
+
+    siaf.db_set({'attempt_count': 0, 'next_attempt_at': now_datetime()})
+    frappe.msgprint(ft('The invoice will be sent by the next sync'))
+
+
 @frappe.whitelist()
 def fix_rejection(id: str):
     import frappe.permissions
@@ -705,13 +860,10 @@ def download_zatca_pdf(id: str, print_format: str = 'ZATCA Phase 2 Print Format'
         )
     pdf_file = get_file_data_from_writer(pdf_writer)
 
-    zatca_pdf_path = convert_to_pdf_a3_b(
+    pdf_content = convert_to_pdf_a3_b(
         settings.zatca_cli_path, settings.java_home, siaf.sales_invoice, pdf_file, xml_content
     )
 
-    with open(zatca_pdf_path, 'rb') as f:
-        pdf_content = f.read()
-
     frappe.response.filename = f'{siaf.sales_invoice}_a3b.pdf'
     frappe.response.filecontent = pdf_content
     frappe.response.type = 'download'
@@ -1,9 +1,77 @@
 # Copyright (c) 2024, Lavaloon and Contributors
 # See license.txt
 
-# import frappe
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from frappe.model.document import Document
+
+from ksa_compliance.ksa_compliance.doctype.zatca_business_settings import zatca_business_settings
+from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import (
+    ZATCABusinessSettings,
+)
+
+COMPANY = '_Test Company Without ZATCA Settings'
+
 
 class TestZATCABusinessSettings(FrappeTestCase):
-    pass
+    def setUp(self):
+        ZATCABusinessSettings.clear_cache()
+
+    def _count_queries(self, lookup) -> int:
+        with patch.object(frappe.db, 'sql', wraps=frappe.db.sql) as sql:
+            lookup()
+        return sql.call_count
+
+    def test_company_lookups_are_cached(self):
+        self.assertGreater(self._count_queries(lambda: ZATCABusinessSettings.for_company(COMPANY)), 0)
+
+        self.assertEqual(self._count_queries(lambda: ZATCABusinessSettings.for_company(COMPANY, True)), 0)
+        self.assertEqual(self._count_queries(lambda: ZATCABusinessSettings.is_enabled_for_company(COMPANY)), 0)
+        self.assertEqual(self._count_queries(lambda: ZATCABusinessSettings.is_revoked_for_company(COMPANY)), 0)
+        self.assertEqual(self._count_queries(lambda: ZATCABusinessSettings.is_branch_config_enabled(COMPANY)), 0)
+
+    def test_clear_cache(self):
+        ZATCABusinessSettings.for_company(COMPANY)
+        ZATCABusinessSettings.clear_cache()
+        # The request-scoped copy kept by frappe.cache.hget goes as well
+        self.assertGreater(self._count_queries(lambda: ZATCABusinessSettings.for_company(COMPANY)), 0)
+
+    def test_clear_cache_again_at_end_of_transaction(self):
+        ZATCABusinessSettings.clear_cache()
+        # A lookup made before the transaction ends (by another worker, say) may still see the old settings
+        ZATCABusinessSettings.for_company(COMPANY)
+        frappe.db.rollback()
+        self.assertGreater(self._count_queries(lambda: ZATCABusinessSettings.for_company(COMPANY)), 0)
+
+    def test_missing_secret_is_reported(self):
+        settings = frappe.new_doc('ZATCA Business Settings')
+        settings.name = '_Test Missing Secret Settings'
+        settings.secret = None
+        with patch.object(Document, 'get_password', side_effect=frappe.AuthenticationError) as decrypt:
+            self.assertRaises(frappe.AuthenticationError, settings.get_password, 'secret')
+            decrypt.assert_called_once_with('secret', True)
+        zatca_business_settings._clear_decrypted_secrets(settings.name)
+
+    def test_secrets_are_decrypted_once_per_version(self):
+        settings = frappe.new_doc('ZATCA Business Settings')
+        settings.name = '_Test Secret Settings'
+        settings.modified = '2026-01-01 00:00:00'
+        settings.secret = '*' * 8
+        with patch.object(Document, 'get_password', side_effect=['secret-1', 'secret-2']) as decrypt:
+            self.assertEqual(settings.get_password('secret'), 'secret-1')
+            self.assertEqual(settings.get_password('secret'), 'secret-1')
+            self.assertEqual(decrypt.call_count, 1)
+            # Secrets live in worker memory, not on the (possibly cached and shared) document
+            self.assertNotIn('secret-1', settings.__dict__.values())
+
+            settings.modified = '2026-01-02 00:00:00'
+            self.assertEqual(settings.get_password('secret'), 'secret-2')
+            self.assertEqual(decrypt.call_count, 2)
+
+        # Only the secrets of the latest version are kept
+        keys = [key for key in zatca_business_settings._decrypted_secrets if key[1] == settings.name]
+        self.assertEqual(keys, [(frappe.local.site, settings.name, '2026-01-02 00:00:00')])
+        zatca_business_settings._clear_decrypted_secrets(settings.name)
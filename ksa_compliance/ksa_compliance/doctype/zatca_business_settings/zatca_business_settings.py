@@ -2,7 +2,7 @@
 # For license information, please see license.txt
 import base64
 import os
-from typing import Optional, NoReturn, cast, Literal
+from typing import Dict, Optional, NoReturn, Tuple, cast, Literal
 
 from pypika.functions import Count
 
@@ -30,6 +30,15 @@ from ksa_compliance.invoice import InvoiceMode
 from ksa_compliance.throw import fthrow
 from ksa_compliance.translation import ft
 
+# Maps each company to the business settings lookups of [ZATCABusinessSettings.for_company] and friends. Kept in the
+# site cache, shared by all workers, and cleared whenever a business settings document changes. Settings documents
+# themselves come from the document cache, which Frappe clears when they're saved
+COMPANY_SETTINGS_CACHE_KEY = 'zatca_business_settings_by_company'
+
+# Decrypted secrets of business settings, kept in worker memory (never in the site cache) so that each stored secret is
+# decrypted once per version of the document. Keyed by (site, name, modified); saving the document changes 'modified'
+_decrypted_secrets: Dict[Tuple[str, str, str], Dict[str, Optional[str]]] = {}
+
 
 class ZATCABusinessSettings(Document):
     # begin: auto-generated types
@@ -77,14 +86,18 @@ class ZATCABusinessSettings(Document):
         secret: DF.Password | None
         security_token: DF.SmallText | None
         seller_name: DF.Data
+        signing_engine: DF.Literal['ZATCA CLI', 'Native']
+        signing_mode: DF.Literal['On Submit', 'Deferred']
         status: DF.Literal['Active', 'Revoked']
         street: DF.Data | None
+        submission_concurrency: DF.Int
         sync_with_zatca: DF.Literal['Live', 'Batches']
         tax_rate: DF.Percent
         type_of_business_transactions: DF.Literal[
             'Let the system decide (both)', 'Simplified Tax Invoices', 'Standard Tax Invoices'
         ]
         validate_generated_xml: DF.Check
+        validation_engine: DF.Literal['ZATCA CLI', 'Native']
         vat_registration_number: DF.Data
         zatca_cli_path: DF.Data | None
         zatca_tax_category: DF.Literal[
@@ -119,6 +132,35 @@ class ZATCABusinessSettings(Document):
         )
         invoice_counting_doc.insert(ignore_permissions=True)
 
+    def on_update(self):
+        _clear_decrypted_secrets(self.name)
+        ZATCABusinessSettings.clear_cache(self.name)
+
+    def get_password(self, fieldname='password', raise_exception=True) -> str | None:
+        # Decrypts each stored secret once per version of the document (see _decrypted_secrets). Secrets set but not
+        # saved yet aren't encrypted. Empty fields fall through, so that a missing secret is reported as usual
+        if self.get(fieldname) and not self.is_dummy_password(self.get(fieldname)):
+            return super().get_password(fieldname, raise_exception)
+
+        key = (frappe.local.site, self.name, str(self.modified))
+        secrets = _decrypted_secrets.get(key)
+        if secrets is None:
+            _clear_decrypted_secrets(self.name)
+            secrets = _decrypted_secrets.setdefault(key, {})
+        if fieldname not in secrets:
+            secrets[fieldname] = super().get_password(fieldname, raise_exception)
+        return secrets[fieldname]
+
+    def validate(self):
+        if self.uses_deferred_signing and self.validate_generated_xml and self.block_invoice_on_invalid_xml:
+            fthrow(
+                ft(
+                    "Invoices can't be blocked on invalid XML with deferred signing, since they're only validated "
+                    'after they are submitted'
+                ),
+                title=ft('Invalid Signing Mode'),
+            )
+
     def before_insert(self):
         if self.automatic_vat_account_configuration == 1:
             # Create Tax Account under Duties and Taxes Account
@@ -134,6 +176,18 @@ class ZATCABusinessSettings(Document):
     def is_live_sync(self) -> bool:
         return self.sync_with_zatca.lower() == 'live'
 
+    @property
+    def uses_native_signer(self) -> bool:
+        return self.signing_engine == 'Native'
+
+    @property
+    def uses_deferred_signing(self) -> bool:
+        return self.signing_mode == 'Deferred'
+
+    @property
+    def uses_native_validator(self) -> bool:
+        return self.validation_engine == 'Native'
+
     @property
     def invoice_mode(self) -> InvoiceMode:
         return InvoiceMode.from_literal(self.type_of_business_transactions)
@@ -290,48 +344,45 @@ class ZATCABusinessSettings(Document):
 
     @staticmethod
     def for_company(company_id: str, include_revoked=False) -> Optional['ZATCABusinessSettings']:
-        business_settings_id = frappe.db.get_value(
-            'ZATCA Business Settings', filters={'company': company_id, 'status': 'Active'}
-        )
+        company_settings = _get_company_settings(company_id)
+        business_settings_id = company_settings['active']
         if not business_settings_id and include_revoked:
-            # frappe.db.exists doesn't order, so it could return the oldest revoked settings. We want the most
-            # recent revoked settings instead
-            business_settings_id = frappe.db.get_value(
-                'ZATCA Business Settings',
-                {'company': company_id, 'status': 'Revoked'},
-                ignore=True,
-                order_by='modified desc',
-            )
+            business_settings_id = company_settings['revoked']
 
         if not business_settings_id:
             return None
 
-        return cast(ZATCABusinessSettings, frappe.get_doc('ZATCA Business Settings', business_settings_id))
+        return cast(ZATCABusinessSettings, frappe.get_cached_doc('ZATCA Business Settings', business_settings_id))
 
     @staticmethod
     def is_revoked_for_company(company_id: str) -> bool:
-        business_settings_id = frappe.db.get_value(
-            'ZATCA Business Settings', filters={'company': company_id, 'status': 'Revoked'}
-        )
-        return bool(business_settings_id)
+        return bool(_get_company_settings(company_id)['revoked'])
 
     @staticmethod
     def is_enabled_for_company(company_id: str) -> bool:
-        return bool(
-            frappe.db.get_value(
-                'ZATCA Business Settings',
-                filters={'company': company_id, 'status': 'Active', 'enable_zatca_integration': True},
-            )
-        )
+        return _get_company_settings(company_id)['enable_zatca_integration']
 
     @staticmethod
     def is_branch_config_enabled(company_id: str) -> bool:
-        return bool(
-            frappe.db.get_value(
-                'ZATCA Business Settings',
-                filters={'company': company_id, 'status': 'Active', 'enable_branch_configuration': True},
-            )
-        )
+        return _get_company_settings(company_id)['enable_branch_configuration']
+
+    @staticmethod
+    def clear_cache(business_settings_id: Optional[str] = None) -> None:
+        """
+        Clears the company lookups, and the cached document of [business_settings_id] if given. The lookups are cleared
+        again once the transaction commits or rolls back, so that a lookup made by another worker before then can't
+        keep stale settings cached
+        """
+
+        def clear_lookups():
+            frappe.cache.delete_value(COMPANY_SETTINGS_CACHE_KEY)
+
+        clear_lookups()
+        if hasattr(frappe.db, 'after_commit'):
+            frappe.db.after_commit.add(clear_lookups)
+            frappe.db.after_rollback.add(clear_lookups)
+        if business_settings_id:
+            frappe.clear_document_cache('ZATCA Business Settings', business_settings_id)
 
     def _generate_csr(self) -> cli.CsrResult:
         config = frappe.render_template(
@@ -366,6 +417,8 @@ class ZATCABusinessSettings(Document):
             fthrow(_("Please configure 'Fatoora Server URL'"))
 
     def on_trash(self) -> NoReturn:
+        _clear_decrypted_secrets(self.name)
+        ZATCABusinessSettings.clear_cache(self.name)
         fthrow(msg=_('You cannot Delete a configured ZATCA Business Settings'), title=_('This Action Is Not Allowed'))
 
     def create_tax_account(self) -> str:
@@ -499,5 +552,44 @@ def revoke_business_settings(settings_id: str, company: str):
         )
 
     frappe.db.set_value('ZATCA Business Settings', settings_id, 'status', 'Revoked')
+    ZATCABusinessSettings.clear_cache(settings_id)
 
     frappe.msgprint(ft('CSID and Business Settings is now revoked.'), ft('Successfully Revoked'))
+
+
+def _clear_decrypted_secrets(business_settings_id: str) -> None:
+    """Drops the decrypted secrets of every version of [business_settings_id] on the current site"""
+    site = frappe.local.site
+    for key in [key for key in _decrypted_secrets if key[:2] == (site, business_settings_id)]:
+        _decrypted_secrets.pop(key, None)
+
+
+def _get_company_settings(company_id: str) -> dict:
+    """
+    Returns the active and latest revoked business settings of [company_id], and whether the active one enables ZATCA
+    integration and branch configuration. Cached in the site cache and, by frappe.cache.hget, for the rest of the
+    request
+    """
+
+    def load() -> dict:
+        active = frappe.db.get_value(
+            'ZATCA Business Settings',
+            {'company': company_id, 'status': 'Active'},
+            ['name', 'enable_zatca_integration', 'enable_branch_configuration'],
+            as_dict=True,
+        )
+        # We want the most recent revoked settings, not the oldest
+        revoked = frappe.db.get_value(
+            'ZATCA Business Settings',
+            {'company': company_id, 'status': 'Revoked'},
+            ignore=True,
+            order_by='modified desc',
+        )
+        return {
+            'active': active.name if active else None,
+            'revoked': revoked,
+            'enable_zatca_integration': bool(active and active.enable_zatca_integration),
+            'enable_branch_configuration': bool(active and active.enable_branch_configuration),
+        }
+
+    return frappe.cache.hget(COMPANY_SETTINGS_CACHE_KEY, company_id, load)
@@ -1,8 +1,12 @@
 # Copyright (c) 2024, Lavaloon and contributors
 # For license information, please see license.txt
 
+from typing import List
+
 import frappe
 from frappe.model.document import Document
+from frappe.query_builder import DocType
+from frappe.query_builder.functions import Count
 
 
 class ZATCAIntegrationLog(Document):
@@ -37,3 +41,20 @@ class ZATCAIntegrationLog(Document):
     def autoname(self):
         count = len(frappe.get_all(self.doctype, {'invoice_reference': self.invoice_reference}, pluck='name'))
         self.name = f'log-{self.invoice_reference}-{count + 1}'
+
+    @staticmethod
+    def make_names(invoice_references: List[str]) -> List[str]:
+        """Returns the names [autoname] would give to new logs of [invoice_references], for inserting them in bulk"""
+        log = DocType('ZATCA Integration Log')
+        counts = dict(
+            frappe.qb.from_(log)
+            .select(log.invoice_reference, Count('*'))
+            .where(log.invoice_reference.isin(list(set(invoice_references))))
+            .groupby(log.invoice_reference)
+            .run()
+        )
+        names = []
+        for reference in invoice_references:
+            counts[reference] = counts.get(reference, 0) + 1
+            names.append(f'log-{reference}-{counts[reference]}')
+        return names
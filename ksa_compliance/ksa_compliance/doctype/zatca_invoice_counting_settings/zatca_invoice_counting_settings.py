@@ -5,6 +5,8 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
+from ksa_compliance import chain_sequencer
+
 
 class ZATCAInvoiceCountingSettings(Document):
     # begin: auto-generated types
@@ -21,6 +23,9 @@ class ZATCAInvoiceCountingSettings(Document):
         zatca_egs: DF.Link | None
     # end: auto-generated types
 
+    def on_update(self) -> None:
+        chain_sequencer.clear_cache(self.business_settings_reference)
+
     def on_trash(self) -> None:
         frappe.throw(
             msg=_('You cannot delete a configured Invoice Counting Settings'), title=_('This Action Is Not Allowed')
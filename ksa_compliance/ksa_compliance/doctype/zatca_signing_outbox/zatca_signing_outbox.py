@@ -0,0 +1,73 @@
+# Copyright (c) 2026, Lavaloon and contributors
+# For license information, please see license.txt
+import datetime
+from typing import List, Literal
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import now_datetime
+
+
+# An invoice submitted under deferred signing, waiting for its sales invoice additional fields to be created (and
+# signed) by ksa_compliance.signing_outbox. Entries are deleted once signed
+class ZATCASigningOutbox(Document):
+    # begin: auto-generated types
+    # This code is auto-generated. Do not modify anything in this block.
+
+    from typing import TYPE_CHECKING
+
+    if TYPE_CHECKING:
+        from frappe.types import DF
+
+        attempts: DF.Int
+        business_settings: DF.Link
+        error: DF.LongText | None
+        invoice: DF.DynamicLink
+        invoice_doctype: DF.Link
+        next_attempt_at: DF.Datetime | None
+    # end: auto-generated types
+
+    @staticmethod
+    def add(
+        invoice_doctype: Literal['Sales Invoice', 'POS Invoice'], invoice_id: str, business_settings_id: str
+    ) -> None:
+        doc = frappe.new_doc('ZATCA Signing Outbox')
+        doc.invoice_doctype = invoice_doctype
+        doc.invoice = invoice_id
+        doc.business_settings = business_settings_id
+        doc.insert(ignore_permissions=True)
+
+    @staticmethod
+    def has_entry(invoice_doctype: Literal['Sales Invoice', 'POS Invoice'], invoice_id: str) -> bool:
+        return bool(
+            frappe.db.exists('ZATCA Signing Outbox', {'invoice_doctype': invoice_doctype, 'invoice': invoice_id})
+        )
+
+    @staticmethod
+    def get_due(business_settings_id: str, limit: int) -> List[str]:
+        """Returns the names of the entries of a business settings that are due for signing, in submission order"""
+        outbox = frappe.qb.DocType('ZATCA Signing Outbox')
+        query = (
+            frappe.qb.from_(outbox)
+            .select(outbox.name)
+            .where(outbox.business_settings == business_settings_id)
+            .where(outbox.next_attempt_at.isnull() | (outbox.next_attempt_at <= now_datetime()))
+            .orderby(outbox.creation)
+            .orderby(outbox.name)
+            .limit(limit)
+        )
+        return [row[0] for row in query.run()]
+
+    @staticmethod
+    def get_business_settings_with_due_entries() -> List[str]:
+        outbox = frappe.qb.DocType('ZATCA Signing Outbox')
+        query = (
+            frappe.qb.from_(outbox)
+            .select(outbox.business_settings)
+            .distinct()
+            .where(outbox.next_attempt_at.isnull() | (outbox.next_attempt_at <= now_datetime()))
+        )
+        return [row[0] for row in query.run()]
+
+    def record_failure(self, error: str, next_attempt_at: datetime.datetime) -> None:
+        self.db_set({'attempts': self.attempts + 1, 'error': error, 'next_attempt_at': next_attempt_at})
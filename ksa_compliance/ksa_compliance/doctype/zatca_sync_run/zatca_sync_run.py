@@ -0,0 +1,65 @@
+# Copyright (c) 2026, Lavaloon and contributors
+# For license information, please see license.txt
+import datetime
+import json
+from collections import Counter
+from typing import Optional
+
+import frappe
+from frappe.model.document import Document
+
+
+# Tracks the sync of a shard (a business settings or EGS, see background_jobs.SyncShard) within a sync run. Holds the
+# sync's cursor, so that it can continue in a new job or resume after its job was killed
+class ZATCASyncRun(Document):
+    # begin: auto-generated types
+    # This code is auto-generated. Do not modify anything in this block.
+
+    from typing import TYPE_CHECKING
+
+    if TYPE_CHECKING:
+        from frappe.types import DF
+
+        business_settings: DF.Link | None
+        check_date: DF.Datetime | None
+        company: DF.Link | None
+        continuations: DF.Int
+        counts: DF.JSON | None
+        egs: DF.Link | None
+        error: DF.SmallText | None
+        finished_at: DF.Datetime | None
+        last_creation: DF.Datetime | None
+        last_name: DF.Link | None
+        processed: DF.Int
+        run_id: DF.Data | None
+        shard: DF.Data
+        started_at: DF.Datetime | None
+        status: DF.Literal['Queued', 'Running', 'Finished', 'Failed', 'Cancelled']
+        total: DF.Int
+    # end: auto-generated types
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ('Queued', 'Running')
+
+    def get_counts(self) -> Counter:
+        counts = json.loads(self.counts) if isinstance(self.counts, str) else self.counts
+        return Counter(counts or {})
+
+    def checkpoint(self, counts: Counter, last_creation: datetime.datetime, last_name: str) -> None:
+        """Saves the progress of the sync. It's committed along with the batch it belongs to"""
+        self.db_set(
+            {
+                'counts': json.dumps(counts),
+                'processed': sum(counts.values()),
+                'last_creation': last_creation,
+                'last_name': last_name,
+            }
+        )
+
+    @staticmethod
+    def get_active(shard: str) -> Optional['ZATCASyncRun']:
+        name = frappe.db.get_value(
+            'ZATCA Sync Run', {'shard': shard, 'status': ('in', ['Queued', 'Running'])}, order_by='creation desc'
+        )
+        return frappe.get_doc('ZATCA Sync Run', name) if name else None
@@ -1,53 +1,224 @@
-frappe.pages['e-invoicing-sync'].on_page_load = function(wrapper) {
-	var me = frappe.ui.make_app_page({
-		parent: wrapper,
-		single_column: true
-	});
-	me.page = wrapper.page;
-	me.page.set_title(__("Sync Invoices"));
-
-	// Calling Initialization method
-	let batch_date;
-	initialize(me, batch_date);
+frappe.pages['e-invoicing-sync'].on_page_load = function (wrapper) {
+    let page = frappe.ui.make_app_page({
+        parent: wrapper,
+        single_column: true
+    });
+    page.set_title(__("Sync Invoices"));
+    new SyncInvoicesPage(page);
 }
 
-function initialize(page, batch_date) {
-    // Initialization implementation
-    let field = page.add_field({
-        label : "Batch Date",
-        fieldtype: "Date",
-        fieldname: "batch_date",
-        change() {
-            batch_date = field.get_value();
+const SYNC_RUN_METHOD_PREFIX = "ksa_compliance.background_jobs.";
+
+class SyncInvoicesPage {
+    constructor(page) {
+        this.page = page;
+        this.run = null;
+        this.batch_date = null;
+
+        let field = page.add_field({
+            label: __("Batch Date"),
+            fieldtype: "Date",
+            fieldname: "batch_date",
+            change: () => {
+                this.batch_date = field.get_value();
+            }
+        });
+        page.set_primary_action(__("Sync"), () => this.sync_invoices());
+        page.set_secondary_action(__("Cancel Sync"), () => this.cancel_sync());
+        page.btn_secondary.hide();
+
+        this.$progress = $('<div class="zatca-sync-progress"></div>').appendTo(page.main);
+
+        // Jobs publish their progress after every batch
+        frappe.realtime.doctype_subscribe("ZATCA Sync Run");
+        frappe.realtime.on("zatca_sync_progress", (data) => this.on_progress(data));
+        this.load_status();
+    }
+
+    async load_status(run_id) {
+        let r = await frappe.call({
+            method: SYNC_RUN_METHOD_PREFIX + "get_sync_run_status",
+            args: {run_id: run_id},
+        });
+        this.run = r.message.run_id ? {run_id: r.message.run_id, shards: r.message.shards} : null;
+        this.render();
+    }
+
+    async sync_invoices() {
+        if (!this.batch_date) {
+            frappe.throw(__("Select a date first."));
         }
-    });
-    let $btn = page.set_primary_action("submit", () => sync_invoices(batch_date));
+        this.page.btn_primary.prop("disabled", true);
+        frappe.show_alert({
+            message: __("Start Invoices Syncing...."),
+            indicator: "green"
+        }, 3);
+        try {
+            let r = await frappe.call({
+                method: SYNC_RUN_METHOD_PREFIX + "add_batch_to_background_queue",
+                args: {
+                    "check_date": this.batch_date
+                },
+            });
+            if (r.message) {
+                await this.load_status(r.message);
+            }
+        } finally {
+            this.page.btn_primary.prop("disabled", false);
+        }
+    }
+
+    cancel_sync() {
+        if (!this.run) {
+            return;
+        }
+        frappe.confirm(__("Stop syncing invoices? Invoices already sent to ZATCA stay sent."), async () => {
+            let r = await frappe.call({
+                method: SYNC_RUN_METHOD_PREFIX + "cancel_sync_run",
+                args: {run_id: this.run.run_id},
+            });
+            this.run.shards = r.message.shards;
+            this.render();
+        });
+    }
+
+    on_progress(data) {
+        if (!this.run || this.run.run_id !== data.run_id) {
+            // A sync run started elsewhere (e.g. the hourly sync). Switch to it
+            if (["Queued", "Running"].includes(data.status)) {
+                this.load_status(data.run_id);
+            }
+            return;
+        }
+        this.run.shards[data.shard] = data;
+        this.render();
+    }
+
+    render() {
+        if (!this.run) {
+            this.page.btn_secondary.hide();
+            this.$progress.html(`<p class="text-muted">${__("No invoices have been synced yet.")}</p>`);
+            return;
+        }
+
+        let shards = Object.values(this.run.shards);
+        let total = summarize(shards);
+        let is_running = shards.some(shard => ["Queued", "Running"].includes(shard.status));
+        this.page.btn_secondary.toggle(is_running);
+
+        let companies = {};
+        for (let shard of shards) {
+            let company = shard.company || __("Unknown");
+            (companies[company] = companies[company] || []).push(shard);
+        }
+
+        let percent = total.processed + total.remaining ? 100 * total.processed / (total.processed + total.remaining) : 100;
+        let rows = Object.entries(companies).map(([company, company_shards]) => {
+            let summary = summarize(company_shards);
+            return `<tr>
+                <td>${frappe.utils.escape_html(company)}</td>
+                <td>${status_indicator(summary.status)}</td>
+                <td class="text-right">${summary.processed}</td>
+                <td class="text-right">${summary.accepted}</td>
+                <td class="text-right">${summary.rejected}</td>
+                <td class="text-right">${summary.resend}</td>
+                <td class="text-right">${summary.other}</td>
+                <td class="text-right">${format_rate(summary.rate)}</td>
+                <td class="text-right">${format_eta(summary.eta)}</td>
+            </tr>`;
+        }).join("");
+
+        this.$progress.html(`
+            <div class="flex justify-between align-center">
+                <h5>${__("Sync Run {0}", [this.run.run_id])}</h5>
+                ${status_indicator(total.status)}
+            </div>
+            <div class="progress" style="height: 8px; margin-bottom: var(--margin-md);">
+                <div class="progress-bar" style="width: ${percent}%"></div>
+            </div>
+            <div class="row">
+                ${stat(__("Processed"), total.processed)}
+                ${stat(__("Accepted"), total.accepted)}
+                ${stat(__("Rejected"), total.rejected)}
+                ${stat(__("Resend"), total.resend)}
+                ${stat(__("Invoices / Second"), format_rate(total.rate))}
+                ${stat(__("Time Left"), format_eta(total.eta))}
+            </div>
+            <table class="table table-bordered" style="margin-top: var(--margin-md);">
+                <thead>
+                    <tr>
+                        <th>${__("Company")}</th>
+                        <th>${__("Status")}</th>
+                        <th class="text-right">${__("Processed")}</th>
+                        <th class="text-right">${__("Accepted")}</th>
+                        <th class="text-right">${__("Rejected")}</th>
+                        <th class="text-right">${__("Resend")}</th>
+                        <th class="text-right">${__("Other")}</th>
+                        <th class="text-right">${__("Invoices / Second")}</th>
+                        <th class="text-right">${__("Time Left")}</th>
+                    </tr>
+                </thead>
+                <tbody>${rows}</tbody>
+            </table>
+        `);
+    }
 }
 
-function sync_invoices(batch_date) {
-    // calling server side method to sync the invoices.
-    let submitBtn = document.getElementsByClassName("btn-sm")[0];
-    submitBtn.disabled = true;
-    if (!batch_date) {
-        submitBtn.disabled = false;
-        frappe.throw(__("Select a date first."));
-    }
-    //show_alert with indicator
-    frappe.show_alert({
-        message:__("Start Invoices Syncing...."),
-        indicator:'green'
-    }, 3);
-    frappe.call({
-        method: "ksa_compliance.background_jobs.add_batch_to_background_queue",
-        args: {
-            "check_date": batch_date
-        },
-        callback: function(r) {
-            if (!r.exc) {
-                frappe.msgprint("Syncing End.....");
+// Mirrors summarize_sync_run in background_jobs.py
+function summarize(shards) {
+    let summary = {processed: 0, remaining: 0, rate: 0, accepted: 0, rejected: 0, resend: 0, other: 0};
+    for (let shard of shards) {
+        summary.processed += shard.processed || 0;
+        summary.remaining += shard.remaining || 0;
+        summary.rate += shard.rate || 0;
+        for (let [status, count] of Object.entries(shard.counts || {})) {
+            if (status === "Accepted" || status === "Accepted with warnings") {
+                summary.accepted += count;
+            } else if (status === "Rejected") {
+                summary.rejected += count;
+            } else if (status === "Resend") {
+                summary.resend += count;
+            } else {
+                summary.other += count;
             }
         }
-    });
-    submitBtn.disabled = true;
-    console.log(batch_date);
-}
\ No newline at end of file
+    }
+
+    let statuses = shards.map(shard => shard.status);
+    if (statuses.includes("Queued") || statuses.includes("Running")) {
+        summary.status = "Running";
+    } else if (statuses.includes("Failed")) {
+        summary.status = "Failed";
+    } else if (statuses.includes("Cancelled")) {
+        summary.status = "Cancelled";
+    } else {
+        summary.status = "Finished";
+    }
+    summary.eta = summary.rate ? Math.round(summary.remaining / summary.rate) : null;
+    return summary;
+}
+
+function stat(label, value) {
+    return `<div class="col-sm-2">
+        <div class="text-muted small">${label}</div>
+        <div class="h4">${value}</div>
+    </div>`;
+}
+
+function status_indicator(status) {
+    let colors = {Running: "blue", Finished: "green", Failed: "red", Cancelled: "orange"};
+    return `<span class="indicator-pill ${colors[status] || "gray"}">${__(status)}</span>`;
+}
+
+function format_rate(rate) {
+    return rate ? rate.toFixed(1) : "-";
+}
+
+function format_eta(seconds) {
+    if (!seconds) {
+        return "-";
+    }
+    let hours = Math.floor(seconds / 3600);
+    let minutes = Math.floor((seconds % 3600) / 60);
+    return hours ? __("{0}h {1}m", [hours, minutes]) : __("{0}m {1}s", [minutes, seconds % 60]);
+}
@@ -8,7 +8,7 @@ from erpnext.accounts.doctype.payment_entry.payment_entry import PaymentEntry
 from erpnext.setup.doctype.branch.branch import Branch
 from frappe.model.document import Document
 from frappe.utils import get_date_str, get_time, strip
-from ksa_compliance.invoice import InvoiceType, get_zatca_discount_reason_by_name
+from ksa_compliance.invoice import InvoiceType
 from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields import sales_invoice_additional_fields
 from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import ZATCABusinessSettings
 from ksa_compliance.ksa_compliance.doctype.zatca_return_against_reference.zatca_return_against_reference import (
@@ -16,8 +16,8 @@ from ksa_compliance.ksa_compliance.doctype.zatca_return_against_reference.zatca_
 )
 from ksa_compliance.throw import fthrow
 from ksa_compliance.translation import ft
-from frappe.utils import flt
 
+from .line_items import LineItems
 from .service import get_right_fieldname, update_result
 from .prepayment_invoice.prepayment_invoice_factory import prepayment_invoice_factory_create
 
@@ -634,7 +634,9 @@ class Einvoice:
 
         # --------------------------- END Buyer Details fields ------------------------------
 
-    def append_to_item_lines(self, item_lines: list, is_tax_included: bool, sales_invoice_doc: SalesInvoice) -> None:
+    def append_to_item_lines(
+        self, item_lines: LineItems, is_tax_included: bool, sales_invoice_doc: SalesInvoice
+    ) -> None:
         """
         Appends items to item_lines list based on document type (Payment Entry or Sales Invoice).
         Handles tax-inclusive and tax-exclusive pricing calculations.
@@ -644,7 +646,7 @@ class Einvoice:
         else:
             self._append_sales_invoice_items(item_lines, is_tax_included, sales_invoice_doc)
 
-    def _append_payment_entry_item(self, item_lines: list, doc: PaymentEntry) -> None:
+    def _append_payment_entry_item(self, item_lines: LineItems, doc: PaymentEntry) -> None:
         values = self._calculate_payment_entry_values(doc)
         """Handles payment entry specific item formatting."""
         item_data = {
@@ -670,7 +672,7 @@ class Einvoice:
             'total_amount': abs(self.sales_invoice_doc.received_amount_after_tax),
         }
 
-        item_lines.append(frappe._dict(item_data))
+        item_lines.append(**item_data)
 
     def _calculate_payment_entry_values(self, doc: PaymentEntry) -> dict:
         values = frappe._dict()
@@ -713,45 +715,9 @@ class Einvoice:
 
         return values
 
-    def _append_sales_invoice_items(self, item_lines: list, is_tax_included: bool, doc: SalesInvoice) -> None:
+    def _append_sales_invoice_items(self, item_lines: LineItems, is_tax_included: bool, doc: SalesInvoice) -> None:
         """Processes regular sales invoice items with proper tax and discount calculations."""
-        for item in doc.items:
-            has_discount = isinstance(item.discount_amount, float) and item.discount_amount > 0
-
-            tax_percent = abs(item.tax_rate or 0.0)
-            tax_amount_with_qty = abs(item.tax_amount or 0.0)
-            discount_with_qty = abs(item.discount_amount * item.qty) if has_discount else 0.0
-            amount_with_qty = abs(
-                flt(abs(item.amount) / (1 + (tax_percent / 100)), 2) if is_tax_included else item.amount
-            )
-            net_amount_with_qty = abs(item.net_amount)
-            rate_without_qty = abs(item.rate)
-            item_data = {
-                'idx': item.idx,
-                'qty': abs(item.qty),
-                'uom': item.uom,
-                'item_code': item.item_code,
-                'item_name': item.item_name,
-                'net_amount': net_amount_with_qty,
-                'rate': rate_without_qty,
-                'discount_percentage': abs(item.discount_percentage) if has_discount else 0.0,
-                'tax_percent': tax_percent,
-                'amount': amount_with_qty,
-                'rounding_amount': tax_amount_with_qty + amount_with_qty,
-                'base_amount': amount_with_qty + discount_with_qty,
-                'discount_amount': discount_with_qty if has_discount else 0.0,
-                'tax_amount': tax_amount_with_qty,
-                'item_tax_template': item.item_tax_template,
-                'allowance_charge_reason': None,
-                'allowance_charge_reason_code': None,
-            }
-            if item_data['discount_amount']:
-                zatca_discount_reason = get_zatca_discount_reason_by_name(
-                    item.get('custom_zatca_discount_reason') or 'Discount'
-                )
-                item_data['allowance_charge_reason'] = zatca_discount_reason.name
-                item_data['allowance_charge_reason_code'] = zatca_discount_reason.code
-            item_lines.append(frappe._dict(item_data))
+        item_lines.append_sales_invoice_items(doc.items, is_tax_included)
 
     def get_e_invoice_details(self, invoice_type: str):
         is_standard = invoice_type == 'Standard'
@@ -886,7 +852,7 @@ class Einvoice:
 
         # --------------------------- END Invoice Basic info ------------------------------
         # --------------------------- Start Getting Invoice's item lines ------------------------------
-        item_lines = []
+        item_lines = LineItems()
         if not self.sales_invoice_doc.taxes:
             fthrow(
                 ft(
@@ -900,7 +866,7 @@ class Einvoice:
         )
         self.append_to_item_lines(item_lines, is_tax_included, self.sales_invoice_doc)
         tax_categories = create_tax_categories(self.sales_invoice_doc, item_lines, is_tax_included)
-        tax_total = create_tax_total(tax_categories)
+        tax_total = create_tax_total(tax_categories, item_lines)
         self.result['invoice']['tax_total'] = tax_total
         allowance_charge = create_allowance_charge(self.sales_invoice_doc, tax_total)
         self.result['invoice']['allowance_charge'] = allowance_charge
@@ -922,7 +888,7 @@ class Einvoice:
                 ) / (1 + tax_percent)
 
         self.result['invoice']['item_lines'] = item_lines
-        self.result['invoice']['line_extension_amount'] = sum(it['amount'] for it in item_lines)
+        self.result['invoice']['line_extension_amount'] = item_lines.total('amount')
         self.compute_invoice_discount_amount()
         self.result['invoice']['net_total'] = (
             self.result['invoice']['line_extension_amount'] - self.result['invoice']['allowance_total_amount']
@@ -0,0 +1,142 @@
+from typing import Dict, Iterator, List, Optional
+
+import frappe
+from frappe.utils import flt
+
+from ksa_compliance.invoice import get_zatca_discount_reason_by_name
+
+# Fields of an invoice line, as used by the invoice XML template (item_lines)
+LINE_COLUMNS = (
+    'idx',
+    'qty',
+    'uom',
+    'item_code',
+    'item_name',
+    'net_amount',
+    'rate',
+    'discount_percentage',
+    'tax_percent',
+    'amount',
+    'rounding_amount',
+    'base_amount',
+    'discount_amount',
+    'tax_amount',
+    'item_tax_template',
+    'allowance_charge_reason',
+    'allowance_charge_reason_code',
+)
+
+
+class LineItems:
+    """
+    The lines of an invoice, held by column (a list per field) rather than a dict per line. Totals are sums over
+    columns, and the tax category of each line is a reference to its category's (shared) tax category dict.
+
+    Iterating gives a [LineItem] view per line, which the invoice XML template reads like the dicts it used to get.
+    Views copy nothing, so wholesale invoices with thousands of lines don't build thousands of dicts
+    """
+
+    def __init__(self):
+        self.columns: Dict[str, list] = {column: [] for column in LINE_COLUMNS}
+        self.category_keys: List[Optional[str]] = []
+        self.tax_categories: Dict[str, frappe._dict] = {}
+
+    def append(self, **values) -> None:
+        for column, values_list in self.columns.items():
+            values_list.append(values.get(column))
+        self.category_keys.append(None)
+
+    def append_sales_invoice_items(self, items: list, is_tax_included: bool) -> None:
+        """Appends the lines of sales invoice items, with their amounts net of tax and discount amounts per quantity"""
+        for item in items:
+            has_discount = isinstance(item.discount_amount, float) and item.discount_amount > 0
+
+            tax_percent = abs(item.tax_rate or 0.0)
+            tax_amount_with_qty = abs(item.tax_amount or 0.0)
+            discount_with_qty = abs(item.discount_amount * item.qty) if has_discount else 0.0
+            amount_with_qty = abs(
+                flt(abs(item.amount) / (1 + (tax_percent / 100)), 2) if is_tax_included else item.amount
+            )
+            reason = (
+                get_zatca_discount_reason_by_name(item.get('custom_zatca_discount_reason') or 'Discount')
+                if has_discount and discount_with_qty
+                else None
+            )
+            self.append(
+                idx=item.idx,
+                qty=abs(item.qty),
+                uom=item.uom,
+                item_code=item.item_code,
+                item_name=item.item_name,
+                net_amount=abs(item.net_amount),
+                rate=abs(item.rate),
+                discount_percentage=abs(item.discount_percentage) if has_discount else 0.0,
+                tax_percent=tax_percent,
+                amount=amount_with_qty,
+                rounding_amount=tax_amount_with_qty + amount_with_qty,
+                base_amount=amount_with_qty + discount_with_qty,
+                discount_amount=discount_with_qty if has_discount else 0.0,
+                tax_amount=tax_amount_with_qty,
+                item_tax_template=item.item_tax_template,
+                allowance_charge_reason=reason.name if reason else None,
+                allowance_charge_reason_code=reason.code if reason else None,
+            )
+
+    def column(self, name: str) -> list:
+        return self.columns[name]
+
+    def total(self, name: str, rows: Optional[List[int]] = None) -> float:
+        """Sums a column over all lines, or the given [rows], in line order"""
+        values = self.columns[name]
+        if rows is None:
+            return sum(values)
+        return sum(values[row] for row in rows)
+
+    def add_tax_category(self, key: str, tax_category: frappe._dict) -> None:
+        """Adds a tax category for lines to refer to through [set_tax_category]"""
+        self.tax_categories[key] = tax_category
+
+    def set_tax_category(self, row: int, key: str) -> None:
+        self.category_keys[row] = key
+
+    def __len__(self) -> int:
+        return len(self.category_keys)
+
+    def __iter__(self) -> Iterator['LineItem']:
+        return (LineItem(self, row) for row in range(len(self)))
+
+    def __getitem__(self, row: int) -> 'LineItem':
+        if not -len(self) <= row < len(self):
+            raise IndexError(row)
+        return LineItem(self, row % len(self))
+
+
+class LineItem:
+    """A read-only view of a line of [LineItems]. Fields are available as attributes or keys"""
+
+    __slots__ = ('_lines', '_row')
+
+    def __init__(self, lines: LineItems, row: int):
+        self._lines = lines
+        self._row = row
+
+    @property
+    def tax_category(self) -> Optional[frappe._dict]:
+        key = self._lines.category_keys[self._row]
+        return self._lines.tax_categories[key] if key is not None else None
+
+    def __getattr__(self, name: str):
+        columns = self._lines.columns
+        if name not in columns:
+            raise AttributeError(name)
+        return columns[name][self._row]
+
+    def __getitem__(self, name: str):
+        if name == 'tax_category':
+            return self.tax_category
+        return self._lines.columns[name][self._row]
+
+    def get(self, name: str, default=None):
+        if name != 'tax_category' and name not in self._lines.columns:
+            return default
+        return self[name]
@@ -1,6 +1,5 @@
 from dataclasses import dataclass
 from typing import Optional, List
-from erpnext.stock.doctype.item.item import Item
 
 
 @dataclass
@@ -22,7 +21,8 @@ class TaxCategory:
 @dataclass
 class TaxCategoryByItems:
     tax_category: TaxCategory
-    items: List[Item]
+    items: List[int]
+    """Indexes of the category's lines (see [ksa_compliance.output_models.line_items.LineItems])"""
 
 
 @dataclass
@@ -1,8 +1,12 @@
+import operator
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
 import frappe
 
-from ksa_compliance.standard_doctypes.tax_category import map_tax_category
+from ksa_compliance.standard_doctypes.tax_category import to_zatca_tax_category
+from .line_items import LineItems
 from .service import get_right_fieldname, dataclass_to_frappe_dict
-from .models import TaxCategory, TaxCategoryByItems, TaxTotal, TaxSubtotal, AllowanceCharge
+from .models import TaxCategory, TaxCategoryByItems, TaxTotal, TaxSubtotal, AllowanceCharge, ZatcaTaxCategory
 
 from erpnext.accounts.doctype.sales_invoice.sales_invoice import SalesInvoice
 from erpnext.accounts.doctype.payment_entry.payment_entry import PaymentEntry
@@ -12,14 +16,81 @@ from ksa_compliance.translation import ft
 from ksa_compliance.throw import fthrow
 
 
-def create_tax_categories(doc: SalesInvoice | PaymentEntry, item_lines: list, is_tax_included: bool) -> dict:
+class TaxMetadata:
+    """
+    The tax templates and categories an invoice refers to. Each one is loaded once per invoice, rather than once per
+    item row. Item tax templates of the invoice's items are loaded together up front
+    """
+
+    def __init__(self, item_tax_templates: Iterable[str] = ()):
+        self._templates: Dict[str, Tuple[Optional[str], Optional[float]]] = {}
+        self._tax_categories: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        self._item_tax_templates: Dict[str, Tuple[ZatcaTaxCategory, Optional[float]]] = {}
+        self._load_item_tax_templates({template for template in item_tax_templates if template})
+
+    def get_template(self, template_id: str) -> Tuple[Optional[str], Optional[float]]:
+        """Returns the tax category and rate of a sales taxes and charges template"""
+        if template_id not in self._templates:
+            tax_category_id = frappe.db.get_value('Sales Taxes and Charges Template', template_id, 'tax_category')
+            rate = frappe.db.get_value('Sales Taxes and Charges', {'parent': template_id}, 'rate')
+            self._templates[template_id] = (tax_category_id, rate)
+        return self._templates[template_id]
+
+    def get_tax_category(self, tax_category_id: str) -> Tuple[Optional[str], Optional[str]]:
+        """Returns the ZATCA category and category reason of a tax category"""
+        if tax_category_id not in self._tax_categories:
+            self._tax_categories[tax_category_id] = frappe.db.get_value(
+                'Tax Category', tax_category_id, ['custom_zatca_category', 'custom_category_reason']
+            ) or (None, None)
+        return self._tax_categories[tax_category_id]
+
+    def get_item_tax_template(self, item_tax_template_id: str) -> Tuple[ZatcaTaxCategory, Optional[float]]:
+        """
+        Returns the ZATCA tax category and tax rate of an item tax template. The rate is that of the template's first
+        tax row (the lowest idx)
+        """
+        if item_tax_template_id not in self._item_tax_templates:
+            self._load_item_tax_templates({item_tax_template_id})
+        if item_tax_template_id not in self._item_tax_templates:
+            fthrow(
+                msg=ft(
+                    'Item Tax Template $item_tax_template_id was not found.', item_tax_template_id=item_tax_template_id
+                )
+            )
+        return self._item_tax_templates[item_tax_template_id]
+
+    def _load_item_tax_templates(self, item_tax_template_ids: Set[str]) -> None:
+        if not item_tax_template_ids:
+            return
+
+        templates = frappe.db.get_all(
+            'Item Tax Template',
+            filters={'name': ('in', list(item_tax_template_ids))},
+            fields=['name', 'custom_zatca_item_tax_category', 'custom_category_reason'],
+        )
+        details = frappe.db.get_all(
+            'Item Tax Template Detail',
+            filters={'parent': ('in', list(item_tax_template_ids)), 'parenttype': 'Item Tax Template'},
+            fields=['parent', 'idx', 'tax_rate'],
+        )
+        rates = {}
+        for detail in sorted(details, key=operator.attrgetter('idx')):
+            rates.setdefault(detail.parent, detail.tax_rate)
+
+        for template in templates:
+            zatca_category = to_zatca_tax_category(
+                template.custom_zatca_item_tax_category, template.custom_category_reason
+            )
+            self._item_tax_templates[template.name] = (zatca_category, rates.get(template.name))
+
+
+def create_tax_categories(doc: SalesInvoice | PaymentEntry, item_lines: LineItems, is_tax_included: bool) -> dict:
     tax_category_map = frappe._dict()
     sales_taxes_and_charges_template = doc.get(get_right_fieldname('taxes_and_charges', doc.doctype))
-    item_tax_templates = [row.item_tax_template for row in item_lines if row.item_tax_template]
+    item_tax_templates = [template for template in item_lines.column('item_tax_template') if template]
+    tax_metadata = TaxMetadata(item_tax_templates)
     if sales_taxes_and_charges_template and not item_tax_templates:
-        tax_category_id = frappe.db.get_value(
-            'Sales Taxes and Charges Template', sales_taxes_and_charges_template, 'tax_category'
-        )
+        tax_category_id, tax_category_percent = tax_metadata.get_template(sales_taxes_and_charges_template)
         if not tax_category_id:
             fthrow(
                 msg=ft(
@@ -27,7 +98,7 @@ def create_tax_categories(doc: SalesInvoice | PaymentEntry, item_lines: list, is
                     sales_taxes_and_charges_template=sales_taxes_and_charges_template,
                 )
             )
-        zatca_category = frappe.db.get_value('Tax Category', tax_category_id, 'custom_zatca_category')
+        zatca_category, custom_category_reason = tax_metadata.get_tax_category(tax_category_id)
         if not zatca_category:
             fthrow(
                 msg=ft(
@@ -35,54 +106,60 @@ def create_tax_categories(doc: SalesInvoice | PaymentEntry, item_lines: list, is
                     tax_category_id=tax_category_id,
                 )
             )
-        tax_category_percent = frappe.db.get_value(
-            'Sales Taxes and Charges', {'parent': sales_taxes_and_charges_template}, 'rate'
-        )
 
-        tax_category_id = map_tax_category(tax_category_id=tax_category_id)
+        tax_category_id = to_zatca_tax_category(zatca_category, custom_category_reason)
         tax_category = TaxCategory(
             zatca_tax_category_id=tax_category_id, percent=tax_category_percent, tax_scheme_id='VAT'
         )
 
-        for row in item_lines:
-            row.tax_category = dataclass_to_frappe_dict(tax_category)
-        tax_category_by_items = TaxCategoryByItems(tax_category=tax_category, items=[row for row in item_lines])
-        tax_category_by_items_cls = tax_category_map.setdefault(
-            zatca_category + str(tax_category_percent), tax_category_by_items
-        )
+        item_lines.add_tax_category(sales_taxes_and_charges_template, dataclass_to_frappe_dict(tax_category))
+        for row in range(len(item_lines)):
+            item_lines.set_tax_category(row, sales_taxes_and_charges_template)
+        tax_category_by_items = TaxCategoryByItems(tax_category=tax_category, items=list(range(len(item_lines))))
+        tax_category_map.setdefault(zatca_category + str(tax_category_percent), tax_category_by_items)
         return tax_category_map
 
     check_item_tax_template(doc, item_lines, sales_taxes_and_charges_template)
 
-    for row in item_lines:
-        if not row.item_tax_template and sales_taxes_and_charges_template:
-            tax_category_id = frappe.db.get_value(
-                'Sales Taxes and Charges Template', sales_taxes_and_charges_template, 'tax_category'
+    # Lines of the same item tax template (or of the invoice's template) share their tax category
+    tax_categories: Dict[str, TaxCategoryByItems] = {}
+    for row, item_tax_template in enumerate(item_lines.column('item_tax_template')):
+        key = item_tax_template or ''
+        tax_category_by_items = tax_categories.get(key)
+        if not tax_category_by_items:
+            if not item_tax_template and sales_taxes_and_charges_template:
+                tax_category_id, tax_category_percent = tax_metadata.get_template(sales_taxes_and_charges_template)
+                zatca_tax_category = to_zatca_tax_category(*_get_zatca_category(tax_metadata, tax_category_id))
+            else:
+                zatca_tax_category, tax_category_percent = tax_metadata.get_item_tax_template(item_tax_template)
+            tax_category = TaxCategory(
+                zatca_tax_category_id=zatca_tax_category, percent=tax_category_percent, tax_scheme_id='VAT'
             )
-            zatca_tax_category = map_tax_category(tax_category_id=tax_category_id)
-            tax_category_percent = frappe.db.get_value(
-                'Sales Taxes and Charges', {'parent': sales_taxes_and_charges_template}, 'rate'
+            item_lines.add_tax_category(key, dataclass_to_frappe_dict(tax_category))
+            # Templates of the same ZATCA category and rate are totaled together, under the first one's category
+            tax_category_by_items = tax_categories[key] = tax_category_map.setdefault(
+                zatca_tax_category.tax_category_code + str(tax_category_percent),
+                TaxCategoryByItems(tax_category=tax_category, items=[]),
             )
-        else:
-            zatca_tax_category = map_tax_category(item_tax_template_id=row.item_tax_template)
-            tax_category_percent = frappe.db.get_value(
-                'Item Tax Template Detail', {'parent': row.item_tax_template}, 'tax_rate'
-            )
-        tax_category = TaxCategory(
-            zatca_tax_category_id=zatca_tax_category, percent=tax_category_percent, tax_scheme_id='VAT'
-        )
 
-        row.tax_category = dataclass_to_frappe_dict(tax_category)
-        tax_category_by_items = TaxCategoryByItems(tax_category=tax_category, items=[])
-        tax_category_by_items_cls = tax_category_map.setdefault(
-            zatca_tax_category.tax_category_code + str(tax_category_percent), tax_category_by_items
-        )
-        tax_category_by_items_cls.items.append(row)
+        item_lines.set_tax_category(row, key)
+        tax_category_by_items.items.append(row)
     return tax_category_map
 
 
-def check_item_tax_template(doc: SalesInvoice, item_lines: list, sales_taxes_and_charges_template: str) -> None:
-    invalid_items = [row.item_name for row in item_lines if not row.item_tax_template]
+def _get_zatca_category(
+    tax_metadata: TaxMetadata, tax_category_id: Optional[str]
+) -> Tuple[Optional[str], Optional[str]]:
+    # Templates without a tax category are mapped to the standard rate
+    return tax_metadata.get_tax_category(tax_category_id) if tax_category_id else (None, None)
+
+
+def check_item_tax_template(doc: SalesInvoice, item_lines: LineItems, sales_taxes_and_charges_template: str) -> None:
+    invalid_items = [
+        item_name
+        for item_name, item_tax_template in zip(item_lines.column('item_name'), item_lines.column('item_tax_template'))
+        if not item_tax_template
+    ]
     if invalid_items and not sales_taxes_and_charges_template:
         frappe.throw(
             'Please Include Sales Taxes and Charges Template on invoice\nOr include Item Tax Template on {0}'.format(
@@ -91,13 +168,13 @@ def check_item_tax_template(doc: SalesInvoice, item_lines: list, sales_taxes_and
         )
 
 
-def create_tax_total(tax_categories: dict) -> dict:
+def create_tax_total(tax_categories: dict, item_lines: LineItems) -> dict:
     tax_sub_totals = []
     tax_amount = 0
     taxable_amount = 0
     total_discount = 0
     for key in tax_categories:
-        amounts = _get_amounts(tax_categories[key])
+        amounts = _get_amounts(tax_categories[key], item_lines)
         tax_sub_total = TaxSubtotal(
             taxable_amount=amounts.taxable_amount,
             tax_amount=amounts.tax_amount,
@@ -114,22 +191,24 @@ def create_tax_total(tax_categories: dict) -> dict:
     )
 
 
-def _get_amounts(tax_category: TaxCategoryByItems) -> frappe._dict:
-    taxable_amount = 0
-    tax_amount = 0
-    total_discount = 0
+def _get_amounts(tax_category: TaxCategoryByItems, item_lines: LineItems) -> frappe._dict:
+    # Sums are taken over the category's lines in line order, as the amounts are in the rendered invoice
+    rows = None if len(tax_category.items) == len(item_lines) else tax_category.items
+    net_amount = item_lines.total('net_amount', rows)
     amounts = frappe._dict()
-    for row in tax_category.items:
-        taxable_amount += row.net_amount
-        tax_amount += row.tax_amount
-        total_discount += row.amount - row.net_amount
-    amounts.taxable_amount = taxable_amount
-    amounts.tax_amount = tax_amount
-    amounts.total_discount = total_discount
-
+    amounts.taxable_amount = net_amount
+    amounts.tax_amount = item_lines.total('tax_amount', rows)
+    amounts.total_discount = _sum_discounts(item_lines, rows)
     return amounts
 
 
+def _sum_discounts(item_lines: LineItems, rows: Optional[List[int]]) -> float:
+    amount, net_amount = item_lines.column('amount'), item_lines.column('net_amount')
+    if rows is None:
+        return sum(map(operator.sub, amount, net_amount))
+    return sum(amount[row] - net_amount[row] for row in rows)
+
+
 def create_allowance_charge(doc: SalesInvoice | PaymentEntry, tax_total: frappe._dict) -> list:
     allowance_charges = []
     discount_reason, discount_reason_code = None, None
@@ -0,0 +1,11 @@
+import frappe
+
+
+def execute():
+    # Serves the batch sync query (background_jobs.build_query) in order, without a sort. Drafts are a small part of
+    # the table, and the remaining filters are checked from the index
+    frappe.db.add_index(
+        'Sales Invoice Additional Fields',
+        ['docstatus', 'creation', 'name', 'integration_status', 'next_attempt_at'],
+        index_name='lava_sales_invoice_additional_fields_sync',
+    )
@@ -0,0 +1,11 @@
+import frappe
+
+
+def execute():
+    print('Scheduling pending sales invoice additional fields for the batch sync.')
+    # Anything pending before scheduling was added is due now, as it was picked up by every sync
+    frappe.db.sql("""
+        UPDATE `tabSales Invoice Additional Fields`
+        SET next_attempt_at = creation
+        WHERE docstatus = 0 AND next_attempt_at IS NULL
+    """)
@@ -0,0 +1,32 @@
+"""
+Scheduling of invoices that need to be sent to ZATCA again ('Resend' status).
+
+Every failed attempt pushes the next one back exponentially, with jitter so that invoices that failed together (e.g.
+during an outage) aren't all retried at once. After the maximum number of attempts, an invoice is no longer retried
+automatically; it can be retried from its Sales Invoice Additional Fields form.
+
+Tuned through 'zatca_resend_backoff' in site config, e.g. {"base_minutes": 10, "max_minutes": 720, "max_attempts": 8}
+"""
+
+import datetime
+import random
+from typing import Optional
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+DEFAULT_BACKOFF = {'base_minutes': 5, 'max_minutes': 24 * 60, 'max_attempts': 12}
+
+
+def get_next_attempt_at(
+    attempt_count: int, now: Optional[datetime.datetime] = None, rng: Optional[random.Random] = None
+) -> Optional[datetime.datetime]:
+    """Returns when to retry an invoice after [attempt_count] failed attempts, or None if it shouldn't be retried"""
+    backoff = {**DEFAULT_BACKOFF, **(frappe.conf.get('zatca_resend_backoff') or {})}
+    if attempt_count >= backoff['max_attempts']:
+        return None
+
+    delay = min(backoff['max_minutes'], backoff['base_minutes'] * 2 ** max(0, attempt_count - 1))
+    # Somewhere between half the delay and the full delay
+    delay = delay / 2 + (rng or random).uniform(0, delay / 2)
+    return add_to_date(now or now_datetime(), minutes=delay)
@@ -0,0 +1,228 @@
+"""
+Deferred signing: creating (and signing) sales invoice additional fields outside the invoice submit transaction.
+
+With 'Signing Mode' set to 'Deferred' in ZATCA Business Settings, submitting a Sales Invoice or POS Invoice only
+records a 'ZATCA Signing Outbox' entry, so submit latency doesn't depend on building and signing the invoice XML. A
+job per business settings then works through its entries in submission order, a batch at a time:
+1. The invoices of the batch are built for the positions following the current head of the invoice chain
+2. They're signed as a chain, through a single CLI process for CLI signing (see [ksa_compliance.signing_scheduler])
+3. Each one is inserted as additional fields, which hands the signed invoice off to the chain (signing it again if
+   the chain moved meanwhile, see [ksa_compliance.chain_sequencer]), then its entry is deleted and committed
+With live sync, each invoice is reported or cleared right after it's committed, in the same order.
+
+Every submitted invoice is eventually signed:
+- The entry is committed along with the invoice, and only deleted along with its additional fields
+- A failed attempt is retried with an increasing delay (capped, never given up on), and doesn't hold up the rest of
+  the outbox. An invoice that can't be built or signed ahead of time goes through the regular insert path, which
+  builds and signs it on its own
+- A scheduled job picks up outboxes whose job was lost (e.g. a worker restart), as well as retries that are due. It
+  signs the chains of all those outboxes concurrently
+
+Jobs run on the 'short' queue by default, which workers pick up before the default and long queues. Tuned through
+'zatca_signing_outbox' in site config, e.g. {"queue": "short", "batch_size": 50, "max_retry_minutes": 60}
+"""
+
+import time
+from typing import Dict, List, Optional, cast
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+from frappe.utils.background_jobs import is_job_enqueued
+from result import is_ok
+
+from ksa_compliance import chain_sequencer
+from ksa_compliance import logger
+from ksa_compliance.chain_sequencer import ChainHead, PresignedInvoice
+from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields import (
+    SalesInvoiceAdditionalFields,
+)
+from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import ZATCABusinessSettings
+from ksa_compliance.ksa_compliance.doctype.zatca_signing_outbox.zatca_signing_outbox import ZATCASigningOutbox
+from ksa_compliance.signing_scheduler import SigningChain, sign_chains
+from ksa_compliance.zatca_cli import SigningRequest
+
+DEFAULT_SIGNING_OUTBOX = {'queue': 'short', 'batch_size': 50, 'max_retry_minutes': 60}
+SIGNING_JOB_TIMEOUT = 300
+DEADLINE_MARGIN_SECONDS = 60
+
+
+def get_config() -> dict:
+    return {**DEFAULT_SIGNING_OUTBOX, **(frappe.conf.get('zatca_signing_outbox') or {})}
+
+
+def enqueue_signing(business_settings_id: Optional[str] = None, enqueue_after_commit: bool = False) -> None:
+    """Enqueues signing the outbox of a business settings, or of every business settings (see [sign_pending])"""
+    frappe.enqueue(
+        'ksa_compliance.signing_outbox.sign_pending',
+        business_settings_id=business_settings_id,
+        queue=get_config()['queue'],
+        timeout=SIGNING_JOB_TIMEOUT,
+        job_name=f'Sign E-Invoices ({business_settings_id})' if business_settings_id else 'Sign E-Invoices',
+        job_id=_get_job_id(business_settings_id),
+        deduplicate=True,
+        enqueue_after_commit=enqueue_after_commit,
+    )
+
+
+def enqueue_pending() -> None:
+    """Scheduled: enqueues signing for the outboxes with entries that are due, unless they have a job of their own"""
+    if _get_business_settings_without_jobs():
+        enqueue_signing()
+
+
+def sign_pending(business_settings_id: Optional[str] = None) -> None:
+    """
+    Signs the due entries of a business settings' outbox in submission order, until it's empty or time is up. Without
+    a business settings, signs every outbox with due entries that doesn't have a job of its own, with the chains of
+    different outboxes signed concurrently
+    """
+    deadline = time.monotonic() + SIGNING_JOB_TIMEOUT - DEADLINE_MARGIN_SECONDS
+    config = get_config()
+    if business_settings_id:
+        business_settings_ids = [business_settings_id]
+    else:
+        business_settings_ids = _get_business_settings_without_jobs()
+
+    signed = failed = 0
+    while business_settings_ids and time.monotonic() < deadline:
+        batches = {bs: ZATCASigningOutbox.get_due(bs, config['batch_size']) for bs in business_settings_ids}
+        try:
+            presigned = presign({bs: names for bs, names in batches.items() if names})
+        except Exception:
+            # Every entry can still be signed on its own
+            logger.error('Could not sign signing outbox entries ahead of time', exc_info=True)
+            presigned = {}
+
+        business_settings_ids = []
+        for bs, names in batches.items():
+            failed_before = failed
+            for name in names:
+                if time.monotonic() >= deadline:
+                    break
+
+                if sign_entry(name, presigned.get(name)):
+                    signed += 1
+                else:
+                    failed += 1
+
+            # Failed entries aren't due again until their next attempt, so a batch that only failed means we're done
+            if len(names) == config['batch_size'] and failed - failed_before < len(names):
+                business_settings_ids.append(bs)
+
+    logger.info(
+        f'Signing outbox of {business_settings_id or "all business settings"}: {signed} signed, {failed} failed'
+    )
+
+
+def presign(batches: Dict[str, List[str]]) -> Dict[str, SalesInvoiceAdditionalFields]:
+    """
+    Builds and signs the invoices of outbox entries ahead of insertion, as one chain per business settings. [batches]
+    maps business settings to their due entries, in submission order. Chains are signed concurrently.
+
+    Returns the additional fields to insert for each entry, keyed by entry name, with flags.presigned set. Entries
+    whose invoice couldn't be built or signed are left out, along with the rest of their chain, and go through the
+    regular insert path
+    """
+    chains: List[SigningChain] = []
+    built: Dict[str, tuple[ChainHead, list[tuple[str, SalesInvoiceAdditionalFields, str]]]] = {}
+    for business_settings_id, names in batches.items():
+        head = chain_sequencer.peek(business_settings_id)
+        entries, requests = [], []
+        settings = None
+        for offset, name in enumerate(names):
+            entry = cast(ZATCASigningOutbox, frappe.get_doc('ZATCA Signing Outbox', name))
+            additional_fields = SalesInvoiceAdditionalFields.create_for_invoice(entry.invoice, entry.invoice_doctype)
+            try:
+                # Only the first PIH is known before signing. The chain signer sets the PIH (and ICV) of every invoice
+                settings, invoice_xml = additional_fields.build_for_chain_position(
+                    head.next_counter + offset, head.invoice_hash
+                )
+            except Exception:
+                logger.warning(f'Could not build {entry.invoice_doctype} {entry.invoice} ahead of time', exc_info=True)
+                break
+
+            entries.append((name, additional_fields, invoice_xml))
+            requests.append(
+                SigningRequest(invoice_xml, additional_fields.get_cert_path(settings), settings.private_key_path)
+            )
+
+        if not requests:
+            continue
+
+        built[business_settings_id] = (head, entries)
+        chains.append(
+            SigningChain(
+                business_settings_id,
+                requests,
+                chain_position=(head.next_counter, head.invoice_hash),
+                native=settings.uses_native_signer,
+                zatca_cli_path=settings.zatca_cli_path,
+                java_home=settings.java_home,
+            )
+        )
+
+    results = sign_chains(chains) if chains else {}
+    presigned = {}
+    for business_settings_id, (head, entries) in built.items():
+        expected_head = head
+        for (name, additional_fields, invoice_xml), result in zip(entries, results[business_settings_id].results):
+            additional_fields.flags.presigned = PresignedInvoice(expected_head, invoice_xml, result)
+            presigned[name] = additional_fields
+            expected_head = ChainHead(head.counting_settings_id, expected_head.next_counter, result.invoice_hash)
+    return presigned
+
+
+def sign_entry(name: str, additional_fields: Optional[SalesInvoiceAdditionalFields] = None) -> bool:
+    """
+    Creates the additional fields of an outbox entry's invoice and deletes the entry. Returns whether it succeeded.
+    [additional_fields] are the ones built and signed ahead of time by [presign], if any
+    """
+    # Locks the entry until commit, in case another job got to it as well
+    if not frappe.db.get_value('ZATCA Signing Outbox', name, 'name', for_update=True):
+        frappe.db.rollback()
+        return True
+
+    entry = cast(ZATCASigningOutbox, frappe.get_doc('ZATCA Signing Outbox', name))
+    try:
+        additional_fields = additional_fields or SalesInvoiceAdditionalFields.create_for_invoice(
+            entry.invoice, entry.invoice_doctype
+        )
+        additional_fields.insert()
+        frappe.db.delete('ZATCA Signing Outbox', name)
+        frappe.db.commit()
+    except Exception:
+        frappe.db.rollback()
+        logger.error(f'Error signing {entry.invoice_doctype} {entry.invoice}', exc_info=True)
+        delay = min(get_config()['max_retry_minutes'], 2**entry.attempts)
+        entry.record_failure(frappe.get_traceback(), add_to_date(now_datetime(), minutes=delay))
+        frappe.db.commit()
+        return False
+
+    settings = ZATCABusinessSettings.for_invoice(entry.invoice, entry.invoice_doctype)
+    if settings and settings.is_live_sync:
+        _submit(additional_fields)
+    return True
+
+
+def _get_job_id(business_settings_id: Optional[str]) -> str:
+    return f'Sign E-Invoices {business_settings_id}' if business_settings_id else 'Sign E-Invoices'
+
+
+def _get_business_settings_without_jobs() -> List[str]:
+    # An outbox with a job of its own is left to it, rather than having two jobs race for the same entries
+    return [
+        business_settings_id
+        for business_settings_id in ZATCASigningOutbox.get_business_settings_with_due_entries()
+        if not is_job_enqueued(_get_job_id(business_settings_id))
+    ]
+
+
+def _submit(additional_fields: SalesInvoiceAdditionalFields) -> None:
+    # The invoice is already signed and committed. If it can't be sent now, the batch sync sends it later
+    try:
+        result = additional_fields.submit_to_zatca()
+        frappe.db.commit()
+        logger.info(f'{additional_fields.name}: {result.ok_value if is_ok(result) else result.err_value}')
+    except Exception:
+        frappe.db.rollback()
+        logger.error(f'Error submitting {additional_fields.name}', exc_info=True)
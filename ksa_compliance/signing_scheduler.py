@@ -0,0 +1,101 @@
+"""
+Signs invoices of independent chains in parallel.
+
+Every business settings instance (or EGS unit, for precomputed invoices) has its own invoice chain: invoice counter
+and previous invoice hash (PIH). Invoices within a chain must be signed in order, since each invoice embeds the hash
+of the one before it. Different chains share nothing, so they can be signed concurrently.
+
+Each chain is signed by a single thread, in submission order, through one CLI process (see
+[ksa_compliance.zatca_cli.iter_sign_invoices]) or the native signer. Threads are enough for parallelism here: CLI
+signing is spent waiting on a subprocess, and native signing spends most of its time in lxml/OpenSSL.
+
+The scheduler only signs, at the chain positions it's given. Appending the signed invoices to their chains is up to
+the caller. The signing outbox ([ksa_compliance.signing_outbox]) signs ahead of the hand-off, without holding the
+chains, and hands each invoice off with [ksa_compliance.chain_sequencer.hand_off], which signs it again if its chain
+moved meanwhile.
+"""
+
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import frappe
+
+from ksa_compliance import logger
+from ksa_compliance import zatca_cli, zatca_signer
+from ksa_compliance.zatca_cli import SigningRequest, SigningResult
+
+
+@dataclass
+class SigningChain:
+    """Invoices of a single chain, in chain order"""
+
+    key: str
+    """Identifies the chain, e.g. the business settings or EGS name"""
+
+    requests: List[SigningRequest]
+    chain_position: Optional[Tuple[int, str]]
+    """
+    The invoice counter (ICV) and PIH of the first invoice. The following invoices take the next counters, and the hash
+    of the invoice before them as PIH. If None, invoices are signed with the ICV and PIH they already have
+    """
+
+    native: bool = False
+    zatca_cli_path: Optional[str] = None
+    java_home: Optional[str] = None
+
+
+@dataclass
+class ChainResult:
+    results: List[SigningResult] = field(default_factory=list)
+    """Results for the signed prefix of the chain. All of the chain is signed, unless there's an error"""
+
+    error: Optional[str] = None
+    """The reason signing stopped, if it did. Requests after len(results) were not signed"""
+
+    @property
+    def is_complete(self) -> bool:
+        return self.error is None
+
+
+def get_concurrency() -> int:
+    """Returns the maximum number of chains to sign at once. Set 'zatca_signing_concurrency' in site config to override"""
+    return int(frappe.conf.get('zatca_signing_concurrency') or os.cpu_count() or 1)
+
+
+def sign_chains(chains: List[SigningChain], max_workers: Optional[int] = None) -> Dict[str, ChainResult]:
+    """Signs [chains] concurrently and returns the result of each, keyed by chain key"""
+    if len({chain.key for chain in chains}) != len(chains):
+        # Two threads signing the same chain would produce two invoices with the same PIH
+        raise ValueError('Each chain can only be scheduled once')
+
+    max_workers = min(max_workers or get_concurrency(), len(chains))
+    if max_workers <= 1:
+        return {chain.key: _sign_chain(chain) for chain in chains}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='zatca-sign') as executor:
+        # Each task runs in a copy of the caller's context so that frappe.local (site config, logger) is available.
+        # A context can't be entered by two threads at once, hence one copy per task
+        futures = {chain.key: executor.submit(contextvars.copy_context().run, _sign_chain, chain) for chain in chains}
+        return {key: future.result() for key, future in futures.items()}
+
+
+def _sign_chain(chain: SigningChain) -> ChainResult:
+    result = ChainResult()
+    if chain.native:
+        signed = zatca_signer.iter_sign_invoices(chain.requests, chain.chain_position)
+    else:
+        signed = zatca_cli.iter_sign_invoices(
+            chain.zatca_cli_path, chain.java_home, chain.requests, chain.chain_position
+        )
+
+    try:
+        for signing_result in signed:
+            result.results.append(signing_result)
+    except Exception as e:
+        logger.error(f'Signing chain {chain.key} stopped after {len(result.results)} invoices', exc_info=True)
+        result.error = str(e) or type(e).__name__
+
+    return result
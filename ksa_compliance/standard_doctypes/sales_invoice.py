@@ -10,6 +10,7 @@ from frappe import _
 from result import is_ok
 
 from ksa_compliance import logger
+from ksa_compliance import signing_outbox
 from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields import (
     SalesInvoiceAdditionalFields,
     is_b2b_customer,
@@ -22,6 +23,7 @@ from ksa_compliance.ksa_compliance.doctype.zatca_phase_1_business_settings.zatca
 from ksa_compliance.ksa_compliance.doctype.zatca_precomputed_invoice.zatca_precomputed_invoice import (
     ZATCAPrecomputedInvoice,
 )
+from ksa_compliance.ksa_compliance.doctype.zatca_signing_outbox.zatca_signing_outbox import ZATCASigningOutbox
 
 from ksa_compliance.translation import ft
 
@@ -64,8 +66,15 @@ def create_sales_invoice_additional_fields_doctype(self: SalesInvoice | POSInvoi
         logger.info(f"Skipping additional fields for {self.name} because it's consolidated")
         return
 
-    si_additional_fields_doc = SalesInvoiceAdditionalFields.create_for_invoice(self.name, self.doctype)
     precomputed_invoice = ZATCAPrecomputedInvoice.for_invoice(self.name)
+    if settings.uses_deferred_signing and not precomputed_invoice:
+        # The invoice is signed (and sent, for live sync) by the signing outbox once the submission commits
+        logger.info(f'Deferring additional fields for {self.name} to the signing outbox')
+        ZATCASigningOutbox.add(self.doctype, self.name, settings.name)
+        signing_outbox.enqueue_signing(settings.name, enqueue_after_commit=True)
+        return
+
+    si_additional_fields_doc = SalesInvoiceAdditionalFields.create_for_invoice(self.name, self.doctype)
     is_live_sync = settings.is_live_sync
     if precomputed_invoice:
         logger.info(f'Using precomputed invoice {precomputed_invoice.name} for {self.name}')
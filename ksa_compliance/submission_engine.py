@@ -0,0 +1,132 @@
+"""
+Sends invoices to ZATCA (reporting/clearance) concurrently.
+
+Sending an invoice is mostly waiting on the network, so the batch sync prepares a batch of submissions, sends them with
+a bounded number of API calls in flight and applies the responses as they arrive. Only the API calls run on worker
+threads. Preparing submissions and applying responses use the database, so they stay on the caller's thread (a
+database connection can't be shared between threads).
+
+Concurrency is bounded per group (business settings), since each group has its own credentials and backlog. Calls go
+through the keep-alive sessions of [ksa_compliance.zatca_api], so a group never has more calls in flight than the
+session's connection pool.
+"""
+
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, Tuple
+
+from result import Err, Result, is_err
+
+from ksa_compliance import fatoora_gateway
+from ksa_compliance import logger
+from ksa_compliance import zatca_api as api
+from ksa_compliance.invoice import InvoiceType
+from ksa_compliance.zatca_api import ReportOrClearInvoiceError, ReportOrClearInvoiceResult, ZatcaSendMode
+
+DEFAULT_CONCURRENCY = 4
+
+
+@dataclass
+class Submission:
+    """Everything needed to report or clear an invoice, so that sending it doesn't need the database"""
+
+    key: str
+    """Identifies the submission, e.g. the sales invoice additional fields name"""
+
+    group: str
+    """Submissions of the same group (business settings) share the concurrency limit"""
+
+    concurrency: int
+    server_url: str
+    invoice_xml: str
+    invoice_uuid: str
+    invoice_hash: str
+    invoice_type: InvoiceType
+    security_token: str
+    secret: str
+    mode: ZatcaSendMode
+
+
+@dataclass
+class SubmissionResponse:
+    result: Result[ReportOrClearInvoiceResult, ReportOrClearInvoiceError]
+    status_code: int
+
+    sent: bool = True
+    """False if the invoice was held back by the rate limiter or circuit breaker (see [ksa_compliance.fatoora_gateway]).
+    Nothing should be recorded for it, so that it's sent again by the next sync"""
+
+
+def get_concurrency_limit(concurrency: int) -> int:
+    """Returns the number of API calls a group can have in flight for a configured concurrency (0 for the default)"""
+    return max(1, min(concurrency or DEFAULT_CONCURRENCY, api.POOL_SIZE))
+
+
+def send(submission: Submission) -> SubmissionResponse:
+    """Clears a standard invoice or reports a simplified one. Doesn't use the database, so it's safe to call from any
+    thread"""
+    permit = fatoora_gateway.acquire(submission.server_url, submission.security_token)
+    if is_err(permit):
+        return SubmissionResponse(Err(ReportOrClearInvoiceError('', permit.err_value)), 0, sent=False)
+
+    send_invoice = api.clear_invoice if submission.invoice_type == 'Standard' else api.report_invoice
+    result, status_code = send_invoice(
+        server=submission.server_url,
+        invoice_xml=submission.invoice_xml,
+        invoice_uuid=submission.invoice_uuid,
+        invoice_hash=submission.invoice_hash,
+        security_token=submission.security_token,
+        secret=submission.secret,
+        mode=submission.mode,
+    )
+    fatoora_gateway.record(submission.server_url, submission.security_token, status_code)
+    return SubmissionResponse(result, status_code)
+
+
+def send_all(submissions: Iterable[Submission]) -> Iterator[Tuple[Submission, SubmissionResponse]]:
+    """
+    Sends [submissions] concurrently and yields each with its response in completion order, so that the caller can
+    apply responses while the rest are in flight.
+
+    Never throws for a failed call: failures are returned as error responses with status code 0, which maps to the
+    'Resend' status. Invoices held back by the gateway's rate limiter or circuit breaker are returned unsent
+    """
+    groups: Dict[str, int] = {}
+    pending = []
+    for submission in submissions:
+        groups.setdefault(submission.group, get_concurrency_limit(submission.concurrency))
+        pending.append(submission)
+
+    if not pending:
+        return
+
+    if sum(groups.values()) == 1:
+        for submission in pending:
+            yield submission, _send_safely(submission)
+        return
+
+    # One executor per group, sized to its limit, so that a large group can't take the threads of a small one
+    with ExitStack() as stack:
+        executors = {
+            group: stack.enter_context(ThreadPoolExecutor(max_workers=limit, thread_name_prefix='zatca-send'))
+            for group, limit in groups.items()
+        }
+        # Each task runs in a copy of the caller's context so that frappe.local (site config, logger) is available.
+        # A context can't be entered by two threads at once, hence one copy per task
+        futures: Dict[Future, Submission] = {
+            executors[submission.group].submit(contextvars.copy_context().run, _send_safely, submission): submission
+            for submission in pending
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def _send_safely(submission: Submission) -> SubmissionResponse:
+    try:
+        return send(submission)
+    except Exception as e:
+        # api_call handles request errors. This covers anything unexpected while building the request
+        logger.error(f'Error sending {submission.key} to ZATCA', exc_info=True)
+        return SubmissionResponse(Err(ReportOrClearInvoiceError('', str(e) or type(e).__name__)), 0)
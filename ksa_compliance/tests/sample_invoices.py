@@ -0,0 +1,207 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+"""
+Sample invoices rendered from templates/e_invoice.xml, filled in the same shape as
+[ksa_compliance.output_models.e_invoice_output_model.Einvoice] fills it in, so signing and validation tests run on
+real template output
+"""
+
+import copy
+
+from ksa_compliance.generate_xml import generate_xml_file
+
+SIMPLIFIED = '0200000'
+STANDARD = '0100000'
+
+PIH = 'NWZlY2ViNjZmZmM4NmYzOGQ5NTI3ODZjNmQ2OTZjNzljMmRiYzIzOWRkNGU5MWI0NjcyOWQ3M2EyN2ZiNTdlOQ=='
+
+STANDARD_RATE = {'percent': 15.0, 'zatca_tax_category_id': {'tax_category_code': 'S'}}
+EXEMPT = {
+    'percent': 0.0,
+    'zatca_tax_category_id': {
+        'tax_category_code': 'E',
+        'reason_code': 'VATEX-SA-29',
+        'arabic_reason': 'الخدمات المالية',
+    },
+}
+
+# 80 Arabic letters: 160 bytes in UTF-8, which needs the full byte range of the QR code's length field
+LONG_ARABIC_NAME = 'شركة ' + 'ا' * 76
+
+SELLER = {
+    'party_identifications': {'CRN': '1010010000'},
+    'street_name': 'الأمير سلطان',
+    'building_number': '2322',
+    'address_additional_number': '1234',
+    'city_subdivision_name': 'المربع',
+    'city_name': 'الرياض',
+    'postal_zone': '23333',
+    'country_code': 'sa',
+}
+
+BUYER = {
+    'street_name': 'صلاح الدين',
+    'building_number': '1111',
+    'city_subdivision_name': 'المروج',
+    'city_name': 'الرياض',
+    'postal_zone': '12222',
+    'country_code': 'sa',
+    'company_id': '399999999800003',
+    'registration_name': 'شركة نماذج فاتورة المحدودة',
+}
+
+BUSINESS_SETTINGS = {'company_id': '399999999900003', 'registration_name': 'شركة اختبار'}
+
+
+def _line(idx: int, name: str, qty: float, amount: float, tax_category: dict, **kwargs) -> dict:
+    tax_amount = round(amount * tax_category['percent'] / 100, 2)
+    return {
+        'idx': idx,
+        'item_name': name,
+        'qty': qty,
+        'amount': amount,
+        'tax_amount': tax_amount,
+        'rounding_amount': amount + tax_amount,
+        'tax_category': tax_category,
+        **kwargs,
+    }
+
+
+# Standard rated and exempt lines, with a line discount and a document level allowance on the standard rated lines
+MIXED_INVOICE = {
+    'id': 'ACC-SINV-2026-00001',
+    'uuid': '3cf5ee18-ee25-44ea-a444-2c37ba7f28be',
+    'issue_date': '2026-01-14',
+    'issue_time': '10:26:03',
+    'invoice_type_code': '388',
+    'currency_code': 'SAR',
+    'tax_currency': 'SAR',
+    'invoice_counter_value': 1,
+    'pih': PIH,
+    'delivery_date': '2026-01-14',
+    'payment_means_type_code': '10',
+    'allowance_charge': [
+        {
+            'allowance_charge_reason_code': 95,
+            'allowance_charge_reason': 'Discount',
+            'amount': 10.0,
+            'tax_category': STANDARD_RATE,
+        }
+    ],
+    'tax_total': {
+        'tax_subtotal': [
+            {'taxable_amount': 126.0, 'tax_amount': 18.9, 'tax_category': STANDARD_RATE},
+            {'taxable_amount': 50.0, 'tax_amount': 0.0, 'tax_category': EXEMPT},
+        ]
+    },
+    'base_total_taxes_and_charges': 18.9,
+    'total_taxes_and_charges': 18.9,
+    'line_extension_amount': 186.0,
+    'net_total': 176.0,
+    'grand_total': 194.9,
+    'allowance_total_amount': 10.0,
+    'payable_amount': 194.9,
+    'item_lines': [
+        _line(1, 'Item A', 2, 100.0, STANDARD_RATE),
+        _line(
+            2,
+            'Item B',
+            1,
+            36.0,
+            STANDARD_RATE,
+            discount_amount=4.0,
+            base_amount=40.0,
+            allowance_charge_reason_code=95,
+            allowance_charge_reason='Discount',
+        ),
+        _line(3, 'Item C', 5, 50.0, EXEMPT),
+    ],
+}
+
+SINGLE_LINE_TOTALS = {
+    'allowance_charge': [],
+    'tax_total': {'tax_subtotal': [{'taxable_amount': 100.0, 'tax_amount': 15.0, 'tax_category': STANDARD_RATE}]},
+    'base_total_taxes_and_charges': 15.0,
+    'total_taxes_and_charges': 15.0,
+    'line_extension_amount': 100.0,
+    'net_total': 100.0,
+    'grand_total': 115.0,
+    'allowance_total_amount': 0.0,
+    'payable_amount': 115.0,
+    'item_lines': [_line(1, 'Item A', 1, 100.0, STANDARD_RATE)],
+}
+
+PREPAYMENT_INVOICE = {
+    'currency': 'SAR',
+    'prepaid_amount': 115.0,
+    'invoice_lines': [
+        {
+            'idx': 2,
+            'uuid': 'f6ab4e4b-0b38-4c2b-9f4b-4e7ae0c3c6b7',
+            'document_reference': {
+                'id': 'ACC-SINV-2026-00000',
+                'issue_date': '2026-01-10',
+                'issue_time': '09:00:00',
+                'document_type_code': 386,
+            },
+            'tax_total': {
+                'tax_subtotal': {
+                    'taxable_amount': 100.0,
+                    'tax_amount': 15.0,
+                    'tax_category_id': 'S',
+                    'tax_percent': 15.0,
+                    'tax_scheme': 'VAT',
+                }
+            },
+            'item': {'name': 'Prepayment', 'tax_category': 'S', 'tax_percent': 15.0, 'tax_scheme': 'VAT'},
+            'tax_category': {},
+        }
+    ],
+}
+
+SCENARIOS = {
+    'simplified': {'invoice': {'invoice_type_transaction': SIMPLIFIED}},
+    'standard': {'invoice': {'invoice_type_transaction': STANDARD}, 'buyer_details': BUYER},
+    'credit_note': {
+        'invoice': {
+            'invoice_type_transaction': STANDARD,
+            'invoice_type_code': '381',
+            'billing_references': ['ACC-SINV-2026-00000'],
+            'instruction_note': 'Returned goods',
+        },
+        'buyer_details': BUYER,
+    },
+    'debit_note': {
+        'invoice': {
+            'invoice_type_transaction': SIMPLIFIED,
+            'invoice_type_code': '383',
+            'billing_references': ['ACC-SINV-2026-00000'],
+            'instruction_note': 'Price adjustment',
+            **SINGLE_LINE_TOTALS,
+        }
+    },
+    'prepayment': {
+        'invoice': {'invoice_type_transaction': STANDARD, **SINGLE_LINE_TOTALS, 'payable_amount': 0.0},
+        'buyer_details': BUYER,
+        'prepayment_invoice': PREPAYMENT_INVOICE,
+    },
+    'long_arabic_name': {
+        'invoice': {'invoice_type_transaction': SIMPLIFIED},
+        'business_settings': {'registration_name': LONG_ARABIC_NAME},
+    },
+}
+
+
+def render(scenario: str, **business_settings) -> str:
+    """Renders the unsigned invoice XML of the given scenario. [business_settings] override the seller's settings"""
+    overrides = SCENARIOS[scenario]
+    return generate_xml_file(
+        {
+            'invoice': {**copy.deepcopy(MIXED_INVOICE), **overrides['invoice']},
+            'seller_details': SELLER,
+            'buyer_details': overrides.get('buyer_details', {}),
+            'business_settings': {**BUSINESS_SETTINGS, **overrides.get('business_settings', {}), **business_settings},
+            'prepayment_invoice': overrides.get('prepayment_invoice', {}),
+        }
+    )
@@ -0,0 +1,84 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import datetime
+import time
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance.background_jobs import get_shard_status, summarize_sync_run, sync_e_invoices
+
+
+class TestSyncRuns(FrappeTestCase):
+    def test_summary_combines_shards(self):
+        summary = summarize_sync_run(
+            {
+                'ZATCA Business Settings A': {'status': 'Finished', 'counts': {'Accepted': 3, 'Resend': 1}},
+                'ZATCA EGS B': {'status': 'Running', 'counts': {'Accepted': 2, 'Rejected': 1}},
+            }
+        )
+
+        self.assertEqual(summary['status'], 'Running')
+        self.assertEqual(summary['counts'], {'Accepted': 5, 'Resend': 1, 'Rejected': 1})
+
+    def test_summary_status(self):
+        self.assertEqual(summarize_sync_run({})['status'], 'Not Started')
+        self.assertEqual(
+            summarize_sync_run({'a': {'status': 'Finished'}, 'b': {'status': 'Finished'}})['status'], 'Finished'
+        )
+        self.assertEqual(
+            summarize_sync_run({'a': {'status': 'Finished'}, 'b': {'status': 'Failed'}})['status'], 'Failed'
+        )
+        self.assertEqual(
+            summarize_sync_run({'a': {'status': 'Queued'}, 'b': {'status': 'Failed'}})['status'], 'Running'
+        )
+        self.assertEqual(
+            summarize_sync_run({'a': {'status': 'Finished'}, 'b': {'status': 'Cancelled'}})['status'], 'Cancelled'
+        )
+
+    def test_throughput_and_eta(self):
+        now = datetime.datetime.now()
+        running = get_shard_status(
+            frappe._dict(
+                name='a',
+                shard='ZATCA Business Settings A',
+                company='A',
+                status='Running',
+                counts='{"Accepted": 200}',
+                processed=200,
+                total=500,
+                started_at=now - datetime.timedelta(seconds=100),
+            )
+        )
+        finished = get_shard_status(
+            frappe._dict(
+                name='b',
+                shard='ZATCA EGS B',
+                company='A',
+                status='Finished',
+                counts='{"Accepted": 50}',
+                processed=50,
+                total=50,
+                started_at=now - datetime.timedelta(seconds=100),
+                finished_at=now - datetime.timedelta(seconds=50),
+            )
+        )
+
+        self.assertAlmostEqual(running['rate'], 2, places=1)
+        self.assertEqual(running['remaining'], 300)
+        self.assertAlmostEqual(running['eta'], 150, delta=2)
+        self.assertEqual(finished['rate'], 0)
+        self.assertIsNone(finished['eta'])
+
+        summary = summarize_sync_run({'a': running, 'b': finished})
+        self.assertEqual(summary['processed'], 250)
+        self.assertEqual(summary['remaining'], 300)
+        self.assertEqual(summary['counts'], {'Accepted': 250})
+
+    def test_sync_stops_at_deadline(self):
+        progress = sync_e_invoices('2026-01-01', after_name='SIAF-1', deadline=time.monotonic() - 1)
+
+        self.assertFalse(progress.is_complete)
+        self.assertEqual(progress.last_name, 'SIAF-1')
+        self.assertEqual(progress.counts, {})
@@ -0,0 +1,181 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+from typing import Dict, List
+from unittest.mock import patch
+
+import frappe
+from erpnext.accounts.doctype.sales_invoice.test_sales_invoice import create_sales_invoice
+from frappe.model.document import Document
+from frappe.tests.utils import FrappeTestCase
+from result import Err
+
+from ksa_compliance import background_jobs
+from ksa_compliance.batch_context import BatchContext
+from ksa_compliance.group_commit import GroupCommit
+from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import ZATCABusinessSettings
+from ksa_compliance.submission_engine import Submission, SubmissionResponse
+from ksa_compliance.zatca_api import ReportOrClearInvoiceError
+
+COMPANY = '_Test Company'
+DEVICE_ID = '_Test Batch Device'
+INVOICE_COUNT = 8
+
+
+class TestBatchContext(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Only the settings created below may be picked for the company
+        frappe.db.set_value('ZATCA Business Settings', {'company': COMPANY, 'status': 'Active'}, 'status', 'Revoked')
+        ZATCABusinessSettings.clear_cache()
+
+        cls.settings = frappe.get_doc(
+            {
+                'doctype': 'ZATCA Business Settings',
+                'company': COMPANY,
+                'country': 'Saudi Arabia',
+                'currency': 'SAR',
+                'status': 'Active',
+                'fatoora_server': 'Sandbox',
+                'type_of_business_transactions': 'Let the system decide (both)',
+                'production_security_token': 'settings-token',
+                'production_secret': 'settings-secret',
+            }
+        ).insert(ignore_mandatory=True)
+        frappe.get_doc(
+            {
+                'doctype': 'ZATCA EGS',
+                'business_settings': cls.settings.name,
+                'egs_type': 'POS Device',
+                'unit_common_name': DEVICE_ID,
+                'unit_serial': '1-TST|2-TST|3-BATCH',
+                'production_security_token': 'egs-token',
+                'production_secret': 'egs-secret',
+            }
+        ).insert()
+
+        # Every other invoice is precomputed by the EGS, and every other customer has a VAT number (standard invoices)
+        cls.names: List[str] = []
+        cls.expected: Dict[str, tuple] = {}
+        for i in range(INVOICE_COUNT):
+            customer = _create_customer(i, vat_registration_number='300000000000003' if i % 2 else None)
+            invoice = create_sales_invoice(company=COMPANY, customer=customer, do_not_submit=True)
+            precomputed_invoice = _create_precomputed_invoice(invoice.name) if i % 2 == 0 else None
+            additional_fields = _create_additional_fields(invoice.name, i + 1, precomputed_invoice)
+
+            cls.names.append(additional_fields.name)
+            cls.expected[additional_fields.name] = (
+                'egs-token' if precomputed_invoice else 'settings-token',
+                'egs-secret' if precomputed_invoice else 'settings-secret',
+                'Standard' if i % 2 else 'Simplified',
+            )
+
+    def _submit(self, names: List[str]) -> tuple[List[Submission], int]:
+        """
+        Runs [background_jobs.submit_batch] on [names], holding back every submission. Returns the submissions prepared
+        for sending and the number of queries
+        """
+        submissions = []
+
+        def send_all(batch):
+            for submission in batch:
+                submissions.append(submission)
+                yield submission, SubmissionResponse(Err(ReportOrClearInvoiceError('', 'Held back')), 0, sent=False)
+
+        with (
+            patch.object(background_jobs.submission_engine, 'send_all', side_effect=send_all),
+            patch.object(frappe.db, 'sql', wraps=frappe.db.sql) as sql,
+        ):
+            counts = background_jobs.submit_batch(names, GroupCommit(max_invoices=100, interval_ms=60_000))
+
+        self.assertEqual(counts, {'Not Sent': len(names)})
+        return submissions, sql.call_count
+
+    def test_batch_prepares_each_invoice_from_its_records(self):
+        submissions, _ = self._submit(self.names)
+
+        self.assertEqual(
+            {
+                submission.key: (submission.security_token, submission.secret, submission.invoice_type)
+                for submission in submissions
+            },
+            self.expected,
+        )
+
+    def test_queries_per_invoice_do_not_grow_with_batch_size(self):
+        # Business settings, customers and EGS are loaded once per batch, and settings and secrets are cached across
+        # batches. Warm those caches, so that each batch below has the same fixed cost
+        self._submit(self.names)
+        queries = {size: self._submit(self.names[:size])[1] for size in (2, 4, 8)}
+
+        # Each invoice only costs loading its own additional fields document
+        per_invoice = (queries[4] - queries[2]) / 2
+        self.assertGreater(per_invoice, 0)
+        self.assertEqual((queries[8] - queries[4]) / 4, per_invoice)
+
+    def test_missing_records(self):
+        context = BatchContext.load(
+            [
+                frappe._dict(
+                    name='SIAF-0',
+                    invoice_doctype='Sales Invoice',
+                    sales_invoice='_Test Missing Invoice',
+                    precomputed_invoice='_Test Missing Precomputed Invoice',
+                )
+            ]
+        )
+
+        self.assertIsNone(context.get_settings('Sales Invoice', '_Test Missing Invoice'))
+        self.assertIsNone(context.get_egs('_Test Missing Precomputed Invoice'))
+
+
+def _create_customer(i: int, vat_registration_number: str | None) -> str:
+    return (
+        frappe.get_doc(
+            {
+                'doctype': 'Customer',
+                'customer_name': f'_Test Batch Customer {i}',
+                'customer_group': '_Test Customer Group',
+                'territory': '_Test Territory',
+                'custom_vat_registration_number': vat_registration_number,
+            }
+        )
+        .insert()
+        .name
+    )
+
+
+def _create_precomputed_invoice(sales_invoice: str) -> str:
+    return (
+        frappe.get_doc(
+            {
+                'doctype': 'ZATCA Precomputed Invoice',
+                'sales_invoice': sales_invoice,
+                'device_id': DEVICE_ID,
+                'invoice_uuid': frappe.generate_hash(),
+                'invoice_hash': 'hash',
+                'invoice_xml': '<Invoice/>',
+            }
+        )
+        .insert()
+        .name
+    )
+
+
+def _create_additional_fields(sales_invoice: str, invoice_counter: int, precomputed_invoice: str | None) -> Document:
+    # Marked precomputed, so that inserting doesn't build and sign the XML. Without a precomputed invoice, the
+    # invoice is sent with the credentials of the business settings
+    return frappe.get_doc(
+        {
+            'doctype': 'Sales Invoice Additional Fields',
+            'invoice_doctype': 'Sales Invoice',
+            'sales_invoice': sales_invoice,
+            'invoice_counter': invoice_counter,
+            'uuid': frappe.generate_hash(),
+            'invoice_hash': 'hash',
+            'invoice_xml': '<Invoice/>',
+            'precomputed': 1,
+            'precomputed_invoice': precomputed_invoice,
+        }
+    ).insert()
@@ -0,0 +1,92 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import tempfile
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from lxml import etree
+
+from ksa_compliance import chain_sequencer, zatca_signer
+from ksa_compliance.chain_sequencer import ChainHead
+from ksa_compliance.tests.test_zatca_signer import SIMPLIFIED, UNSIGNED_INVOICE, create_credentials
+
+BUSINESS_SETTINGS = '_Test Chain Sequencer Settings'
+
+
+class TestChainSequencer(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        _, _, cert_path, key_path = create_credentials(cls.tmp_dir.name)
+        cls.credentials = zatca_signer.load_credentials(cert_path, key_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.signed = []
+        self.writes = []
+        set_value = patch.object(frappe.db, 'set_value', side_effect=lambda *args: self.writes.append(args))
+        set_value.start()
+        self.addCleanup(set_value.stop)
+
+    def _sign(self, invoice_xml: str):
+        self.signed.append(invoice_xml)
+        return zatca_signer.sign_invoice_with_credentials(invoice_xml, self.credentials)
+
+    def _hand_off(self, expected: ChainHead, actual: ChainHead):
+        invoice_xml = UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED)
+        result = self._sign(invoice_xml)
+        with patch.object(chain_sequencer, '_read_head', return_value=actual) as read_head:
+            head, result = chain_sequencer.hand_off(BUSINESS_SETTINGS, expected, invoice_xml, result, self._sign)
+        read_head.assert_called_once_with(BUSINESS_SETTINGS, for_update=True)
+        return head, result
+
+    def test_uncontended_hand_off_keeps_signed_invoice(self):
+        head = ChainHead('counting-1', 0, 'hash-0')
+
+        taken, result = self._hand_off(head, head)
+
+        self.assertEqual(taken, head)
+        self.assertEqual(len(self.signed), 1)
+        self.assertEqual(
+            self.writes,
+            [
+                (
+                    'ZATCA Invoice Counting Settings',
+                    'counting-1',
+                    {'invoice_counter': 1, 'previous_invoice_hash': result.invoice_hash},
+                )
+            ],
+        )
+
+    def test_contended_hand_off_signs_at_next_position(self):
+        expected = ChainHead('counting-1', 0, 'hash-0')
+        actual = ChainHead('counting-1', 5, 'hash-5')
+
+        taken, result = self._hand_off(expected, actual)
+
+        self.assertEqual(taken, actual)
+        self.assertEqual(len(self.signed), 2)
+        root = etree.fromstring(result.signed_invoice_xml.encode())
+        self.assertEqual(root.xpath(zatca_signer.ICV_XPATH, namespaces=zatca_signer.NS)[0].text, '6')
+        self.assertEqual(zatca_signer.get_previous_invoice_hash(root), 'hash-5')
+        self.assertEqual(result.invoice_hash, zatca_signer.compute_invoice_hash(result.signed_invoice_xml))
+        self.assertEqual(self.writes[0][2], {'invoice_counter': 6, 'previous_invoice_hash': result.invoice_hash})
+
+    def test_peek_prefers_committed_head(self):
+        chain_sequencer.clear_cache(BUSINESS_SETTINGS)
+        committed = ChainHead('counting-1', 7, 'hash-7')
+        chain_sequencer._publish_head(BUSINESS_SETTINGS, committed)
+
+        with patch.object(chain_sequencer, '_read_head') as read_head:
+            self.assertEqual(chain_sequencer.peek(BUSINESS_SETTINGS), committed)
+            chain_sequencer.clear_cache(BUSINESS_SETTINGS)
+            chain_sequencer.peek(BUSINESS_SETTINGS)
+
+        read_head.assert_called_once_with(BUSINESS_SETTINGS, for_update=False)
@@ -0,0 +1,173 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import os
+from typing import cast
+from unittest.mock import patch
+
+import frappe
+from erpnext.accounts.doctype.sales_invoice.sales_invoice import SalesInvoice
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance.generate_xml import generate_xml_file
+
+# e_invoice_output_model and the additional fields doctype import each other, and only load in this order
+from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields import (  # noqa: F401
+    sales_invoice_additional_fields,
+)
+from ksa_compliance.output_models import e_invoice_output_model
+from ksa_compliance.output_models.e_invoice_output_model import Einvoice
+
+# Invoice XML rendered from the same documents by the dict-per-line implementation of the invoice lines, which
+# LineItems replaced. LineItems must render it byte for byte
+MIXED_INVOICE_XML = os.path.join(os.path.dirname(__file__), 'golden', 'mixed_invoice.xml')
+
+SALES_TAXES_TEMPLATE = 'KSA VAT 15%'
+STANDARD_TEMPLATE = 'KSA VAT 15% Item'
+EXEMPT_TEMPLATE = 'KSA Financial Services'
+
+ITEM_TAX_TEMPLATES = [
+    frappe._dict(name=STANDARD_TEMPLATE, custom_zatca_item_tax_category='Standard rate', custom_category_reason=None),
+    frappe._dict(
+        name=EXEMPT_TEMPLATE,
+        custom_zatca_item_tax_category='Exempt from Tax || Financial services mentioned in Article 29 of the VAT '
+        'Regulations',
+        custom_category_reason=None,
+    ),
+]
+ITEM_TAX_TEMPLATE_DETAILS = [
+    frappe._dict(parent=STANDARD_TEMPLATE, idx=1, tax_rate=15.0),
+    frappe._dict(parent=EXEMPT_TEMPLATE, idx=1, tax_rate=0.0),
+]
+
+
+def _item(idx: int, name: str, qty: float, rate: float, net_amount: float, tax_rate: float, **kwargs) -> dict:
+    return {
+        'idx': idx,
+        'item_code': name,
+        'item_name': name,
+        'uom': 'Nos',
+        'qty': qty,
+        'rate': rate,
+        'amount': qty * rate,
+        'net_amount': net_amount,
+        'discount_amount': 0.0,
+        'discount_percentage': 0.0,
+        'tax_rate': tax_rate,
+        'tax_amount': round(net_amount * tax_rate / 100, 2),
+        'item_tax_template': None,
+        **kwargs,
+    }
+
+
+def create_mixed_invoice() -> SalesInvoice:
+    """
+    A standard invoice with a 5% discount on the net total: standard rated lines of an item tax template and of the
+    invoice's sales taxes and charges template (one of them with a line discount), and two exempt lines
+    """
+    return cast(
+        SalesInvoice,
+        frappe.get_doc(
+            doctype='Sales Invoice',
+            name='ACC-SINV-2026-00042',
+            company='_Test Company',
+            customer_name='شركة نماذج فاتورة المحدودة',
+            posting_date='2026-01-14',
+            posting_time='10:26:03',
+            due_date='2026-01-21',
+            currency='SAR',
+            is_return=0,
+            is_debit_note=0,
+            taxes_and_charges=SALES_TAXES_TEMPLATE,
+            taxes=[{'rate': 15.0, 'tax_amount': 19.38, 'included_in_print_rate': 0}],
+            items=[
+                _item(1, 'Item A', 2, 50.0, 95.0, 15.0, item_tax_template=STANDARD_TEMPLATE),
+                _item(2, 'Item B', 1, 36.0, 34.2, 15.0, discount_amount=4.0, discount_percentage=10.0),
+                _item(3, 'Item C', 5, 10.0, 47.5, 0.0, item_tax_template=EXEMPT_TEMPLATE),
+                _item(4, 'Item D', 1, 20.0, 19.0, 0.0, item_tax_template=EXEMPT_TEMPLATE),
+            ],
+            total=206.0,
+            discount_amount=10.3,
+            additional_discount_percentage=5.0,
+            apply_discount_on='Net Total',
+            custom_zatca_discount_reason='Discount',
+            net_total=195.7,
+            total_taxes_and_charges=19.38,
+            base_total_taxes_and_charges=19.38,
+            grand_total=215.08,
+            rounding_adjustment=-0.08,
+            outstanding_amount=215.0,
+            advances=[],
+        ),
+    )
+
+
+def create_additional_fields() -> frappe._dict:
+    return frappe._dict(
+        doctype='Sales Invoice Additional Fields',
+        invoice_doctype='Sales Invoice',
+        sales_invoice='ACC-SINV-2026-00042',
+        uuid='3cf5ee18-ee25-44ea-a444-2c37ba7f28be',
+        invoice_type_code='388',
+        invoice_type_transaction='0100000',
+        payment_means_type_code='10',
+        tax_currency='SAR',
+        invoice_counter=42,
+        previous_invoice_hash='NWZlY2ViNjZmZmM4NmYzOGQ5NTI3ODZjNmQ2OTZjNzljMmRiYzIzOWRkNGU5MWI0NjcyOWQ3M2EyN2ZiNTdlOQ==',
+        other_buyer_ids=[],
+        buyer_street_name='صلاح الدين',
+        buyer_building_number='1111',
+        buyer_city='الرياض',
+        buyer_postal_code='12222',
+        buyer_district='المروج',
+        buyer_country_code='SA',
+        buyer_vat_registration_number='399999999800003',
+    )
+
+
+def create_business_settings() -> frappe._dict:
+    return frappe._dict(
+        doctype='ZATCA Business Settings',
+        enable_branch_configuration=0,
+        other_ids=[frappe._dict(type_code='CRN', value='1010010000')],
+        street='الأمير سلطان',
+        building_number='2322',
+        city='الرياض',
+        postal_code='23333',
+        district='المربع',
+        country_code='SA',
+        vat_registration_number='399999999900003',
+        seller_name='شركة اختبار',
+    )
+
+
+def _get_all(doctype: str, *args, **kwargs) -> list:
+    return {'Item Tax Template': ITEM_TAX_TEMPLATES, 'Item Tax Template Detail': ITEM_TAX_TEMPLATE_DETAILS}[doctype]
+
+
+def _get_value(doctype: str, *args, **kwargs):
+    return {
+        'Sales Taxes and Charges Template': 'KSA VAT',
+        'Sales Taxes and Charges': 15.0,
+        'Tax Category': ('Standard rate', None),
+    }[doctype]
+
+
+def render_mixed_invoice() -> str:
+    """Renders the mixed invoice through [Einvoice], with the documents and tax lookups it reads kept in memory"""
+    invoice = create_mixed_invoice()
+    with (
+        patch.object(frappe, 'get_doc', return_value=invoice),
+        patch.object(
+            e_invoice_output_model.ZATCABusinessSettings, 'for_invoice', return_value=create_business_settings()
+        ),
+        patch.object(frappe.db, 'get_all', side_effect=_get_all),
+        patch.object(frappe.db, 'get_value', side_effect=_get_value),
+    ):
+        return generate_xml_file(Einvoice(create_additional_fields(), invoice_type='Standard').result)
+
+
+class TestEinvoice(FrappeTestCase):
+    def test_mixed_invoice_matches_golden_file(self):
+        with open(MIXED_INVOICE_XML, 'rt', encoding='utf-8') as f:
+            self.assertEqual(render_mixed_invoice(), f.read())
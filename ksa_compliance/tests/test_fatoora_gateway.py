@@ -0,0 +1,67 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import uuid
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from result import is_err, is_ok
+
+from ksa_compliance import fatoora_gateway
+
+
+class TestFatooraGateway(FrappeTestCase):
+    def setUp(self):
+        # A server of our own keeps the state of each test apart
+        self.server_url = f'https://{uuid.uuid4().hex}.example.com/'
+
+    def test_circuit_breaker(self):
+        config = {'zatca_circuit_breaker': {'failure_threshold': 3, 'cooldown': 0}, 'zatca_rate_limit': {'rate': 0}}
+        with patch.dict(frappe.conf, config):
+            for _ in range(2):
+                self.assertTrue(is_ok(fatoora_gateway.acquire(self.server_url, 'token')))
+                fatoora_gateway.record(self.server_url, 'token', 503)
+
+            # A rejection is an answer about the invoice, so it resets the consecutive failures
+            fatoora_gateway.record(self.server_url, 'token', 400)
+            fatoora_gateway.record(self.server_url, 'token', 503)
+            self.assertTrue(is_ok(fatoora_gateway.acquire(self.server_url, 'token')))
+
+            for _ in range(3):
+                fatoora_gateway.record(self.server_url, 'token', 0)
+
+            # Open, with the cooldown passed: a single probe is let through
+            self.assertTrue(is_ok(fatoora_gateway.acquire(self.server_url, 'token')))
+            self.assertTrue(is_err(fatoora_gateway.acquire(self.server_url, 'token')))
+
+            # A failed probe reopens the breaker, and a successful one closes it
+            fatoora_gateway.record(self.server_url, 'token', 500)
+            self.assertTrue(is_ok(fatoora_gateway.acquire(self.server_url, 'token')))
+            fatoora_gateway.record(self.server_url, 'token', 200)
+            self.assertTrue(is_ok(fatoora_gateway.acquire(self.server_url, 'token')))
+            self.assertTrue(is_ok(fatoora_gateway.acquire(self.server_url, 'token')))
+
+    def test_open_circuit_breaker_rejects_until_cooldown(self):
+        config = {'zatca_circuit_breaker': {'failure_threshold': 1, 'cooldown': 60}, 'zatca_rate_limit': {'rate': 0}}
+        with patch.dict(frappe.conf, config):
+            fatoora_gateway.record(self.server_url, 'token', 429)
+            self.assertTrue(is_err(fatoora_gateway.acquire(self.server_url, 'token')))
+
+    def test_rate_limit(self):
+        config = {'zatca_circuit_breaker': {'failure_threshold': 0}, 'zatca_rate_limit': {'rate': 1, 'burst': 1}}
+        with patch.dict(frappe.conf, config), patch.object(fatoora_gateway, 'MAX_WAIT_SECONDS', 0.5):
+            self.assertTrue(is_ok(fatoora_gateway.acquire(self.server_url, 'token')))
+            self.assertTrue(is_err(fatoora_gateway.acquire(self.server_url, 'token')))
+
+            # Buckets are per credential
+            self.assertTrue(is_ok(fatoora_gateway.acquire(self.server_url, 'another-token')))
+
+    def test_rate_limit_adapts_to_throttling(self):
+        config = {'zatca_circuit_breaker': {'failure_threshold': 0}, 'zatca_rate_limit': {'rate': 4, 'burst': 4}}
+        with patch.dict(frappe.conf, config), patch.object(fatoora_gateway, 'MAX_WAIT_SECONDS', 0.4):
+            self.assertTrue(is_ok(fatoora_gateway.acquire(self.server_url, 'token')))
+
+            # Drops the remaining tokens and halves the rate, so the next token is 0.5 seconds away
+            fatoora_gateway.record(self.server_url, 'token', 429)
+            self.assertTrue(is_err(fatoora_gateway.acquire(self.server_url, 'token')))
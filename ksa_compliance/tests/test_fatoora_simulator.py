@@ -0,0 +1,70 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import threading
+
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import zatca_api as api
+from ksa_compliance.fatoora_simulator import FatooraSimulator, SimulatorConfig
+from ksa_compliance.zatca_api import ZatcaSendMode
+
+
+class TestFatooraSimulator(FrappeTestCase):
+    def _start(self, **config) -> str:
+        simulator = FatooraSimulator(('127.0.0.1', 0), SimulatorConfig(latency_ms=0, seed=1, **config))
+        threading.Thread(target=simulator.serve_forever, daemon=True).start()
+        self.addCleanup(simulator.server_close)
+        self.addCleanup(simulator.shutdown)
+        return simulator.url
+
+    def _send(self, server: str, clear: bool = False):
+        send = api.clear_invoice if clear else api.report_invoice
+        return send(
+            server=server,
+            invoice_xml='<Invoice/>',
+            invoice_uuid='8e6000cf-1a98-4174-b3e7-b5d5954bc10d',
+            invoice_hash='hash',
+            security_token='token',
+            secret='secret',
+            mode=ZatcaSendMode.Production,
+        )
+
+    def test_accepted(self):
+        server = self._start()
+
+        result, status_code = self._send(server)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(result.ok_value.status, 'REPORTED')
+
+        result, status_code = self._send(server, clear=True)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(result.ok_value.status, 'CLEARED')
+        self.assertIsNotNone(result.ok_value.cleared_invoice)
+
+    def test_warnings(self):
+        result, status_code = self._send(self._start(warning_rate=1))
+
+        self.assertEqual(status_code, 202)
+        self.assertEqual(result.ok_value.warnings[0].code, 'BR-KSA-08')
+
+    def test_rejected(self):
+        result, status_code = self._send(self._start(rejection_rate=1), clear=True)
+
+        self.assertEqual(status_code, 400)
+        self.assertIn('BR-KSA-37', result.err_value.error)
+
+    def test_throttled(self):
+        result, status_code = self._send(self._start(throttle_rate=1))
+        self.assertEqual(status_code, 429)
+
+        server = self._start(rate_limit=1)
+        self.assertEqual(self._send(server)[1], 200)
+        self.assertEqual(self._send(server)[1], 429)
+
+    def test_csid(self):
+        server = self._start()
+
+        result, status_code = api.get_compliance_csid(server, 'csr', '123456')
+        self.assertEqual(status_code, 200)
+        self.assertEqual(result.ok_value.disposition_message, 'ISSUED')
@@ -0,0 +1,40 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance.group_commit import GroupCommit
+
+
+class TestGroupCommit(FrappeTestCase):
+    def test_commits_every_n_invoices(self):
+        group = GroupCommit(max_invoices=3, interval_ms=60_000)
+        with patch.object(group, 'commit', wraps=group.commit) as commit, patch.object(frappe.db, 'commit'):
+            for _ in range(7):
+                with group.invoice():
+                    pass
+
+        self.assertEqual(commit.call_count, 2)
+
+    def test_commits_after_interval(self):
+        group = GroupCommit(max_invoices=100, interval_ms=0)
+        with patch.object(frappe.db, 'commit') as commit:
+            with group.invoice():
+                pass
+
+        commit.assert_called_once()
+
+    def test_failed_invoice_discards_its_writes(self):
+        group = GroupCommit(max_invoices=100, interval_ms=60_000)
+        with group.invoice():
+            group.update('Sales Invoice Additional Fields', 'a', {'integration_status': 'Resend'})
+        with self.assertRaises(ValueError), group.invoice():
+            group.add_integration_log(invoice_reference='b', status='Accepted')
+            group.update('Sales Invoice Additional Fields', 'b', {'integration_status': 'Resend'})
+            raise ValueError()
+
+        self.assertEqual(group._integration_logs, [])
+        self.assertEqual(group._updates, [('Sales Invoice Additional Fields', 'a', {'integration_status': 'Resend'})])
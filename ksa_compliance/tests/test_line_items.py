@@ -0,0 +1,55 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance.output_models.line_items import LineItems
+
+
+class TestLineItems(FrappeTestCase):
+    def setUp(self):
+        self.lines = LineItems()
+        self.lines.append_sales_invoice_items(
+            [
+                frappe._dict(
+                    idx=1, item_name='A', qty=2, rate=50.0, amount=100.0, net_amount=100.0, tax_rate=15, tax_amount=15
+                ),
+                frappe._dict(
+                    idx=2,
+                    item_name='B',
+                    qty=1,
+                    rate=40.0,
+                    amount=36.0,
+                    net_amount=36.0,
+                    discount_amount=4.0,
+                    discount_percentage=10,
+                    tax_rate=15,
+                    tax_amount=5.4,
+                    item_tax_template='Template',
+                ),
+            ],
+            False,
+        )
+
+    def test_lines_read_like_dicts(self):
+        self.assertEqual(len(self.lines), 2)
+        second = self.lines[1]
+        self.assertEqual((second.idx, second['item_name'], second.get('base_amount')), (2, 'B', 40.0))
+        self.assertEqual(second.allowance_charge_reason_code, 95)
+        self.assertEqual(self.lines[-1].idx, 2)
+        self.assertIsNone(self.lines[0].allowance_charge_reason)
+        self.assertIsNone(self.lines[0].get('missing'))
+        self.assertEqual([line.item_name for line in self.lines], ['A', 'B'])
+
+    def test_totals(self):
+        self.assertEqual(self.lines.total('amount'), 136.0)
+        self.assertEqual(self.lines.total('tax_amount', [1]), 5.4)
+
+    def test_lines_share_tax_categories(self):
+        tax_category = frappe._dict(percent=15)
+        self.lines.add_tax_category('Template', tax_category)
+        self.lines.set_tax_category(1, 'Template')
+        self.assertIsNone(self.lines[0].tax_category)
+        self.assertIs(self.lines[1].tax_category, tax_category)
+        self.assertIs(self.lines[1]['tax_category'], tax_category)
@@ -0,0 +1,33 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import datetime
+import random
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance.resend_schedule import get_next_attempt_at
+
+NOW = datetime.datetime(2026, 1, 1, 12, 0)
+
+
+class TestResendSchedule(FrappeTestCase):
+    def _delay_minutes(self, attempt_count: int, rng: random.Random) -> float:
+        return (get_next_attempt_at(attempt_count, NOW, rng) - NOW).total_seconds() / 60
+
+    def test_backoff_grows_exponentially_with_jitter(self):
+        config = {'zatca_resend_backoff': {'base_minutes': 10, 'max_minutes': 60, 'max_attempts': 10}}
+        rng = random.Random(42)
+        with patch.dict(frappe.conf, config):
+            for attempt_count, full_delay in [(1, 10), (2, 20), (3, 40), (4, 60), (9, 60)]:
+                delays = [self._delay_minutes(attempt_count, rng) for _ in range(50)]
+                self.assertTrue(all(full_delay / 2 <= delay <= full_delay for delay in delays))
+                # Invoices that failed together are spread out
+                self.assertGreater(len(set(delays)), 1)
+
+    def test_max_attempts(self):
+        with patch.dict(frappe.conf, {'zatca_resend_backoff': {'max_attempts': 3}}):
+            self.assertIsNotNone(get_next_attempt_at(2, NOW))
+            self.assertIsNone(get_next_attempt_at(3, NOW))
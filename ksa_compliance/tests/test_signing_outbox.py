@@ -0,0 +1,197 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from lxml import etree
+
+from ksa_compliance import jinja, signing_outbox, zatca_signer
+from ksa_compliance.chain_sequencer import ChainHead
+from ksa_compliance.ksa_compliance.doctype.zatca_signing_outbox.zatca_signing_outbox import ZATCASigningOutbox
+from ksa_compliance.tests.test_zatca_signer import SIMPLIFIED, UNSIGNED_INVOICE, create_credentials
+
+BUSINESS_SETTINGS = '_Test Signing Outbox Settings'
+OTHER_BUSINESS_SETTINGS = '_Test Signing Outbox Other Settings'
+
+
+class TestSigningOutbox(FrappeTestCase):
+    def setUp(self):
+        # Entries are committed and rolled back one at a time by the outbox. Keep them within the test transaction
+        for method in ('commit', 'rollback'):
+            patcher = patch.object(frappe.db, method)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.entry = self._add_entry(BUSINESS_SETTINGS, '_Test Outbox Invoice')
+
+    def _add_entry(self, business_settings_id: str, invoice: str) -> ZATCASigningOutbox:
+        return frappe.get_doc(
+            {
+                'doctype': 'ZATCA Signing Outbox',
+                'invoice_doctype': 'Sales Invoice',
+                'invoice': invoice,
+                'business_settings': business_settings_id,
+            }
+        ).insert(ignore_links=True)
+
+    def test_signed_entry_is_removed(self):
+        additional_fields = MagicMock()
+        with (
+            patch.object(
+                signing_outbox.SalesInvoiceAdditionalFields, 'create_for_invoice', return_value=additional_fields
+            ),
+            patch.object(signing_outbox.ZATCABusinessSettings, 'for_invoice', return_value=None),
+        ):
+            self.assertTrue(signing_outbox.sign_entry(self.entry.name))
+
+        additional_fields.insert.assert_called_once()
+        self.assertFalse(frappe.db.exists('ZATCA Signing Outbox', self.entry.name))
+
+    def test_failed_entry_is_retried_later(self):
+        self.assertEqual(ZATCASigningOutbox.get_due(BUSINESS_SETTINGS, 10), [self.entry.name])
+
+        with patch.object(
+            signing_outbox.SalesInvoiceAdditionalFields, 'create_for_invoice', side_effect=RuntimeError('CLI crashed')
+        ):
+            self.assertFalse(signing_outbox.sign_entry(self.entry.name))
+
+        self.entry.reload()
+        self.assertEqual(self.entry.attempts, 1)
+        self.assertIn('CLI crashed', self.entry.error)
+        self.assertEqual(ZATCASigningOutbox.get_due(BUSINESS_SETTINGS, 10), [])
+
+    def test_presigned_entry_is_inserted_as_is(self):
+        additional_fields = MagicMock()
+        with (
+            patch.object(signing_outbox.SalesInvoiceAdditionalFields, 'create_for_invoice') as create_for_invoice,
+            patch.object(signing_outbox.ZATCABusinessSettings, 'for_invoice', return_value=None),
+        ):
+            self.assertTrue(signing_outbox.sign_entry(self.entry.name, additional_fields))
+
+        create_for_invoice.assert_not_called()
+        additional_fields.insert.assert_called_once()
+        self.assertFalse(frappe.db.exists('ZATCA Signing Outbox', self.entry.name))
+
+    def test_presign_signs_a_chain_per_business_settings(self):
+        second = self._add_entry(BUSINESS_SETTINGS, '_Test Outbox Invoice 2')
+        other = self._add_entry(OTHER_BUSINESS_SETTINGS, '_Test Outbox Invoice 3')
+        heads = {
+            BUSINESS_SETTINGS: ChainHead('counting-1', 4, 'hash-4'),
+            OTHER_BUSINESS_SETTINGS: ChainHead('counting-2', 9, 'hash-9'),
+        }
+
+        with tempfile.TemporaryDirectory() as directory:
+            _key, _cert, cert_path, key_path = create_credentials(directory)
+            settings = frappe._dict(uses_native_signer=True, private_key_path=key_path)
+            invoice_xml = UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED)
+            with (
+                patch.object(signing_outbox.chain_sequencer, 'peek', side_effect=heads.get),
+                patch.object(
+                    signing_outbox.SalesInvoiceAdditionalFields,
+                    'build_for_chain_position',
+                    return_value=(settings, invoice_xml),
+                ),
+                patch.object(signing_outbox.SalesInvoiceAdditionalFields, 'get_cert_path', return_value=cert_path),
+            ):
+                presigned = signing_outbox.presign(
+                    {BUSINESS_SETTINGS: [self.entry.name, second.name], OTHER_BUSINESS_SETTINGS: [other.name]}
+                )
+
+        chains = {BUSINESS_SETTINGS: [self.entry.name, second.name], OTHER_BUSINESS_SETTINGS: [other.name]}
+        for business_settings_id, names in chains.items():
+            expected_head = heads[business_settings_id]
+            for name in names:
+                invoice = presigned[name].flags.presigned
+                self.assertEqual(invoice.expected_head, expected_head)
+                self.assertEqual(invoice.invoice_xml, invoice_xml)
+
+                # Each invoice is signed at the position after the one before it: counter and PIH move together
+                root = etree.fromstring(invoice.result.signed_invoice_xml.encode())
+                self.assertEqual(zatca_signer.get_invoice_counter(root), expected_head.next_counter)
+                self.assertEqual(zatca_signer.get_previous_invoice_hash(root), expected_head.invoice_hash)
+                expected_head = ChainHead(
+                    expected_head.counting_settings_id, expected_head.next_counter, invoice.result.invoice_hash
+                )
+
+    def test_entries_that_cannot_be_presigned_are_left_out(self):
+        second = self._add_entry(BUSINESS_SETTINGS, '_Test Outbox Invoice 2')
+        with (
+            patch.object(signing_outbox.chain_sequencer, 'peek', return_value=ChainHead('counting-1', 4, 'hash-4')),
+            patch.object(
+                signing_outbox.SalesInvoiceAdditionalFields,
+                'build_for_chain_position',
+                side_effect=RuntimeError('Missing customer address'),
+            ),
+        ):
+            presigned = signing_outbox.presign({BUSINESS_SETTINGS: [self.entry.name, second.name]})
+
+        self.assertEqual(presigned, {})
+
+    def test_deferred_invoice_prints_before_it_is_signed(self):
+        invoice = frappe.get_doc(
+            {
+                'doctype': 'Sales Invoice',
+                'name': '_Test Outbox Invoice',
+                'company': '_Test Company',
+                'customer': '_Test Customer',
+                'currency': 'SAR',
+                'conversion_rate': 1,
+                'posting_date': '2026-01-14',
+                'items': [
+                    {
+                        'item_code': '_Test Item',
+                        'item_name': '_Test Item',
+                        'qty': 1,
+                        'rate': 100.0,
+                        'amount': 100.0,
+                        'net_amount': 100.0,
+                        'tax_rate': 15,
+                        'tax_amount': 15.0,
+                    }
+                ],
+            }
+        )
+        settings = frappe._dict(name=BUSINESS_SETTINGS, enable_branch_configuration=False, seller_name='_Test Seller')
+
+        def set_invoice_details(siaf, _settings):
+            siaf.invoice_type_transaction = SIMPLIFIED
+            return 'Simplified'
+
+        exists = frappe.db.exists
+        with (
+            patch.object(
+                frappe.db,
+                'exists',
+                side_effect=lambda doctype, *args, **kwargs: (
+                    BUSINESS_SETTINGS if doctype == 'ZATCA Business Settings' else exists(doctype, *args, **kwargs)
+                ),
+            ),
+            patch.object(jinja.frappe, 'get_doc', return_value=settings),
+            patch.object(
+                jinja.SalesInvoiceAdditionalFields,
+                'set_invoice_details',
+                autospec=True,
+                side_effect=set_invoice_details,
+            ),
+        ):
+            details = jinja.get_phase_2_print_format_details(invoice)
+
+        # The outbox entry hasn't been processed, so there are no additional fields (and no QR code) yet
+        self.assertTrue(details['pending_signature'])
+        self.assertTrue(details['siaf'].is_new())
+        self.assertIsNone(details['siaf'].qr_image_src)
+
+        html = frappe.render_template(
+            frappe.db.get_value('Print Format', 'ZATCA Phase 2 Print Format', 'html'),
+            {
+                'doc': invoice,
+                'get_phase_2_print_format_details': lambda doc: details,
+                'get_item_wise_tax_details': lambda doc: {},
+            },
+        )
+        self.assertIn('Simplified Tax Invoice', html)
+        self.assertIn('Pending ZATCA signature', html)
+        self.assertNotIn('No Qr code', html)
@@ -0,0 +1,56 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import tempfile
+
+from frappe.tests.utils import FrappeTestCase
+from lxml import etree
+
+from ksa_compliance import zatca_signer
+from ksa_compliance.signing_scheduler import SigningChain, sign_chains
+from ksa_compliance.tests.test_zatca_signer import SIMPLIFIED, UNSIGNED_INVOICE, create_credentials
+from ksa_compliance.zatca_cli import SigningRequest
+
+
+class TestSigningScheduler(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        _key, _cert, cls.cert_path, cls.key_path = create_credentials(cls.tmp_dir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+        super().tearDownClass()
+
+    def _chain(self, key: str, size: int, invoice_xml: str | None = None) -> SigningChain:
+        invoice_xml = invoice_xml or UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED)
+        requests = [SigningRequest(invoice_xml, self.cert_path, self.key_path) for _ in range(size)]
+        return SigningChain(key, requests, chain_position=(10, f'{key}-seed'), native=True)
+
+    def test_chains_keep_counter_and_pih_order(self):
+        results = sign_chains([self._chain(f'chain-{i}', 5) for i in range(4)], max_workers=4)
+
+        for key, chain_result in results.items():
+            self.assertTrue(chain_result.is_complete)
+            self.assertEqual(len(chain_result.results), 5)
+            previous_hash = f'{key}-seed'
+            for counter, signing_result in enumerate(chain_result.results, start=10):
+                root = etree.fromstring(signing_result.signed_invoice_xml.encode())
+                self.assertEqual(zatca_signer.get_invoice_counter(root), counter)
+                self.assertEqual(zatca_signer.get_previous_invoice_hash(root), previous_hash)
+                previous_hash = signing_result.invoice_hash
+
+    def test_failed_chain_does_not_affect_others(self):
+        broken = self._chain('broken', 3, invoice_xml='<Invoice/>')
+        results = sign_chains([self._chain('ok', 3), broken], max_workers=2)
+
+        self.assertTrue(results['ok'].is_complete)
+        self.assertEqual(len(results['ok'].results), 3)
+        self.assertFalse(results['broken'].is_complete)
+        self.assertEqual(results['broken'].results, [])
+
+    def test_rejects_duplicate_chains(self):
+        with self.assertRaises(ValueError):
+            sign_chains([self._chain('same', 1), self._chain('same', 1)])
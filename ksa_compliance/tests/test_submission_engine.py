@@ -0,0 +1,68 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import threading
+import time
+from collections import Counter
+from unittest.mock import patch
+
+from frappe.tests.utils import FrappeTestCase
+from result import Ok, is_err
+
+from ksa_compliance import submission_engine
+from ksa_compliance.submission_engine import Submission, SubmissionResponse
+from ksa_compliance.zatca_api import POOL_SIZE, ZatcaSendMode
+
+
+def _submission(key: str, group: str, concurrency: int) -> Submission:
+    return Submission(
+        key=key,
+        group=group,
+        concurrency=concurrency,
+        server_url='http://localhost/',
+        invoice_xml='<Invoice/>',
+        invoice_uuid=key,
+        invoice_hash='hash',
+        invoice_type='Simplified',
+        security_token='token',
+        secret='secret',
+        mode=ZatcaSendMode.Production,
+    )
+
+
+class TestSubmissionEngine(FrappeTestCase):
+    def test_concurrency_is_bounded_per_group(self):
+        lock = threading.Lock()
+        in_flight = Counter()
+        peak = Counter()
+
+        def send(submission: Submission) -> SubmissionResponse:
+            with lock:
+                in_flight[submission.group] += 1
+                peak[submission.group] = max(peak[submission.group], in_flight[submission.group])
+            time.sleep(0.02)
+            with lock:
+                in_flight[submission.group] -= 1
+            return SubmissionResponse(Ok(None), 200)
+
+        submissions = [_submission(f'a-{i}', 'a', 3) for i in range(12)]
+        submissions += [_submission(f'b-{i}', 'b', 1) for i in range(4)]
+        with patch.object(submission_engine, 'send', side_effect=send):
+            sent = [submission.key for submission, _response in submission_engine.send_all(submissions)]
+
+        self.assertCountEqual(sent, [submission.key for submission in submissions])
+        self.assertEqual(peak['a'], 3)
+        self.assertEqual(peak['b'], 1)
+
+    def test_failures_become_resend_responses(self):
+        with patch.object(submission_engine, 'send', side_effect=RuntimeError('boom')):
+            results = list(submission_engine.send_all([_submission('a', 'a', 2), _submission('b', 'a', 2)]))
+
+        self.assertEqual(len(results), 2)
+        for _, response in results:
+            self.assertTrue(is_err(response.result))
+            self.assertEqual(response.status_code, 0)
+
+    def test_concurrency_limit(self):
+        self.assertEqual(submission_engine.get_concurrency_limit(0), submission_engine.DEFAULT_CONCURRENCY)
+        self.assertEqual(submission_engine.get_concurrency_limit(1000), POOL_SIZE)
@@ -0,0 +1,65 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance.output_models.models import ZatcaTaxCategory
+from ksa_compliance.output_models.tax import TaxMetadata
+from ksa_compliance.standard_doctypes.tax_category import to_zatca_tax_category
+
+
+class TestTaxMetadata(FrappeTestCase):
+    def test_category_mapping(self):
+        self.assertEqual(to_zatca_tax_category(None, None), ZatcaTaxCategory('S'))
+        self.assertEqual(to_zatca_tax_category('Standard rate', 'ignored'), ZatcaTaxCategory('S'))
+        self.assertEqual(
+            to_zatca_tax_category('Zero rated goods || Export of goods', None),
+            ZatcaTaxCategory('Z', 'VATEX-SA-32', 'صادرات السلع من المملكة'),
+        )
+        self.assertEqual(
+            to_zatca_tax_category('Services outside scope of tax / Not subject to VAT || {manual entry}', 'Reason'),
+            ZatcaTaxCategory('O', 'VATEX-SA-OOS', 'Reason'),
+        )
+        self.assertEqual(
+            to_zatca_tax_category('Services outside scope of tax / Not subject to VAT || {manual entry}', ''),
+            ZatcaTaxCategory('O', 'VATEX-SA-OOS', None),
+        )
+
+    def test_lookups_are_loaded_once(self):
+        templates = [
+            frappe._dict(name='A', custom_zatca_item_tax_category='Exempt from Tax || Qualifying metals'),
+            frappe._dict(name='B', custom_zatca_item_tax_category=None),
+        ]
+        details = [
+            frappe._dict(parent='A', idx=1, tax_rate=0),
+            frappe._dict(parent='B', idx=2, tax_rate=5),
+            frappe._dict(parent='B', idx=1, tax_rate=15),
+        ]
+        with (
+            patch.object(frappe.db, 'get_all', side_effect=[templates, details]) as get_all,
+            patch.object(frappe.db, 'get_value', side_effect=['Tax Category A', 15]) as get_value,
+        ):
+            metadata = TaxMetadata(['A', 'B', 'A', None])
+            for _ in range(3):
+                self.assertEqual(
+                    metadata.get_item_tax_template('A'), (ZatcaTaxCategory('E', 'VATEX-SA-36', 'المعادن المؤهلة'), 0)
+                )
+                self.assertEqual(metadata.get_item_tax_template('B'), (ZatcaTaxCategory('S'), 15))
+                self.assertEqual(metadata.get_template('Template'), ('Tax Category A', 15))
+
+        self.assertEqual(get_all.call_count, 2)
+        self.assertEqual(get_value.call_count, 2)
+
+    def test_template_rate_is_first_row_rate(self):
+        details = [frappe._dict(parent='A', idx=3, tax_rate=5), frappe._dict(parent='A', idx=1, tax_rate=15)]
+        with patch.object(frappe.db, 'get_all', side_effect=[[frappe._dict(name='A')], details]):
+            self.assertEqual(TaxMetadata(['A']).get_item_tax_template('A'), (ZatcaTaxCategory('S'), 15))
+
+    def test_missing_item_tax_template(self):
+        with patch.object(frappe.db, 'get_all', return_value=[]):
+            metadata = TaxMetadata()
+            with self.assertRaises(frappe.ValidationError):
+                metadata.get_item_tax_template('Missing')
@@ -0,0 +1,68 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import tempfile
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from lxml import etree
+
+from ksa_compliance import zatca_cli, zatca_signer
+from ksa_compliance.tests.test_zatca_cli_pool import create_fake_cli, get_starts
+from ksa_compliance.tests.test_zatca_signer import SIMPLIFIED, UNSIGNED_INVOICE
+from ksa_compliance.zatca_cli import SigningRequest
+
+PIH = 'cHJldmlvdXMtaW52b2ljZS1oYXNo'
+
+
+class TestSignInvoices(FrappeTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        invoice = UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED)
+        self.requests = [SigningRequest(invoice, 'cert.pem', 'key.pem') for _ in range(3)]
+
+    def _sign(self, supports_serve: bool) -> tuple[list[zatca_cli.SigningResult], list[str]]:
+        self.cli_path = create_fake_cli(self.tmp_dir, supports_serve)
+        results = zatca_cli.sign_invoices(self.cli_path, None, self.requests, chain_position=(7, PIH))
+        return results, [start.split()[0] for start in get_starts(self.cli_path)]
+
+    def _assert_chained(self, results: list[zatca_cli.SigningResult]) -> None:
+        self.assertEqual(len(results), 3)
+        previous_invoice_hash = PIH
+        for counter, result in enumerate(results, start=7):
+            root = etree.fromstring(result.signed_invoice_xml.encode())
+            self.assertEqual(zatca_signer.get_invoice_counter(root), counter)
+            self.assertEqual(zatca_signer.get_previous_invoice_hash(root), previous_invoice_hash)
+            previous_invoice_hash = result.invoice_hash
+
+    def test_chain_is_signed_by_one_worker(self):
+        results, starts = self._sign(supports_serve=True)
+
+        self._assert_chained(results)
+        self.assertTrue(zatca_cli.get_capabilities(self.cli_path, None).supports_worker_mode)
+        self.assertEqual(starts, ['-v', 'serve'])
+
+    def test_cli_without_worker_mode_signs_one_shot(self):
+        results, starts = self._sign(supports_serve=False)
+
+        # No attempt to start a worker: each invoice is signed by its own CLI run
+        self._assert_chained(results)
+        self.assertFalse(zatca_cli.get_capabilities(self.cli_path, None).supports_worker_mode)
+        self.assertEqual(starts, ['-v', 'sign', 'sign', 'sign'])
+
+
+class TestValidateInvoice(FrappeTestCase):
+    def _validate(self) -> zatca_cli.ValidationResult | None:
+        return zatca_cli.validate_invoice('/opt/zatca/bin/zatca-cli', None, '<Invoice/>', 'cert.pem', PIH)
+
+    def test_timeout_means_not_validated(self):
+        with patch.object(zatca_cli, 'run_command', return_value=zatca_cli._timeout_result(60)):
+            self.assertIsNone(self._validate())
+
+    def test_other_failures_throw(self):
+        failure = zatca_cli.ZatcaResult(is_success=False, msg='Invalid certificate', errors=[], data=None)
+        with patch.object(zatca_cli, 'run_command', return_value=failure):
+            self.assertRaises(frappe.ValidationError, self._validate)
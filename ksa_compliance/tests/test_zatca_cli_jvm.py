@@ -0,0 +1,45 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import os
+import tempfile
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance.zatca_cli_jvm import get_jvm_options
+
+
+class TestZatcaCliJvm(FrappeTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        os.makedirs(os.path.join(tmp_dir.name, 'bin'))
+        self.cli_path = os.path.join(tmp_dir.name, 'bin', 'zatca-cli')
+        open(self.cli_path, 'w').close()
+
+    def test_heap_caps_only_for_small_commands(self):
+        with patch.dict(frappe.conf, {'zatca_cli_jvm_options': None}):
+            for command in ('sign', '-v'):
+                self.assertIn('-Xmx256m', get_jvm_options(self.cli_path, command))
+                self.assertIn('-Xss512k', get_jvm_options(self.cli_path, command))
+
+            for command in ('convert-pdf', 'validate', 'csr'):
+                options = get_jvm_options(self.cli_path, command)
+                self.assertIn('-XX:TieredStopAtLevel=1', options)
+                self.assertFalse(any(option.startswith(('-Xmx', '-Xss', '-XX:MaxDirect')) for option in options))
+
+            self.assertIn('-Xmx512m', get_jvm_options(self.cli_path, 'serve'))
+
+    def test_site_config_override(self):
+        with patch.dict(frappe.conf, {'zatca_cli_jvm_options': '-Xmx1g'}):
+            self.assertEqual(get_jvm_options(self.cli_path, 'sign'), ['-Xmx1g'])
+
+        configured = {'convert-pdf': '-Xmx2g -Xss1m', 'default': ''}
+        with patch.dict(frappe.conf, {'zatca_cli_jvm_options': configured}):
+            self.assertEqual(get_jvm_options(self.cli_path, 'convert-pdf'), ['-Xmx2g', '-Xss1m'])
+            self.assertEqual(get_jvm_options(self.cli_path, 'sign'), [])
+
+        with patch.dict(frappe.conf, {'zatca_cli_jvm_options': {'convert-pdf': '-Xmx2g'}}):
+            self.assertIn('-Xmx256m', get_jvm_options(self.cli_path, 'sign'))
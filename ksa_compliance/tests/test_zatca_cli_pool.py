@@ -0,0 +1,202 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import zatca_cli, zatca_cli_pool
+from ksa_compliance.zatca_cli_pool import CliWorkerPool, CliWorkerTimeout, CliWorkerUnavailable
+
+# A stand-in for zatca-cli. It answers the same way in one-shot and 'serve' mode, and logs the arguments of every
+# process start to starts.log in the installation directory, so tests can tell how many JVMs the real CLI would start
+FAKE_CLI = """
+import base64
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(args):
+    if args == ['-v']:
+        features = ['serve'] if SUPPORTS_SERVE else []
+        return 0, {'msg': 'Fake ZATCA CLI', 'data': {'version': '2.10.0', 'features': features}}
+    if args[0] == 'sleep':
+        time.sleep(float(args[1]))
+        return 0, {'msg': 'Slept'}
+    if args[0] == 'crash-once':
+        marker = os.path.join(BASE_PATH, 'crashed')
+        if not os.path.exists(marker):
+            open(marker, 'w').close()
+            sys.exit(1)
+        return 0, {'msg': 'Recovered'}
+    if args[0] == 'sign':
+        output_path, invoice_path = args[args.index('-o') + 1], args[-1]
+        shutil.copyfile(invoice_path, output_path)
+        with open(invoice_path, 'rb') as f:
+            invoice_hash = base64.b64encode(hashlib.sha256(f.read()).digest()).decode()
+        return 0, {'msg': 'Signed', 'data': {'hash': invoice_hash, 'qrCode': 'QR'}}
+    return 1, {'msg': f'Unknown command: {args}', 'errors': []}
+
+
+with open(os.path.join(BASE_PATH, 'starts.log'), 'a') as log:
+    log.write(' '.join(sys.argv[1:]) + '\\n')
+
+if sys.argv[1:] == ['serve']:
+    if not SUPPORTS_SERVE:
+        print('Usage: zatca-cli [-v] [COMMAND]')
+        sys.exit(2)
+    for line in sys.stdin:
+        exit_code, response = run(json.loads(line)['args'])
+        print(json.dumps({**response, 'exitCode': exit_code}), flush=True)
+else:
+    exit_code, response = run(sys.argv[1:])
+    print(json.dumps(response))
+    sys.exit(exit_code)
+"""
+
+
+def create_fake_cli(directory: str, supports_serve: bool = True) -> str:
+    """Installs the fake CLI under [directory] (as bin/zatca-cli, like the real one) and returns its path"""
+    os.makedirs(os.path.join(directory, 'bin'), exist_ok=True)
+    path = os.path.join(directory, 'bin', 'zatca-cli')
+    with open(path, 'wt') as f:
+        f.write(f'#!{sys.executable}\nSUPPORTS_SERVE = {supports_serve}\n{FAKE_CLI}')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def get_starts(zatca_cli_path: str) -> list[str]:
+    """Returns the arguments of every start of the fake CLI at [zatca_cli_path], in order"""
+    try:
+        with open(os.path.join(os.path.dirname(os.path.dirname(zatca_cli_path)), 'starts.log'), 'rt') as f:
+            return f.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+class TestZatcaCliPool(FrappeTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cli_path = create_fake_cli(tmp_dir.name)
+        self.pool = CliWorkerPool(self.cli_path, None, size=1, acquire_timeout=0.5)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_requests_reuse_the_worker(self):
+        for _ in range(3):
+            self.assertEqual(self.pool.run(['-v'])[0], 0)
+
+        self.assertEqual(get_starts(self.cli_path), ['serve'])
+
+    def test_crashed_worker_is_restarted(self):
+        self.pool.run(['-v'])
+        with self.pool.reserve() as worker:
+            zatca_cli_pool.kill_process_group(worker.proc)
+
+        self.assertEqual(self.pool.run(['-v'])[0], 0)
+        # A worker that dies in the middle of a request is restarted, and the request is sent again once
+        self.assertEqual(self.pool.run(['crash-once'])[1]['msg'], 'Recovered')
+        self.assertEqual(get_starts(self.cli_path), ['serve'] * 3)
+
+    def test_busy_pool_times_out(self):
+        with self.pool.reserve() as worker:
+            self.assertIsNotNone(worker)
+            start = time.monotonic()
+            with self.assertRaises(CliWorkerUnavailable):
+                self.pool.run(['-v'])
+            self.assertLess(time.monotonic() - start, 5)
+
+    def test_unresponsive_worker_is_killed(self):
+        with self.assertRaises(CliWorkerTimeout):
+            self.pool.run(['sleep', '30'], timeout=0.5)
+
+        self.assertEqual(self.pool.run(['-v'])[0], 0)
+        self.assertEqual(get_starts(self.cli_path), ['serve', 'serve'])
+
+    def test_shutdown_stops_workers_in_use(self):
+        with self.pool.reserve() as worker:
+            self.pool.shutdown()
+            self.assertFalse(worker.is_alive)
+
+        self.assertFalse(worker.is_alive)
+        with self.assertRaises(CliWorkerUnavailable):
+            self.pool.run(['-v'])
+
+    def test_failed_start_is_retried(self):
+        start = zatca_cli_pool.CliWorker.start
+        failures = [CliWorkerUnavailable('JVM failed to start')]
+
+        def flaky_start(worker):
+            if failures:
+                raise failures.pop()
+            start(worker)
+
+        with patch.object(zatca_cli_pool.CliWorker, 'start', autospec=True, side_effect=flaky_start):
+            with self.assertRaises(CliWorkerUnavailable):
+                self.pool.run(['-v'])
+            # The slot is given back, and the next request starts a worker
+            self.assertEqual(self.pool.run(['-v'])[0], 0)
+
+        self.assertEqual(get_starts(self.cli_path), ['serve'])
+
+    def test_workers_start_concurrently(self):
+        pool = CliWorkerPool(self.cli_path, None, size=2)
+        self.addCleanup(pool.shutdown)
+        start = zatca_cli_pool.CliWorker.start
+        lock = threading.Lock()
+        starting = [0]
+        peak = [0]
+
+        def slow_start(worker):
+            with lock:
+                starting[0] += 1
+                peak[0] = max(peak[0], starting[0])
+            time.sleep(0.2)
+            start(worker)
+            with lock:
+                starting[0] -= 1
+
+        with patch.object(zatca_cli_pool.CliWorker, 'start', autospec=True, side_effect=slow_start):
+            # Each thread holds its worker, so that both need a slot of their own
+            threads = [threading.Thread(target=lambda: pool.run(['sleep', '0.5'])) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # Neither start waited for the other under the pool lock
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(get_starts(self.cli_path), ['serve', 'serve'])
+
+    def test_unsupported_cli_falls_back_to_one_shot_runs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cli_path = create_fake_cli(directory, supports_serve=False)
+            with patch.dict(frappe.conf, {'zatca_cli_workers': 1}):
+                self.addCleanup(zatca_cli_pool.shutdown_pools)
+                self.assertTrue(zatca_cli.run_command(cli_path, ['sleep', '0'], java_home=None).is_success)
+                self.assertTrue(zatca_cli.run_command(cli_path, ['sleep', '0'], java_home=None).is_success)
+
+            # The CLI doesn't report the 'serve' feature, so no worker is started
+            self.assertEqual(get_starts(cli_path), ['-v', 'sleep 0', 'sleep 0'])
+
+    def test_supported_cli_runs_through_worker(self):
+        with patch.dict(frappe.conf, {'zatca_cli_workers': 1}):
+            self.addCleanup(zatca_cli_pool.shutdown_pools)
+            self.assertTrue(zatca_cli.run_command(self.cli_path, ['sleep', '0'], java_home=None).is_success)
+            self.assertTrue(zatca_cli.run_command(self.cli_path, ['sleep', '0'], java_home=None).is_success)
+
+        # Probing the capabilities is a one-shot run, and both commands go through one worker
+        self.assertEqual(get_starts(self.cli_path), ['-v', 'serve'])
@@ -0,0 +1,264 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import base64
+import datetime
+import hashlib
+import os
+import tempfile
+
+import frappe
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from frappe.tests.utils import FrappeTestCase
+from lxml import etree
+
+from ksa_compliance import zatca_cli, zatca_signer
+from ksa_compliance.tests import sample_invoices
+from ksa_compliance.tests.sample_invoices import LONG_ARABIC_NAME, SIMPLIFIED, STANDARD
+
+UNSIGNED_INVOICE = """<?xml version="1.0" encoding="UTF-8"?>
+<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"
+         xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
+         xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"
+         xmlns:ext="urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2">
+    <cbc:ProfileID>reporting:1.0</cbc:ProfileID>
+    <cbc:ID>ACC-SINV-2026-00001</cbc:ID>
+    <cbc:UUID>3cf5ee18-ee25-44ea-a444-2c37ba7f28be</cbc:UUID>
+    <cbc:IssueDate>2026-01-14</cbc:IssueDate>
+    <cbc:IssueTime>10:26:03</cbc:IssueTime>
+    <cbc:InvoiceTypeCode name="{type_code_name}">388</cbc:InvoiceTypeCode>
+    <cbc:DocumentCurrencyCode>SAR</cbc:DocumentCurrencyCode>
+    <cbc:TaxCurrencyCode>SAR</cbc:TaxCurrencyCode>
+    <cac:AdditionalDocumentReference>
+        <cbc:ID>ICV</cbc:ID>
+        <cbc:UUID>1</cbc:UUID>
+    </cac:AdditionalDocumentReference>
+    <cac:AdditionalDocumentReference>
+        <cbc:ID>PIH</cbc:ID>
+        <cac:Attachment>
+            <cbc:EmbeddedDocumentBinaryObject mimeCode="text/plain">NWZlY2ViNjZmZmM4NmYzOGQ5NTI3ODZjNmQ2OTZjNzljMmRiYzIzOWRkNGU5MWI0NjcyOWQ3M2EyN2ZiNTdlOQ==</cbc:EmbeddedDocumentBinaryObject>
+        </cac:Attachment>
+    </cac:AdditionalDocumentReference>
+    <cac:AccountingSupplierParty>
+        <cac:Party>
+            <cac:PartyTaxScheme>
+                <cbc:CompanyID>399999999900003</cbc:CompanyID>
+                <cac:TaxScheme>
+                    <cbc:ID>VAT</cbc:ID>
+                </cac:TaxScheme>
+            </cac:PartyTaxScheme>
+            <cac:PartyLegalEntity>
+                <cbc:RegistrationName>شركة اختبار</cbc:RegistrationName>
+            </cac:PartyLegalEntity>
+        </cac:Party>
+    </cac:AccountingSupplierParty>
+    <cac:TaxTotal>
+        <cbc:TaxAmount currencyID="SAR">15.00</cbc:TaxAmount>
+    </cac:TaxTotal>
+    <cac:LegalMonetaryTotal>
+        <cbc:TaxInclusiveAmount currencyID="SAR">115.00</cbc:TaxInclusiveAmount>
+    </cac:LegalMonetaryTotal>
+</Invoice>
+"""
+
+
+class TestZATCASigner(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.key, cls.cert, cls.cert_path, cls.key_path = create_credentials(cls.tmp_dir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+        super().tearDownClass()
+
+    def test_hash_excludes_signature_elements(self):
+        invoice = UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED)
+        result = zatca_signer.sign_invoice(invoice, self.cert_path, self.key_path)
+
+        self.assertEqual(result.invoice_hash, zatca_signer.compute_invoice_hash(invoice))
+        self.assertEqual(result.invoice_hash, zatca_signer.compute_invoice_hash(result.signed_invoice_xml))
+
+    def test_signature_verifies_against_certificate(self):
+        invoice = UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED)
+        result = zatca_signer.sign_invoice(invoice, self.cert_path, self.key_path)
+        root = etree.fromstring(result.signed_invoice_xml.encode())
+
+        signature = base64.b64decode(root.xpath('//ds:SignatureValue/text()', namespaces=zatca_signer.NS)[0])
+        self.cert.public_key().verify(signature, base64.b64decode(result.invoice_hash), ec.ECDSA(hashes.SHA256()))
+
+    def test_qr_code_stamp_only_for_simplified_invoices(self):
+        simplified = zatca_signer.sign_invoice(
+            UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED), self.cert_path, self.key_path
+        )
+        standard = zatca_signer.sign_invoice(
+            UNSIGNED_INVOICE.format(type_code_name=STANDARD), self.cert_path, self.key_path
+        )
+
+        simplified_tags = zatca_signer.parse_qr_code(simplified.qr_code)
+        self.assertEqual(simplified_tags[1], 'شركة اختبار'.encode())
+        self.assertEqual(simplified_tags[3], b'2026-01-14T10:26:03')
+        self.assertEqual(simplified_tags[6], simplified.invoice_hash.encode())
+        self.assertEqual(simplified_tags[9], self.cert.signature)
+        self.assertNotIn(9, zatca_signer.parse_qr_code(standard.qr_code))
+
+    def test_signed_properties_digest_declares_only_xades_and_ds(self):
+        result = zatca_signer.sign_invoice(
+            UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED), self.cert_path, self.key_path
+        )
+        root = etree.fromstring(result.signed_invoice_xml.encode())
+        signed_properties = root.xpath('//xades:SignedProperties', namespaces=zatca_signer.NS)[0]
+
+        # Exclusive C14N with ds and xades as inclusive prefixes declares exactly those two on SignedProperties
+        content = etree.tostring(
+            signed_properties, method='c14n', exclusive=True, inclusive_ns_prefixes=['ds', 'xades']
+        )
+        self.assertTrue(
+            content.startswith(
+                b'<xades:SignedProperties xmlns:ds="http://www.w3.org/2000/09/xmldsig#" '
+                b'xmlns:xades="http://uri.etsi.org/01903/v1.3.2#" Id="xadesSignedProperties">'
+            )
+        )
+        digest = root.xpath(
+            "//ds:Reference[@URI='#xadesSignedProperties']/ds:DigestValue/text()", namespaces=zatca_signer.NS
+        )[0]
+        self.assertEqual(digest, base64.b64encode(hashlib.sha256(content).hexdigest().encode()).decode())
+        self.assertEqual(zatca_signer.verify_signature(root), [])
+
+    def test_resigning_is_stable(self):
+        first = zatca_signer.sign_invoice(
+            UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED), self.cert_path, self.key_path
+        )
+        second = zatca_signer.sign_invoice(first.signed_invoice_xml, self.cert_path, self.key_path)
+        self.assertEqual(first.invoice_hash, second.invoice_hash)
+
+    def test_signs_template_output(self):
+        for scenario in sample_invoices.SCENARIOS:
+            with self.subTest(scenario):
+                invoice = sample_invoices.render(scenario)
+                result = zatca_signer.sign_invoice(invoice, self.cert_path, self.key_path)
+                root = etree.fromstring(result.signed_invoice_xml.encode())
+
+                self.assertEqual(result.invoice_hash, zatca_signer.compute_invoice_hash(invoice))
+                self.assertEqual(zatca_signer.verify_signature(root), [])
+                self.assertEqual(zatca_signer.verify_qr_code(root), [])
+                self.assertEqual(
+                    zatca_signer.sign_invoice(result.signed_invoice_xml, self.cert_path, self.key_path).invoice_hash,
+                    result.invoice_hash,
+                )
+
+    def test_qr_code_with_long_arabic_name(self):
+        result = zatca_signer.sign_invoice(sample_invoices.render('long_arabic_name'), self.cert_path, self.key_path)
+
+        seller_name = zatca_signer.parse_qr_code(result.qr_code)[1]
+        self.assertGreater(len(seller_name), 127)
+        self.assertEqual(seller_name.decode(), LONG_ARABIC_NAME)
+
+    def test_qr_code_rejects_values_over_255_bytes(self):
+        invoice = sample_invoices.render('simplified', registration_name='ش' * 128)
+        with self.assertRaisesRegex(ValueError, 'QR code tag 1 is 256 bytes long'):
+            zatca_signer.sign_invoice(invoice, self.cert_path, self.key_path)
+
+    def test_matches_zatca_cli(self):
+        """
+        Differential test against the ZATCA CLI, on the hand-written invoice and every sample rendered from the
+        invoice template. Set 'zatca_test_cli_path' (and optionally 'zatca_test_java_home') in the site config to run
+        it. [test_signs_template_output] covers the same samples without the CLI.
+
+        The native signer is given the signing time of the CLI's output, so everything but the signature value (and
+        therefore QR tag 7), which ECDSA randomizes, must match byte for byte.
+        """
+        cli_path = frappe.conf.get('zatca_test_cli_path')
+        if not cli_path:
+            self.skipTest('zatca_test_cli_path is not configured')
+        java_home = frappe.conf.get('zatca_test_java_home')
+
+        invoices = [UNSIGNED_INVOICE.format(type_code_name=name) for name in (SIMPLIFIED, STANDARD)]
+        invoices += [sample_invoices.render(scenario) for scenario in sample_invoices.SCENARIOS]
+        for invoice in invoices:
+            expected = zatca_cli.sign_invoice(cli_path, java_home, invoice, self.cert_path, self.key_path)
+            actual = zatca_signer.sign_invoice_with_credentials(
+                invoice,
+                zatca_signer.load_credentials(self.cert_path, self.key_path),
+                signing_time=_signing_time(expected.signed_invoice_xml),
+            )
+
+            self.assertEqual(actual.invoice_hash, expected.invoice_hash)
+            self.assertEqual(
+                _signed_properties_digest(actual.signed_invoice_xml),
+                _signed_properties_digest(expected.signed_invoice_xml),
+            )
+
+            expected_tags, actual_tags = (
+                zatca_signer.parse_qr_code(expected.qr_code),
+                zatca_signer.parse_qr_code(actual.qr_code),
+            )
+            del expected_tags[7], actual_tags[7]
+            self.assertEqual(actual_tags, expected_tags)
+
+            self.assertEqual(_masked_c14n(actual.signed_invoice_xml), _masked_c14n(expected.signed_invoice_xml))
+
+
+def create_credentials(directory: str) -> tuple[ec.EllipticCurvePrivateKey, x509.Certificate, str, str]:
+    """
+    Creates a self-signed EGS key and certificate under [directory], in the same formats as the files written during
+    onboarding: PEM certificate and bare base64 DER key
+    """
+    key = ec.generate_private_key(ec.SECP256K1())
+    name = x509.Name(
+        [
+            x509.NameAttribute(NameOID.DOMAIN_COMPONENT, 'local'),
+            x509.NameAttribute(NameOID.DOMAIN_COMPONENT, 'gov'),
+            x509.NameAttribute(NameOID.COMMON_NAME, 'TSZEINVOICE-SubCA-1'),
+        ]
+    )
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(379112742831380471835263969587287663520528387)
+        .not_valid_before(datetime.datetime(2024, 1, 1))
+        .not_valid_after(datetime.datetime(2034, 1, 1))
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_path = os.path.join(directory, 'cert.pem')
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    key_path = os.path.join(directory, 'private_key.pem')
+    with open(key_path, 'wb') as f:
+        der = key.private_bytes(
+            serialization.Encoding.DER, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()
+        )
+        f.write(base64.b64encode(der))
+    return key, cert, cert_path, key_path
+
+
+def _signing_time(signed_xml: str) -> datetime.datetime:
+    root = etree.fromstring(signed_xml.encode())
+    signing_time = root.xpath('//xades:SigningTime/text()', namespaces=zatca_signer.NS)[0]
+    return datetime.datetime.strptime(signing_time, '%Y-%m-%dT%H:%M:%S')
+
+
+def _signed_properties_digest(signed_xml: str) -> str:
+    root = etree.fromstring(signed_xml.encode())
+    return root.xpath(
+        "//ds:Reference[@URI='#xadesSignedProperties']/ds:DigestValue/text()", namespaces=zatca_signer.NS
+    )[0]
+
+
+def _masked_c14n(signed_xml: str) -> bytes:
+    root = etree.fromstring(signed_xml.encode())
+    for xpath in (
+        '//ds:SignatureValue',
+        "//cac:AdditionalDocumentReference[cbc:ID='QR']//cbc:EmbeddedDocumentBinaryObject",
+    ):
+        for element in root.xpath(xpath, namespaces=zatca_signer.NS):
+            element.text = ''
+    return etree.tostring(root, method='c14n')
@@ -0,0 +1,144 @@
+# Copyright (c) 2026, LavaLoon and Contributors
+# See license.txt
+
+import os
+import tempfile
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import zatca_cli, zatca_signer, zatca_validator
+from ksa_compliance.tests import sample_invoices
+from ksa_compliance.tests.test_zatca_signer import SIMPLIFIED, UNSIGNED_INVOICE, create_credentials
+
+PIH = 'NWZlY2ViNjZmZmM4NmYzOGQ5NTI3ODZjNmQ2OTZjNzljMmRiYzIzOWRkNGU5MWI0NjcyOWQ3M2EyN2ZiNTdlOQ=='
+
+# A minimal stand-in for the compiled ZATCA rules, producing the same SVRL report format
+RULES_XSL = """<xsl:stylesheet version="2.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
+    xmlns:svrl="http://purl.oclc.org/dsdl/svrl"
+    xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"
+    xmlns:inv="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2">
+  <xsl:template match="/">
+    <svrl:schematron-output>
+      <xsl:if test="not(matches(/inv:Invoice/cbc:DocumentCurrencyCode, '^[A-Z]{3}$'))">
+        <svrl:failed-assert id="BR-05" flag="fatal" location="/Invoice">
+          <svrl:text>Invalid currency code</svrl:text>
+        </svrl:failed-assert>
+      </xsl:if>
+      <xsl:if test="not(/inv:Invoice/cbc:Note)">
+        <svrl:failed-assert id="BR-KSA-99" flag="warning" location="/Invoice">
+          <svrl:text>Missing note</svrl:text>
+        </svrl:failed-assert>
+      </xsl:if>
+    </svrl:schematron-output>
+  </xsl:template>
+</xsl:stylesheet>
+"""
+
+
+class TestZATCAValidator(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        _key, _cert, cls.cert_path, cls.key_path = create_credentials(cls.tmp_dir.name)
+
+        # Mimic a CLI installation: <base>/bin/zatca-cli with the rules under <base>/Data/Rules/Schematrons
+        cls.cli_path = os.path.join(cls.tmp_dir.name, 'bin', 'zatca-cli')
+        rules_dir = os.path.join(cls.tmp_dir.name, 'Data', 'Rules', 'Schematrons')
+        os.makedirs(rules_dir)
+        with open(os.path.join(rules_dir, 'rules.xsl'), 'wt') as f:
+            f.write(RULES_XSL)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+        super().tearDownClass()
+
+    def _sign(self, invoice_xml: str) -> str:
+        return zatca_signer.sign_invoice(invoice_xml, self.cert_path, self.key_path).signed_invoice_xml
+
+    def test_valid_signature_and_qr(self):
+        result = zatca_validator.validate_invoice(
+            self.cli_path, self._sign(UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED)), PIH
+        )
+
+        self.assertTrue(result.details.is_valid_signature)
+        self.assertTrue(result.details.is_valid_qr)
+        self.assertNotIn('PIH', result.details.errors)
+
+    def test_tampered_invoice(self):
+        signed = self._sign(UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED))
+        result = zatca_validator.validate_invoice(self.cli_path, signed.replace('115.00', '105.00'), PIH)
+
+        self.assertFalse(result.details.is_valid)
+        self.assertFalse(result.details.is_valid_signature)
+        self.assertFalse(result.details.is_valid_qr)
+
+    def test_previous_invoice_hash_mismatch(self):
+        signed = self._sign(UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED))
+        result = zatca_validator.validate_invoice(self.cli_path, signed, 'another-hash')
+
+        self.assertFalse(result.details.is_valid)
+        self.assertIn('PIH', result.details.errors)
+
+    def test_business_rules(self):
+        invoice = UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED).replace(
+            '>SAR</cbc:DocumentCurrencyCode>', '>sar</cbc:DocumentCurrencyCode>'
+        )
+        result = zatca_validator.validate_invoice(self.cli_path, self._sign(invoice), PIH)
+
+        self.assertIn('BR-05', result.details.errors)
+        self.assertEqual(result.details.warnings, {'BR-KSA-99': 'Missing note'})
+        self.assertIn('BR-05: Invalid currency code', result.errors_and_warnings)
+
+    def test_schema(self):
+        # The fixture omits the buyer, which the UBL schema requires
+        result = zatca_validator.validate_invoice(
+            self.cli_path, self._sign(UNSIGNED_INVOICE.format(type_code_name=SIMPLIFIED)), PIH
+        )
+
+        self.assertTrue(any(code.startswith('XSD:') for code in result.details.errors))
+        self.assertIn('[XSD] validation result : FAILED', result.messages)
+
+    def test_native_signed_template_output_is_valid(self):
+        for scenario in sample_invoices.SCENARIOS:
+            with self.subTest(scenario):
+                result = zatca_validator.validate_invoice(
+                    self.cli_path, self._sign(sample_invoices.render(scenario)), sample_invoices.PIH
+                )
+
+                self.assertEqual(result.details.errors, {})
+                self.assertTrue(result.details.is_valid)
+                self.assertNotIn('FAILED', '\n'.join(result.messages))
+
+    def test_cli_signed_template_output_is_valid(self):
+        """
+        Validates invoices signed by the ZATCA CLI (and the same invoices signed natively) against the business rules
+        shipped with it. Set 'zatca_test_cli_path' (and optionally 'zatca_test_java_home') in the site config to run it
+        """
+        cli_path = frappe.conf.get('zatca_test_cli_path')
+        if not cli_path:
+            self.skipTest('zatca_test_cli_path is not configured')
+        java_home = frappe.conf.get('zatca_test_java_home')
+
+        for scenario in sample_invoices.SCENARIOS:
+            invoice = sample_invoices.render(scenario)
+            cli_signed = zatca_cli.sign_invoice(cli_path, java_home, invoice, self.cert_path, self.key_path)
+            for signer, signed_invoice in (('cli', cli_signed.signed_invoice_xml), ('native', self._sign(invoice))):
+                with self.subTest(scenario=scenario, signer=signer):
+                    result = zatca_validator.validate_invoice(cli_path, signed_invoice, sample_invoices.PIH)
+                    self.assertEqual(result.details.errors, {})
+
+    def test_falls_back_without_rules(self):
+        cli_path = os.path.join(self.tmp_dir.name, 'other', 'bin', 'zatca-cli')
+        self.assertIsNone(zatca_validator.validate_invoice(cli_path, '<Invoice/>', PIH))
+
+        # A CLI installation without the Schematron stylesheets, e.g. a stripped down or corrupted one
+        os.makedirs(os.path.dirname(cli_path))
+        open(cli_path, 'w').close()
+        os.makedirs(os.path.join(self.tmp_dir.name, 'other', 'Data', 'Rules', 'Schematrons'))
+        self.assertFalse(zatca_validator.is_supported(cli_path))
+        self.assertIsNone(
+            zatca_validator.validate_invoice(cli_path, self._sign(sample_invoices.render('simplified')), PIH)
+        )
@@ -1,5 +1,6 @@
 import base64
 import dataclasses
+import threading
 import traceback
 from dataclasses import dataclass
 from enum import Enum
@@ -8,12 +9,26 @@ from urllib.parse import urljoin
 
 import requests
 from requests import HTTPError, Response, JSONDecodeError
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from result import Result, Ok, Err
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
 
 from ksa_compliance import logger
 
 
+# Connect and read timeouts in seconds. Clearance is synchronous on ZATCA's side, so reads get a generous timeout
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+# Connections kept alive per server. Should be at least the number of concurrent API calls per process
+POOL_SIZE = 16
+
+# Connection attempts per request, on top of the first one
+CONNECTION_RETRIES = 2
+
+
 class ZatcaSendMode(Enum):
     """Mode used for sending invoice XML to ZATCA. Compliance is for passing compliance checks. Production is regular
     operation"""
@@ -201,6 +216,51 @@ def clear_invoice(
     )
 
 
+class _ConnectionRetry(Retry):
+    """
+    Retries requests that failed to connect, or whose connection was reset before a response arrived (typically a
+    pooled keep-alive connection the server has closed). Resending is safe in these cases: ZATCA identifies invoices by
+    UUID and hash, and we already resend the same signed invoice for the 'Resend' status.
+
+    Read timeouts are never retried: the server got the request and may still be processing it.
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if isinstance(error, ReadTimeoutError):
+            raise error
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(server: str) -> requests.Session:
+    """
+    Returns the keep-alive session for [server]. Sessions are shared by all calls to the same server within a process,
+    so that consecutive calls reuse the TCP/TLS connection instead of handshaking every time
+    """
+    with _sessions_lock:
+        session = _sessions.get(server)
+        if session is None:
+            retry = _ConnectionRetry(
+                total=CONNECTION_RETRIES,
+                connect=CONNECTION_RETRIES,
+                read=CONNECTION_RETRIES,
+                status=0,
+                other=0,
+                allowed_methods=None,
+                backoff_factor=0.2,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[server] = session
+        return session
+
+
 TOk = TypeVar('TOk')
 TError = TypeVar('TError')
 
@@ -230,7 +290,9 @@ def api_call(
 
     response: Response | None = None
     try:
-        response = requests.post(url, headers=final_headers, json=body, auth=auth)
+        response = get_session(server).post(
+            url, headers=final_headers, json=body, auth=auth, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+        )
         response.raise_for_status()
         return Ok(result_builder(response.json(), response.text)), response.status_code
     except HTTPError as e:
@@ -1,11 +1,14 @@
+import dataclasses
+import functools
 import json
 import os.path
 import stat
 import subprocess
 import tempfile
-from dataclasses import dataclass
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
 from json import JSONDecodeError
-from typing import cast, List, NoReturn, Optional
+from typing import cast, Iterable, Iterator, List, NoReturn, Optional, Tuple
 
 import semantic_version
 from result import is_err
@@ -17,12 +20,33 @@ from frappe import _
 from ksa_compliance import logger
 from ksa_compliance.throw import fthrow
 from ksa_compliance.translation import ft
+from ksa_compliance.zatca_cli_jvm import build_env, generate_cds_archive
+from ksa_compliance.zatca_cli_pool import (
+    CliWorker,
+    CliWorkerPool,
+    CliWorkerTimeout,
+    CliWorkerUnavailable,
+    get_pool,
+    kill_process_group,
+    reserve_worker,
+)
 from ksa_compliance.zatca_cli_setup import download_with_progress, extract_archive
 from ksa_compliance.zatca_files import get_csr_path, get_private_key_path, get_zatca_tool_path
 
 DEFAULT_CLI_VERSION = '2.10.0'
 DEFAULT_JRE_URL = 'https://github.com/adoptium/temurin11-binaries/releases/download/jdk-11.0.23%2B9/OpenJDK11U-jre_x64_linux_hotspot_11.0.23_9.tar.gz'
 DEFAULT_CLI_URL = f'https://github.com/lavaloon-eg/zatca-cli/releases/download/{DEFAULT_CLI_VERSION}/zatca-cli-{DEFAULT_CLI_VERSION}.zip'
+TMPFS_DIR = '/dev/shm'
+
+# Per-command timeouts in seconds (see get_timeout). These are generous: a healthy CLI takes a few seconds at most
+DEFAULT_TIMEOUTS = {
+    'default': 120,
+    '-v': 60,
+    'sign': 60,
+    'validate': 60,
+    'csr': 120,
+    'convert-pdf': 180,
+}
 
 
 @dataclass
@@ -33,6 +57,8 @@ class ZatcaResult:
     msg: str
     errors: List[str]
     data: Optional[dict]
+    is_timeout: bool = False
+    """Whether the CLI was killed for exceeding its timeout, in which case retrying later may succeed"""
 
     @property
     def is_failure(self):
@@ -68,11 +94,19 @@ class SigningResult:
     """Result for an invoice signing invocation to lava-zatca CLI"""
 
     signed_invoice_xml: str
-    signed_invoice_path: str
     invoice_hash: str
     qr_code: str
 
 
+@dataclass
+class SigningRequest:
+    """An invoice to sign as part of a batch (see [sign_invoices])"""
+
+    invoice_xml: str
+    cert_path: str
+    private_key_path: str
+
+
 @dataclass
 class ValidationDetails:
     is_valid: bool
@@ -103,20 +137,108 @@ class ValidationResult:
         return ValidationResult(j['messages'], j['errorsAndWarnings'], details)
 
 
+@dataclass
+class CliCapabilities:
+    """Version and feature support of a ZATCA CLI installation, as reported by 'zatca-cli -v'"""
+
+    cli_mtime: float
+    """Modification time of the CLI binary when it was probed. A different mtime means the CLI has been replaced"""
+
+    msg: str
+    version: Optional[str]
+    """The CLI version. CLIs older than 2.1.0 don't report one"""
+
+    java_version: Optional[str]
+    """The JRE version from JAVA_HOME/release, if a JAVA_HOME is configured"""
+
+    features: List[str] = field(default_factory=list)
+    """Optional features of the CLI, e.g. 'serve' for worker mode. CLI 2.10.0 and older don't report any"""
+
+    @property
+    def parsed_version(self) -> Optional[semantic_version.Version]:
+        return semantic_version.Version(self.version) if self.version else None
+
+    @property
+    def supports_validation_details(self) -> bool:
+        # Version 2.1.0 is the first version to both support validation and include a 'version' in the data payload
+        return self.version is not None
+
+    @property
+    def supports_pdfa3b(self) -> bool:
+        return self.version is not None and self.parsed_version >= semantic_version.Version('2.5.0')
+
+    @property
+    def supports_worker_mode(self) -> bool:
+        return 'serve' in self.features
+
+
+CAPABILITIES_CACHE_KEY = 'zatca_cli_capabilities'
+
+# Per-process memo in front of the site cache, keyed by (CLI path, JAVA_HOME, CLI mtime)
+_capabilities: dict[tuple[str, Optional[str], float], CliCapabilities] = {}
+
+
+def get_capabilities(zatca_cli_path: str, java_home: Optional[str], refresh: bool = False) -> CliCapabilities:
+    """
+    Returns the capabilities of the given CLI. The CLI is only started the first time, or after the binary changes;
+    the result is kept in the site cache and in process memory. Throws if the CLI can't be run
+    """
+    if not os.path.isfile(zatca_cli_path):
+        fthrow(_('{0} does not exist or is not a file').format(zatca_cli_path))
+
+    mtime = os.path.getmtime(zatca_cli_path)
+    key = (zatca_cli_path, java_home or None, mtime)
+    cache_field = f'{zatca_cli_path}:{java_home or ""}'
+    if not refresh:
+        capabilities = _capabilities.get(key)
+        if capabilities:
+            return capabilities
+
+        cached = frappe.cache.hget(CAPABILITIES_CACHE_KEY, cache_field)
+        if cached and cached.get('cli_mtime') == mtime:
+            capabilities = CliCapabilities(**cached)
+            _capabilities[key] = capabilities
+            return capabilities
+
+    result = run_command(zatca_cli_path, ['-v'], java_home=java_home)
+    result.throw_if_failure()
+    capabilities = CliCapabilities(
+        cli_mtime=mtime,
+        msg=result.msg,
+        version=result.data.get('version') if result.data else None,
+        java_version=_get_java_version(java_home),
+        features=list(result.data.get('features') or []) if result.data else [],
+    )
+    frappe.cache.hset(CAPABILITIES_CACHE_KEY, cache_field, dataclasses.asdict(capabilities))
+    _capabilities[key] = capabilities
+    return capabilities
+
+
+def _get_java_version(java_home: Optional[str]) -> Optional[str]:
+    if not java_home:
+        return None
+    try:
+        with open(os.path.join(java_home, 'release'), 'rt') as f:
+            for line in f:
+                name, _sep, value = line.partition('=')
+                if name.strip() == 'JAVA_VERSION':
+                    return value.strip().strip('"')
+    except OSError:
+        pass
+    return None
+
+
 @frappe.whitelist()
 def check_setup(zatca_cli_path: str, java_home: Optional[str]) -> NoReturn:
     """Shows a desk dialog with the version of the Lava ZATCA CLI if found, or an error otherwise"""
-    result = run_command(zatca_cli_path, ['-v'], java_home=java_home)
-    result.throw_if_failure()
-    frappe.msgprint(result.msg, ft('ZATCA CLI'))
+    # This is an explicit check of the setup (e.g. after changing JAVA_HOME), so always run the CLI
+    capabilities = get_capabilities(zatca_cli_path, java_home, refresh=True)
+    frappe.msgprint(capabilities.msg, ft('ZATCA CLI'))
 
 
 @frappe.whitelist()
 def check_validation_details_support(zatca_cli_path: str, java_home: Optional[str]) -> dict:
-    result = run_command(zatca_cli_path, ['-v'], java_home=java_home)
-    result.throw_if_failure()
-    # Version 2.1.0 is the first version to both support validation and include a 'version' in the data payload
-    is_supported = result.data and 'version' in result.data
+    is_supported = get_capabilities(zatca_cli_path, java_home).supports_validation_details
     return {
         'is_supported': is_supported,
         'error': ''
@@ -127,12 +249,8 @@ def check_validation_details_support(zatca_cli_path: str, java_home: Optional[st
 
 def check_pdfa3b_support_or_throw(zatca_cli_path: str, java_home: Optional[str]) -> None:
     """Checks whether PDF/A-3b support is available (version 2.5.0+). Throws a frappe error if it's not supported"""
-    result = run_command(zatca_cli_path, ['-v'], java_home=java_home)
-    result.throw_if_failure()
-    if result.data and 'version' in result.data:
-        version = semantic_version.Version(result.data['version'])
-        if version >= semantic_version.Version('2.5.0'):
-            return
+    if get_capabilities(zatca_cli_path, java_home).supports_pdfa3b:
+        return
 
     fthrow(ft('Please update ZATCA CLI to $version or later to support PDF/A-3b generation', version='2.5.0'))
 
@@ -150,11 +268,12 @@ def setup(override_cli_download_url: str | None, override_jre_download_url: str
         jre_url = override_jre_download_url or DEFAULT_JRE_URL
         cli_url = override_cli_download_url or DEFAULT_CLI_URL
 
-        # There are 4 steps mapped to 0-100% progress:
+        # There are 5 steps mapped to 0-100% progress:
         # 1. JRE download: 0 - 25%
         # 2. JRE extraction: 25 - 50%
         # 3. CLI download: 50 - 75%
-        # 4. CLI extraction: 75 - 100%
+        # 4. CLI extraction: 75 - 90%
+        # 5. Class data sharing archive generation: 90 - 100%
         jre_result = download_with_progress(
             jre_url, directory, lambda p: progress_callback(ft('Downloading JRE'), p / 4)
         )
@@ -191,6 +310,12 @@ def setup(override_cli_download_url: str | None, override_jre_download_url: str
         # Make ZATCA CLI executable for the current user
         os.chmod(zatca_bin, os.stat(zatca_bin).st_mode | stat.S_IEXEC)
 
+        # The archive only speeds up JVM startup, so failing to generate it doesn't fail the setup
+        progress_callback(ft('Generating class data sharing archive'), 90)
+        cds_result = generate_cds_archive(zatca_bin, java_home)
+        if is_err(cds_result):
+            logger.warning(cds_result.err_value)
+
         return {
             'cli_path': zatca_bin,
             'jre_path': os.path.abspath(java_home),
@@ -207,13 +332,14 @@ def generate_csr(
     """
     Generates a CSR. The given prefix is used to name the resulting CSR and private key files.
     """
-    config_path = write_temp_file(config, f'{file_prefix}-csr.properties')
     csr_path = get_csr_path(file_prefix)
     private_key_path = get_private_key_path(file_prefix)
-    args = ['csr', '-c', config_path, '-o', csr_path, '-k', private_key_path]
-    if simulation:
-        args.append('-s')
-    result = run_command(zatca_cli_path, args, java_home=java_home)
+    with temp_dir() as directory:
+        config_path = write_temp_file(directory, f'{file_prefix}-csr.properties', config)
+        args = ['csr', '-c', config_path, '-o', csr_path, '-k', private_key_path]
+        if simulation:
+            args.append('-s')
+        result = run_command(zatca_cli_path, args, java_home=java_home)
     logger.info(result.msg)
     result.throw_if_failure()
     with open(csr_path, 'rt') as file:
@@ -223,36 +349,134 @@ def generate_csr(
 
 def sign_invoice(
     zatca_cli_path: str, java_home: str, invoice_xml: str, cert_path: str, private_key_path: str
+) -> SigningResult:
+    return _sign_invoice(zatca_cli_path, java_home, invoice_xml, cert_path, private_key_path, worker=None)
+
+
+def sign_invoices(
+    zatca_cli_path: str,
+    java_home: Optional[str],
+    requests: List[SigningRequest],
+    chain_position: Optional[Tuple[int, str]] = None,
+) -> List[SigningResult]:
+    """
+    Signs a chain of invoices using a single CLI process, in order.
+
+    If [chain_position] is given as (invoice counter, previous invoice hash), the first invoice takes that counter
+    (ICV) and PIH, and every following invoice takes the next counter and the hash of the invoice before it. Otherwise,
+    invoices are signed with the ICV and PIH they already have.
+
+    Signing stops at the first failure (by throwing), since the rest of the chain depends on the failed invoice
+    """
+    return list(iter_sign_invoices(zatca_cli_path, java_home, requests, chain_position))
+
+
+def iter_sign_invoices(
+    zatca_cli_path: str,
+    java_home: Optional[str],
+    requests: Iterable[SigningRequest],
+    chain_position: Optional[Tuple[int, str]] = None,
+) -> Iterator[SigningResult]:
+    """
+    Same as [sign_invoices], but yields each result as soon as it's available, so callers can keep the signed prefix
+    of a chain that fails midway. The CLI process is held until the iterator is exhausted or closed.
+
+    CLIs that don't report worker mode support (see [CliCapabilities.supports_worker_mode]) sign each invoice in a
+    one-shot invocation
+    """
+    # zatca_signer depends on this module for SigningResult
+    from ksa_compliance.zatca_signer import set_chain_position
+
+    if get_capabilities(zatca_cli_path, java_home).supports_worker_mode:
+        reservation = reserve_worker(zatca_cli_path, java_home)
+    else:
+        reservation = nullcontext(None)
+
+    with reservation as worker:
+        for request in requests:
+            invoice_xml = request.invoice_xml
+            if chain_position:
+                invoice_xml = set_chain_position(invoice_xml, *chain_position)
+
+            result = _sign_invoice(
+                zatca_cli_path, java_home, invoice_xml, request.cert_path, request.private_key_path, worker
+            )
+            if chain_position:
+                chain_position = (chain_position[0] + 1, result.invoice_hash)
+            yield result
+
+
+def _sign_invoice(
+    zatca_cli_path: str,
+    java_home: Optional[str],
+    invoice_xml: str,
+    cert_path: str,
+    private_key_path: str,
+    worker: Optional[CliWorker],
 ) -> SigningResult:
     base_path = os.path.normpath(os.path.join(os.path.dirname(zatca_cli_path), '../'))
-    invoice_path = write_temp_file(invoice_xml, 'invoice.xml')
-    signed_invoice_path = get_temp_path('signed_invoice.xml')
-    result = run_command(
-        zatca_cli_path,
-        ['sign', '-b', base_path, '-o', signed_invoice_path, '-c', cert_path, '-k', private_key_path, invoice_path],
-        java_home=java_home,
-    )
-    logger.info(result.msg)
-    result.throw_if_failure()
-    with open(signed_invoice_path, 'rt') as file:
-        signed_invoice = file.read()
-    return SigningResult(signed_invoice, signed_invoice_path, result.data['hash'], result.data['qrCode'])
+    with temp_dir() as directory:
+        invoice_path = write_temp_file(directory, 'invoice.xml', invoice_xml)
+        signed_invoice_path = os.path.join(directory, 'signed_invoice.xml')
+        args = [
+            'sign',
+            '-b',
+            base_path,
+            '-o',
+            signed_invoice_path,
+            '-c',
+            cert_path,
+            '-k',
+            private_key_path,
+            invoice_path,
+        ]
+        result = None
+        if worker:
+            try:
+                result = _to_zatca_result(*worker.request(args, get_timeout(args)))
+            except CliWorkerTimeout:
+                result = _timeout_result(get_timeout(args))
+            except CliWorkerUnavailable:
+                logger.warning('ZATCA CLI worker unavailable, falling back to one-shot invocation', exc_info=True)
+        if result is None:
+            result = run_command(zatca_cli_path, args, java_home=java_home)
+
+        logger.info(result.msg)
+        result.throw_if_failure()
+        with open(signed_invoice_path, 'rt') as file:
+            signed_invoice = file.read()
+    return SigningResult(signed_invoice, result.data['hash'], result.data['qrCode'])
 
 
 def validate_invoice(
-    zatca_cli_path: str, java_home: Optional[str], invoice_path: str, cert_path: str, previous_invoice_hash: str
-) -> ValidationResult:
+    zatca_cli_path: str, java_home: Optional[str], invoice_xml: str, cert_path: str, previous_invoice_hash: str
+) -> Optional[ValidationResult]:
+    """Validates a signed invoice. Returns None if the CLI timed out, in which case the invoice wasn't validated"""
     base_path = os.path.normpath(os.path.join(os.path.dirname(zatca_cli_path), '../'))
-    result = run_command(
-        zatca_cli_path,
-        ['validate', '-b', base_path, '-c', cert_path, '-p', previous_invoice_hash, invoice_path],
-        java_home=java_home,
-    )
+    with temp_dir() as directory:
+        invoice_path = write_temp_file(directory, 'invoice.xml', invoice_xml)
+        result = run_command(
+            zatca_cli_path,
+            ['validate', '-b', base_path, '-c', cert_path, '-p', previous_invoice_hash, invoice_path],
+            java_home=java_home,
+        )
     logger.info(result.msg)
+    if result.is_timeout:
+        return None
     result.throw_if_failure()
     return ValidationResult.from_json(result.data)
 
 
+def get_timeout(args: List[str]) -> float:
+    """
+    Returns the timeout in seconds for a CLI command, based on the subcommand (the first argument). Timeouts can be
+    configured through 'zatca_cli_timeouts' in site config, e.g. {"sign": 30, "default": 60}
+    """
+    timeouts = {**DEFAULT_TIMEOUTS, **(frappe.conf.get('zatca_cli_timeouts') or {})}
+    command = args[0] if args else ''
+    return float(timeouts.get(command) or timeouts['default'])
+
+
 def run_command(zatca_cli_path: str, args: List[str], java_home: Optional[str]) -> ZatcaResult:
     """Runs a ZATCA command (using lava-zatca CLI) and parses its JSON output. Output is in the form:
     { 'msg': '...',
@@ -265,59 +489,128 @@ def run_command(zatca_cli_path: str, args: List[str], java_home: Optional[str])
     Note that currently there are no error codes or the like, because there's no automatic action that can be performed
     in response to failures. The user has to apply the recommended fixes manually, so we just show the messages and
     errors as is.
+
+    If 'zatca_cli_workers' is set in site config, the command is sent to a resident CLI worker instead of starting a
+    new JVM (see [ksa_compliance.zatca_cli_pool]).
+
+    Commands that exceed their timeout (see [get_timeout]) are killed, along with any child processes, and reported as
+    a failed result with [ZatcaResult.is_timeout] set.
     """
     if not os.path.isfile(zatca_cli_path):
         fthrow(_('{0} does not exist or is not a file').format(zatca_cli_path))
 
+    timeout = get_timeout(args)
+
+    # Worker mode saves a JVM start per invocation. If it's disabled, unsupported by the CLI, or the workers can't start
+    # or keep crashing, we fall back to running the CLI as a one-shot process
+    pool = _get_worker_pool(zatca_cli_path, java_home, args)
+    if pool:
+        try:
+            logger.info(f'Running through worker: {args}')
+            returncode, result = pool.run(args, timeout)
+            return _to_zatca_result(returncode, result)
+        except CliWorkerUnavailable:
+            logger.warning('ZATCA CLI worker unavailable, falling back to one-shot invocation', exc_info=True)
+        except CliWorkerTimeout:
+            # Not falling back: a command that hangs in a worker would most likely hang in a one-shot run as well
+            logger.error(f'ZATCA CLI worker timed out after {timeout} seconds: {args}')
+            return _timeout_result(timeout)
+
     full_args = [zatca_cli_path] + args
-    env = os.environ.copy()
-    if java_home:
-        env['JAVA_HOME'] = java_home
+    env = build_env(zatca_cli_path, java_home, args[0] if args else '')
     logger.info(f'Running: {full_args}')
-    proc = subprocess.run(full_args, capture_output=True, env=env)
+    # A new session puts the CLI script and the JVM it starts in their own process group, so we can kill both
+    proc = subprocess.Popen(full_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, start_new_session=True)
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.error(f'ZATCA CLI timed out after {timeout} seconds: {full_args}')
+        kill_process_group(proc)
+        proc.communicate()
+        return _timeout_result(timeout)
+
     try:
-        result = cast(dict, json.loads(proc.stdout))
+        result = cast(dict, json.loads(stdout))
     except JSONDecodeError:
-        result = {'msg': str(proc.stdout), 'errors': [str(proc.stderr)]}
+        result = {'msg': str(stdout), 'errors': [str(stderr)]}
     except Exception as e:
         result = {'msg': 'An unexpected error occurred', 'errors': [str(e)]}
 
-    if proc.returncode != 0:
+    return _to_zatca_result(proc.returncode, result)
+
+
+def _get_worker_pool(zatca_cli_path: str, java_home: Optional[str], args: List[str]) -> Optional[CliWorkerPool]:
+    """Returns the worker pool to run [args] through, if worker mode is enabled and supported by the CLI"""
+    pool = get_pool(zatca_cli_path, java_home)
+    # Probing the capabilities of the CLI runs '-v' through here, which has to be a one-shot run
+    if not pool or args == ['-v']:
+        return None
+    return pool if get_capabilities(zatca_cli_path, java_home).supports_worker_mode else None
+
+
+def _timeout_result(timeout: float) -> ZatcaResult:
+    return ZatcaResult(
+        is_success=False,
+        msg=ft('ZATCA CLI did not finish within $timeout seconds', timeout=timeout),
+        errors=[],
+        data=None,
+        is_timeout=True,
+    )
+
+
+def _to_zatca_result(returncode: int, result: dict) -> ZatcaResult:
+    if returncode != 0:
         return ZatcaResult(is_success=False, msg=result['msg'], errors=result.get('errors', []), data=None)
 
     return ZatcaResult(is_success=True, msg=result['msg'], errors=[], data=result.get('data'))
 
 
-def write_temp_file(content: str, name: str) -> str:
-    """Writes the given text [content] into a temporary file named [name]"""
-    path = get_temp_path(name)
-    with open(path, 'wt+') as file:
-        file.write(content)
-    return path
+@contextmanager
+def temp_dir() -> Iterator[str]:
+    """
+    Creates a private temporary directory for the files exchanged with the CLI, and deletes it with its contents on
+    exit. The directory is created on tmpfs (/dev/shm) where available, so invoices never hit the disk
+    """
+    with tempfile.TemporaryDirectory(prefix='zatca-', dir=_get_tmpfs_dir()) as directory:
+        yield directory
 
 
-def write_binary_temp_file(content: bytes, name: str) -> str:
-    path = get_temp_path(name)
-    with open(path, 'wb+') as file:
-        file.write(content)
-    return path
+@functools.cache
+def _get_tmpfs_dir() -> Optional[str]:
+    if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK | os.X_OK):
+        return TMPFS_DIR
+    return None
 
 
-def get_temp_path(name: str) -> str:
-    return tempfile.mktemp(suffix='-' + name)
+def write_temp_file(directory: str, name: str, content: str | bytes) -> str:
+    """Writes [content] into a file named [name] under [directory] (see [temp_dir]) and returns its path"""
+    path = os.path.join(directory, os.path.basename(name))
+    with open(path, 'wb' if isinstance(content, bytes) else 'wt') as file:
+        file.write(content)
+    return path
 
 
 def convert_to_pdf_a3_b(
     zatca_cli_path: str, java_home: Optional[str], invoice_id: str, pdf_content: bytes, xml_content: str
-) -> str:
-    pdf = write_binary_temp_file(pdf_content, f'{invoice_id}.pdf')
-    invoice_xml = write_temp_file(xml_content, f'{invoice_id}.xml')
-
-    result = run_command(
-        zatca_cli_path,
-        ['convert-pdf', '-i', invoice_id, '-x', invoice_xml, pdf],
-        java_home=java_home,
-    )
-    logger.info(result.msg)
-    result.throw_if_failure()
-    return result.data['filePath']
+) -> bytes:
+    """Embeds [xml_content] into [pdf_content] and returns the resulting PDF/A-3b document"""
+    with temp_dir() as directory:
+        pdf = write_temp_file(directory, f'{invoice_id}.pdf', pdf_content)
+        invoice_xml = write_temp_file(directory, f'{invoice_id}.xml', xml_content)
+
+        result = run_command(
+            zatca_cli_path,
+            ['convert-pdf', '-i', invoice_id, '-x', invoice_xml, pdf],
+            java_home=java_home,
+        )
+        logger.info(result.msg)
+        result.throw_if_failure()
+
+        output_path = result.data['filePath']
+        try:
+            with open(output_path, 'rb') as f:
+                return f.read()
+        finally:
+            # The CLI decides where the output goes. It's normally next to the input, but clean up in case it isn't
+            if os.path.dirname(os.path.abspath(output_path)) != directory:
+                os.remove(output_path)
@@ -0,0 +1,151 @@
+"""
+JVM tuning for the ZATCA CLI.
+
+Most of the time of a one-shot CLI invocation is JVM startup: loading and verifying a few thousand classes, then
+interpreting/compiling them. Two things help:
+1. An AppCDS (application class-data sharing) archive of the classes the CLI loads, which the JVM maps into memory
+   instead of loading and verifying them from the jars
+2. Flags suited to short-lived processes: C1 only (no C2 warm-up), serial GC, and a small heap for commands known to
+   need little memory
+
+Both are passed through JAVA_TOOL_OPTIONS, which the JVM reads regardless of how the CLI's start script invokes java.
+The archive is optional: if it's missing, stale or unusable by the JVM, the JVM silently runs without it.
+"""
+
+import os
+import shlex
+import subprocess
+from typing import List, Optional
+
+import frappe
+from result import Err, Ok, Result
+
+from ksa_compliance import logger
+from ksa_compliance.translation import ft
+
+# Caps the memory of a CLI process. Running out of it kills the JVM instead of leaving it thrashing in GC
+MEMORY_JVM_OPTIONS = ['-XX:MaxMetaspaceSize=128m', '-XX:MaxDirectMemorySize=64m', '-XX:+ExitOnOutOfMemoryError']
+
+# For one-shot invocations, which run for a fraction of a second
+ONE_SHOT_JVM_OPTIONS = ['-XX:TieredStopAtLevel=1', '-XX:+UseSerialGC', '-Xms32m', '-XX:+ExitOnOutOfMemoryError']
+
+# Signing an invoice and printing the version need little memory, so their one-shot runs get tight caps. Other
+# commands (PDF/A-3b conversion, validation) handle larger documents and keep the JVM's default limits
+SMALL_COMMANDS = ('sign', '-v')
+SMALL_COMMAND_JVM_OPTIONS = ['-Xmx256m', '-Xss512k', *MEMORY_JVM_OPTIONS]
+
+# Resident workers (see zatca_cli_pool) live long enough to benefit from C2, so we keep full tiered compilation
+WORKER_JVM_OPTIONS = ['-XX:+UseSerialGC', '-Xms64m', '-Xmx512m', *MEMORY_JVM_OPTIONS]
+WORKER_COMMAND = 'serve'
+
+CDS_ARCHIVE_NAME = 'zatca-cli.jsa'
+CDS_CLASS_LIST_NAME = 'zatca-cli.classlist'
+
+
+def get_cli_base_path(zatca_cli_path: str) -> str:
+    return os.path.normpath(os.path.join(os.path.dirname(zatca_cli_path), '../'))
+
+
+def get_cds_archive_path(zatca_cli_path: str) -> str:
+    return os.path.join(get_cli_base_path(zatca_cli_path), CDS_ARCHIVE_NAME)
+
+
+def get_jvm_options(zatca_cli_path: str, command: str) -> List[str]:
+    """
+    Returns the JVM options to run the given CLI command with ('serve' for resident workers).
+
+    'zatca_cli_jvm_options' in site config replaces the default flags (set it to an empty string to disable them).
+    It's either a string for all commands, or a string per command with an optional 'default', e.g.
+    {"convert-pdf": "-Xmx1g", "default": ""}. The CDS archive is used either way if it's available
+    """
+    configured = frappe.conf.get('zatca_cli_jvm_options')
+    if isinstance(configured, dict):
+        configured = configured.get(command, configured.get('default'))
+
+    if configured is not None:
+        options = shlex.split(configured)
+    elif command == WORKER_COMMAND:
+        options = list(WORKER_JVM_OPTIONS)
+    elif command in SMALL_COMMANDS:
+        options = ONE_SHOT_JVM_OPTIONS + SMALL_COMMAND_JVM_OPTIONS
+    else:
+        options = list(ONE_SHOT_JVM_OPTIONS)
+
+    archive = get_cds_archive_path(zatca_cli_path)
+    if _is_archive_current(archive, zatca_cli_path):
+        options += ['-Xshare:auto', f'-XX:SharedArchiveFile={archive}']
+    return options
+
+
+def build_env(zatca_cli_path: str, java_home: Optional[str], command: str) -> dict:
+    """
+    Returns the environment to run the given CLI command with: JAVA_HOME and the JVM options in JAVA_TOOL_OPTIONS
+    (see [get_jvm_options])
+    """
+    env = os.environ.copy()
+    if java_home:
+        env['JAVA_HOME'] = java_home
+
+    options = get_jvm_options(zatca_cli_path, command)
+    if options:
+        env['JAVA_TOOL_OPTIONS'] = ' '.join(filter(None, [env.get('JAVA_TOOL_OPTIONS'), shlex.join(options)]))
+    return env
+
+
+def generate_cds_archive(zatca_cli_path: str, java_home: Optional[str]) -> Result[str, str]:
+    """
+    Generates the AppCDS archive for the CLI next to its installation. Returns the archive path on success, an error
+    message on failure.
+
+    This is a two-step process (JDK 11 doesn't support dynamic archiving on exit):
+    1. A training run records the classes the CLI loads into a class list
+    2. A dump run with the same class path (the CLI's start script) writes those classes into the archive
+    """
+    base_path = get_cli_base_path(zatca_cli_path)
+    class_list = os.path.join(base_path, CDS_CLASS_LIST_NAME)
+    archive = os.path.join(base_path, CDS_ARCHIVE_NAME)
+    if not os.access(base_path, os.W_OK):
+        return Err(ft('Cannot write class data sharing archive to $path', path=base_path))
+
+    steps = [
+        ['-Xshare:off', f'-XX:DumpLoadedClassList={class_list}'],
+        ['-Xshare:dump', f'-XX:SharedClassListFile={class_list}', f'-XX:SharedArchiveFile={archive}'],
+    ]
+    for options in steps:
+        env = os.environ.copy()
+        if java_home:
+            env['JAVA_HOME'] = java_home
+        env['JAVA_TOOL_OPTIONS'] = shlex.join(options)
+
+        logger.info(f'Running {zatca_cli_path} with JAVA_TOOL_OPTIONS={env["JAVA_TOOL_OPTIONS"]}')
+        try:
+            proc = subprocess.run([zatca_cli_path, '-v'], capture_output=True, env=env, timeout=300)
+        except subprocess.TimeoutExpired:
+            _remove_quietly(archive)
+            return Err(ft('Timed out generating class data sharing archive for $cli', cli=zatca_cli_path))
+        if proc.returncode != 0:
+            logger.error(f'Class data sharing step failed: {proc.stderr.decode("utf-8", errors="replace")}')
+            _remove_quietly(archive)
+            return Err(ft('Failed to generate class data sharing archive for $cli', cli=zatca_cli_path))
+
+    _remove_quietly(class_list)
+    if not os.path.isfile(archive):
+        return Err(ft('Failed to generate class data sharing archive for $cli', cli=zatca_cli_path))
+
+    logger.info(f'Generated class data sharing archive: {archive}')
+    return Ok(archive)
+
+
+def _is_archive_current(archive: str, zatca_cli_path: str) -> bool:
+    # An archive older than the CLI was generated for a different installation, so the JVM would reject it anyway
+    try:
+        return os.path.getmtime(archive) >= os.path.getmtime(zatca_cli_path)
+    except OSError:
+        return False
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,343 @@
+import atexit
+import json
+import os
+import queue
+import select
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from json import JSONDecodeError
+from typing import Dict, Iterator, List, Optional, Tuple, cast
+
+import frappe
+
+from ksa_compliance import logger
+from ksa_compliance.zatca_cli_jvm import WORKER_COMMAND, build_env
+
+# A worker that has been idle for longer than this is pinged before being handed a request, so that we don't send an
+# invoice to a JVM that died or hung while nobody was looking
+IDLE_PING_SECONDS = 60
+
+
+class CliWorkerUnavailable(Exception):
+    """Raised when no resident CLI worker can serve a request. Callers are expected to fall back to one-shot runs"""
+
+
+class CliWorkerTimeout(Exception):
+    """Raised when a resident CLI worker doesn't answer in time. The worker is killed, and the request isn't retried"""
+
+
+# How long a worker has to come up and answer its health check
+START_TIMEOUT_SECONDS = 60
+
+# How long a request waits for a worker when all of them are busy (e.g. reserved for signing an invoice chain). After
+# that, the request falls back to a one-shot run rather than holding up the web request or job behind it
+ACQUIRE_TIMEOUT_SECONDS = 10
+
+
+def kill_process_group(proc: subprocess.Popen) -> None:
+    """
+    Kills [proc] and its children. The CLI is a shell script that starts java as a child process, so killing the
+    script alone would leave the JVM running. Expects [proc] to be started with start_new_session=True
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        logger.warning(f'ZATCA CLI process {proc.pid} did not exit after SIGKILL')
+
+
+class CliWorker:
+    """
+    A resident ZATCA CLI process started with the 'serve' subcommand. It reads one JSON request per line from stdin
+    and writes one JSON response per line to stdout:
+
+        request:  {"args": ["sign", "-b", "...", ...]}
+        response: {"exitCode": 0, "msg": "...", "errors": [...], "data": {...}}
+
+    The response has the same shape as the output of a one-shot invocation, plus the exit code the one-shot invocation
+    would have returned.
+    """
+
+    def __init__(self, zatca_cli_path: str, java_home: Optional[str]):
+        self.zatca_cli_path = zatca_cli_path
+        self.java_home = java_home
+        self.proc: Optional[subprocess.Popen] = None
+        self.last_used = 0.0
+
+    @property
+    def is_alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self) -> None:
+        env = build_env(self.zatca_cli_path, self.java_home, WORKER_COMMAND)
+        logger.info(f'Starting ZATCA CLI worker: {self.zatca_cli_path}')
+        self.proc = subprocess.Popen(
+            [self.zatca_cli_path, WORKER_COMMAND],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=env,
+            text=True,
+            bufsize=1,
+            start_new_session=True,
+        )
+        # Health check: a CLI that doesn't support 'serve' exits (or prints usage) instead of answering
+        try:
+            self.request(['-v'], timeout=START_TIMEOUT_SECONDS)
+        except CliWorkerTimeout as e:
+            raise CliWorkerUnavailable(str(e))
+
+    def request(self, args: List[str], timeout: Optional[float] = None) -> Tuple[int, dict]:
+        """
+        Sends [args] to the worker and returns the exit code and the parsed response. If the worker doesn't answer
+        within [timeout] seconds, it's killed and CliWorkerTimeout is raised
+        """
+        # The pool may stop the worker from another thread on shutdown, so hold on to the process we talk to
+        proc = self.proc
+        if proc is None or proc.poll() is not None:
+            raise CliWorkerUnavailable('ZATCA CLI worker is not running')
+
+        try:
+            proc.stdin.write(json.dumps({'args': args}) + '\n')
+            proc.stdin.flush()
+            # Requests and responses are strictly one line each, so nothing is left in the read buffer between
+            # requests and waiting on the pipe itself is accurate
+            ready, _, _ = select.select([proc.stdout], [], [], timeout)
+            if not ready:
+                self.stop()
+                raise CliWorkerTimeout(f'ZATCA CLI worker did not respond within {timeout} seconds: {args}')
+            line = proc.stdout.readline()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            self.stop()
+            raise CliWorkerUnavailable(str(e))
+
+        if not line:
+            self.stop()
+            raise CliWorkerUnavailable('ZATCA CLI worker exited unexpectedly')
+
+        try:
+            response = cast(dict, json.loads(line))
+        except JSONDecodeError:
+            self.stop()
+            raise CliWorkerUnavailable(f'Invalid response from ZATCA CLI worker: {line}')
+
+        self.last_used = time.monotonic()
+        return int(response.get('exitCode', 0)), response
+
+    def ensure_healthy(self) -> None:
+        """Restarts the worker if it crashed, and pings it if it has been idle for a while"""
+        if not self.is_alive:
+            self.stop()
+            self.start()
+            return
+
+        if time.monotonic() - self.last_used > IDLE_PING_SECONDS:
+            try:
+                self.request(['-v'], timeout=START_TIMEOUT_SECONDS)
+            except (CliWorkerUnavailable, CliWorkerTimeout):
+                self.stop()
+                self.start()
+
+    def stop(self) -> None:
+        if self.proc is None:
+            return
+        try:
+            kill_process_group(self.proc)
+        except Exception:
+            logger.warning('Failed to stop ZATCA CLI worker', exc_info=True)
+        self.proc = None
+
+
+class CliWorkerPool:
+    """A bounded pool of resident CLI workers for a single CLI path/JAVA_HOME combination"""
+
+    def __init__(
+        self,
+        zatca_cli_path: str,
+        java_home: Optional[str],
+        size: int,
+        acquire_timeout: float = ACQUIRE_TIMEOUT_SECONDS,
+    ):
+        self.zatca_cli_path = zatca_cli_path
+        self.java_home = java_home
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self._idle: queue.LifoQueue[CliWorker] = queue.LifoQueue()
+        self._workers: List[CliWorker] = []
+        self._lock = threading.Lock()
+        self._is_shut_down = False
+
+    def run(self, args: List[str], timeout: Optional[float] = None) -> Tuple[int, dict]:
+        worker = self._acquire()
+        try:
+            try:
+                worker.ensure_healthy()
+                return worker.request(args, timeout)
+            except CliWorkerUnavailable:
+                if self._is_shut_down:
+                    raise
+                # Restart on crash, once. If the fresh worker fails as well, the caller falls back to a one-shot run
+                worker.stop()
+                worker.start()
+                return worker.request(args, timeout)
+        except CliWorkerUnavailable:
+            worker.stop()
+            raise
+        finally:
+            self._release(worker)
+
+    @contextmanager
+    def reserve(self) -> Iterator[Optional[CliWorker]]:
+        """
+        Holds a single worker for a sequence of requests, e.g. signing an invoice chain. Yields None if no worker could
+        be started
+        """
+        try:
+            worker = self._acquire()
+        except CliWorkerUnavailable:
+            yield None
+            return
+
+        try:
+            try:
+                worker.ensure_healthy()
+            except CliWorkerUnavailable:
+                logger.warning('Could not start a ZATCA CLI worker', exc_info=True)
+                worker.stop()
+                yield None
+                return
+            yield worker
+        finally:
+            self._release(worker)
+
+    def _acquire(self) -> CliWorker:
+        if self._is_shut_down:
+            raise CliWorkerUnavailable('ZATCA CLI worker pool is shut down')
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        # The slot is taken under the lock, but the worker is started outside of it. Starting takes a JVM start and a
+        # health check (up to START_TIMEOUT_SECONDS), which other requests (and shutdown) shouldn't wait on
+        worker = None
+        with self._lock:
+            if len(self._workers) < self.size:
+                worker = CliWorker(self.zatca_cli_path, self.java_home)
+                self._workers.append(worker)
+
+        if worker:
+            try:
+                worker.start()
+                if self._is_shut_down:
+                    raise CliWorkerUnavailable('ZATCA CLI worker pool is shut down')
+            except Exception:
+                # Give the slot back, so that the next request tries to start a worker again
+                logger.warning(f'Could not start a ZATCA CLI worker for {self.zatca_cli_path}', exc_info=True)
+                worker.stop()
+                with self._lock:
+                    if worker in self._workers:
+                        self._workers.remove(worker)
+                raise
+            return worker
+
+        try:
+            return self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise CliWorkerUnavailable(
+                f'All {self.size} ZATCA CLI workers are busy, waited {self.acquire_timeout} seconds'
+            )
+
+    def _release(self, worker: CliWorker) -> None:
+        if self._is_shut_down:
+            worker.stop()
+        else:
+            self._idle.put(worker)
+
+    def shutdown(self) -> None:
+        """Stops all workers, including those in use. Requests in flight on them fail over to one-shot runs"""
+        with self._lock:
+            self._is_shut_down = True
+            workers, self._workers = self._workers, []
+
+        for worker in workers:
+            worker.stop()
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+
+
+_pools: Dict[Tuple[str, Optional[str]], CliWorkerPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool_size() -> int:
+    """Returns the configured number of resident CLI workers per process. 0 (the default) disables worker mode"""
+    return int(frappe.conf.get('zatca_cli_workers') or 0)
+
+
+def get_pool(zatca_cli_path: str, java_home: Optional[str]) -> Optional[CliWorkerPool]:
+    """
+    Returns the worker pool for the given CLI, or None if worker mode is disabled. Whether the CLI supports worker mode
+    is up to the caller (see [ksa_compliance.zatca_cli.CliCapabilities.supports_worker_mode])
+    """
+    size = get_pool_size()
+    if size <= 0:
+        return None
+
+    key = (zatca_cli_path, java_home or None)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = CliWorkerPool(zatca_cli_path, java_home, size)
+            _pools[key] = pool
+
+    return pool
+
+
+@contextmanager
+def reserve_worker(zatca_cli_path: str, java_home: Optional[str]) -> Iterator[Optional[CliWorker]]:
+    """
+    Reserves a worker for a sequence of requests. If worker mode is disabled, a dedicated worker is started for the
+    duration of the block, so the sequence still pays for a single JVM start. Yields None if no worker could be started,
+    in which case callers should run one-shot invocations. Callers are expected to check that the CLI supports worker
+    mode first (see [ksa_compliance.zatca_cli.CliCapabilities.supports_worker_mode])
+    """
+    pool = get_pool(zatca_cli_path, java_home)
+    if pool:
+        with pool.reserve() as worker:
+            yield worker
+        return
+
+    worker = CliWorker(zatca_cli_path, java_home)
+    try:
+        worker.start()
+    except CliWorkerUnavailable:
+        logger.warning(f'Could not start a ZATCA CLI worker for {zatca_cli_path}', exc_info=True)
+        worker.stop()
+        yield None
+        return
+
+    try:
+        yield worker
+    finally:
+        worker.stop()
+
+
+def shutdown_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown()
+        _pools.clear()
+
+
+atexit.register(shutdown_pools)
@@ -0,0 +1,431 @@
+"""
+In-process invoice signing, as an alternative to running the ZATCA CLI for every invoice.
+
+This follows the same steps as the ZATCA SDK (which the CLI wraps):
+1. Compute the invoice hash: SHA-256 over the canonicalized (C14N) invoice, excluding UBL extensions, the signature
+   reference and the QR document reference
+2. Sign the invoice hash using ECDSA (secp256k1) with the EGS private key
+3. Embed the XAdES signed properties (signing time, certificate digest, issuer and serial number) and the signature
+4. Build the TLV QR code and embed it in the invoice
+
+The signature elements are inserted without any surrounding whitespace, so removing them yields the exact unsigned
+invoice. That keeps the invoice hash stable whether a verifier strips whitespace around removed elements or not.
+"""
+
+import base64
+import datetime
+import functools
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from lxml import etree
+
+from ksa_compliance.zatca_cli import SigningRequest, SigningResult
+
+NS = {
+    'inv': 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2',
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+    'ext': 'urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2',
+    'sig': 'urn:oasis:names:specification:ubl:schema:xsd:CommonSignatureComponents-2',
+    'sac': 'urn:oasis:names:specification:ubl:schema:xsd:SignatureAggregateComponents-2',
+    'sbc': 'urn:oasis:names:specification:ubl:schema:xsd:SignatureBasicComponents-2',
+    'ds': 'http://www.w3.org/2000/09/xmldsig#',
+    'xades': 'http://uri.etsi.org/01903/v1.3.2#',
+}
+
+# Elements excluded from the invoice hash, as specified by the transforms in the signature's SignedInfo
+HASH_EXCLUDED_XPATH = (
+    '/inv:Invoice/ext:UBLExtensions'
+    " | /inv:Invoice/cac:AdditionalDocumentReference[normalize-space(cbc:ID) = 'QR']"
+    ' | /inv:Invoice/cac:Signature'
+)
+
+PIH_XPATH = (
+    "/inv:Invoice/cac:AdditionalDocumentReference[cbc:ID = 'PIH']/cac:Attachment/cbc:EmbeddedDocumentBinaryObject"
+)
+ICV_XPATH = "/inv:Invoice/cac:AdditionalDocumentReference[cbc:ID = 'ICV']/cbc:UUID"
+QR_XPATH = "/inv:Invoice/cac:AdditionalDocumentReference[cbc:ID = 'QR']/cac:Attachment/cbc:EmbeddedDocumentBinaryObject"
+
+UBL_EXTENSIONS_TEMPLATE = (
+    '<ext:UBLExtensions xmlns:ext="{ext}">'
+    '<ext:UBLExtension>'
+    '<ext:ExtensionURI>urn:oasis:names:specification:ubl:dsig:enveloped:xades</ext:ExtensionURI>'
+    '<ext:ExtensionContent>'
+    '<sig:UBLDocumentSignatures xmlns:sig="{sig}" xmlns:sac="{sac}" xmlns:sbc="{sbc}">'
+    '<sac:SignatureInformation>'
+    '<cbc:ID xmlns:cbc="{cbc}">urn:oasis:names:specification:ubl:signature:1</cbc:ID>'
+    '<sbc:ReferencedSignatureID>urn:oasis:names:specification:ubl:signature:Invoice</sbc:ReferencedSignatureID>'
+    '<ds:Signature xmlns:ds="{ds}" Id="signature">'
+    '<ds:SignedInfo>'
+    '<ds:CanonicalizationMethod Algorithm="http://www.w3.org/2006/12/xml-c14n11"/>'
+    '<ds:SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha256"/>'
+    '<ds:Reference Id="invoiceSignedData" URI="">'
+    '<ds:Transforms>'
+    '<ds:Transform Algorithm="http://www.w3.org/TR/1999/REC-xpath-19991116">'
+    '<ds:XPath>not(//ancestor-or-self::ext:UBLExtensions)</ds:XPath>'
+    '</ds:Transform>'
+    '<ds:Transform Algorithm="http://www.w3.org/TR/1999/REC-xpath-19991116">'
+    '<ds:XPath>not(//ancestor-or-self::cac:Signature)</ds:XPath>'
+    '</ds:Transform>'
+    '<ds:Transform Algorithm="http://www.w3.org/TR/1999/REC-xpath-19991116">'
+    "<ds:XPath>not(//ancestor-or-self::cac:AdditionalDocumentReference[cbc:ID='QR'])</ds:XPath>"
+    '</ds:Transform>'
+    '<ds:Transform Algorithm="http://www.w3.org/2006/12/xml-c14n11"/>'
+    '</ds:Transforms>'
+    '<ds:DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/>'
+    '<ds:DigestValue/>'
+    '</ds:Reference>'
+    '<ds:Reference Type="http://www.w3.org/2000/09/xmldsig#SignatureProperties" URI="#xadesSignedProperties">'
+    '<ds:DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/>'
+    '<ds:DigestValue/>'
+    '</ds:Reference>'
+    '</ds:SignedInfo>'
+    '<ds:SignatureValue/>'
+    '<ds:KeyInfo><ds:X509Data><ds:X509Certificate/></ds:X509Data></ds:KeyInfo>'
+    '<ds:Object>'
+    '<xades:QualifyingProperties xmlns:xades="{xades}" Target="signature">'
+    '<xades:SignedProperties Id="xadesSignedProperties">'
+    '<xades:SignedSignatureProperties>'
+    '<xades:SigningTime/>'
+    '<xades:SigningCertificate>'
+    '<xades:Cert>'
+    '<xades:CertDigest>'
+    '<ds:DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/>'
+    '<ds:DigestValue/>'
+    '</xades:CertDigest>'
+    '<xades:IssuerSerial>'
+    '<ds:X509IssuerName/>'
+    '<ds:X509SerialNumber/>'
+    '</xades:IssuerSerial>'
+    '</xades:Cert>'
+    '</xades:SigningCertificate>'
+    '</xades:SignedSignatureProperties>'
+    '</xades:SignedProperties>'
+    '</xades:QualifyingProperties>'
+    '</ds:Object>'
+    '</ds:Signature>'
+    '</sac:SignatureInformation>'
+    '</sig:UBLDocumentSignatures>'
+    '</ext:ExtensionContent>'
+    '</ext:UBLExtension>'
+    '</ext:UBLExtensions>'
+).format(**NS)
+
+QR_REFERENCE_TEMPLATE = (
+    '<cac:AdditionalDocumentReference xmlns:cac="{cac}" xmlns:cbc="{cbc}">'
+    '<cbc:ID>QR</cbc:ID>'
+    '<cac:Attachment><cbc:EmbeddedDocumentBinaryObject mimeCode="text/plain"/></cac:Attachment>'
+    '</cac:AdditionalDocumentReference>'
+).format(**NS)
+
+SIGNATURE_REFERENCE_TEMPLATE = (
+    '<cac:Signature xmlns:cac="{cac}" xmlns:cbc="{cbc}">'
+    '<cbc:ID>urn:oasis:names:specification:ubl:signature:Invoice</cbc:ID>'
+    '<cbc:SignatureMethod>urn:oasis:names:specification:ubl:dsig:enveloped:xades</cbc:SignatureMethod>'
+    '</cac:Signature>'
+).format(**NS)
+
+
+@dataclass(frozen=True)
+class SigningCredentials:
+    """An EGS private key and its ZATCA-issued certificate"""
+
+    private_key: ec.EllipticCurvePrivateKey
+    certificate: x509.Certificate
+    certificate_base64: str
+    """The certificate body (base64 DER without PEM armor), as embedded in the signature"""
+
+
+def sign_invoice(invoice_xml: str, cert_path: str, private_key_path: str) -> SigningResult:
+    """Signs [invoice_xml] in-process. Returns the same result as [ksa_compliance.zatca_cli.sign_invoice]"""
+    credentials = load_credentials(cert_path, private_key_path)
+    return sign_invoice_with_credentials(invoice_xml, credentials)
+
+
+def iter_sign_invoices(
+    requests: Iterable[SigningRequest], chain_position: Optional[Tuple[int, str]] = None
+) -> Iterator[SigningResult]:
+    """Signs a chain of invoices in order. See [ksa_compliance.zatca_cli.iter_sign_invoices]"""
+    for request in requests:
+        invoice_xml = request.invoice_xml
+        if chain_position:
+            invoice_xml = set_chain_position(invoice_xml, *chain_position)
+
+        result = sign_invoice(invoice_xml, request.cert_path, request.private_key_path)
+        if chain_position:
+            chain_position = (chain_position[0] + 1, result.invoice_hash)
+        yield result
+
+
+def sign_invoice_with_credentials(
+    invoice_xml: str, credentials: SigningCredentials, signing_time: Optional[datetime.datetime] = None
+) -> SigningResult:
+    root = _parse(invoice_xml)
+    _remove_signature_elements(root)
+    _insert_signature_elements(root)
+
+    invoice_hash = compute_invoice_hash(root)
+    signature = base64.b64encode(
+        credentials.private_key.sign(base64.b64decode(invoice_hash), ec.ECDSA(hashes.SHA256()))
+    ).decode()
+
+    signing_time = signing_time or datetime.datetime.now()
+    cert = credentials.certificate
+    _set_text(root, '//xades:SigningTime', signing_time.strftime('%Y-%m-%dT%H:%M:%S'))
+    _set_text(root, '//xades:CertDigest/ds:DigestValue', _hex_digest_base64(credentials.certificate_base64.encode()))
+    _set_text(root, '//ds:X509IssuerName', _format_issuer(cert))
+    _set_text(root, '//ds:X509SerialNumber', str(cert.serial_number))
+
+    signed_properties = _find(root, '//xades:SignedProperties')
+    signed_properties_digest = _signed_properties_digest(signed_properties)
+    _set_text(root, "//ds:Reference[@Id='invoiceSignedData']/ds:DigestValue", invoice_hash)
+    _set_text(root, "//ds:Reference[@URI='#xadesSignedProperties']/ds:DigestValue", signed_properties_digest)
+    _set_text(root, '//ds:SignatureValue', signature)
+    _set_text(root, '//ds:X509Certificate', credentials.certificate_base64)
+
+    qr_code = build_qr_code(root, invoice_hash, signature, cert)
+    _set_text(root, QR_XPATH, qr_code)
+
+    return SigningResult(_serialize(root), invoice_hash, qr_code)
+
+
+def compute_invoice_hash(invoice: str | etree._Element) -> str:
+    """
+    Computes the base64 SHA-256 hash of an invoice, signed or not. Signature elements (if any) are excluded as per the
+    signature transforms, keeping any whitespace around them
+    """
+    root = _parse(invoice) if isinstance(invoice, str) else invoice
+    root = _copy(root)
+    _remove_signature_elements(root)
+    return base64.b64encode(hashlib.sha256(etree.tostring(root, method='c14n')).digest()).decode()
+
+
+def get_previous_invoice_hash(root: etree._Element) -> str:
+    return _text(root, PIH_XPATH)
+
+
+def get_invoice_counter(root: etree._Element) -> int:
+    return int(_text(root, ICV_XPATH))
+
+
+def set_chain_position(invoice_xml: str, invoice_counter: int, previous_invoice_hash: str) -> str:
+    """Returns [invoice_xml] with its invoice counter (ICV) and PIH document references set"""
+    root = _parse(invoice_xml)
+    _set_text(root, ICV_XPATH, str(invoice_counter))
+    _set_text(root, PIH_XPATH, previous_invoice_hash)
+    return _serialize(root)
+
+
+def build_qr_code(root: etree._Element, invoice_hash: str, signature: str, certificate: x509.Certificate) -> str:
+    """Builds the base64 TLV QR code for a signed invoice"""
+    issue_date = _text(root, '/inv:Invoice/cbc:IssueDate')
+    issue_time = _text(root, '/inv:Invoice/cbc:IssueTime')
+    tags: List[Tuple[int, bytes]] = [
+        (
+            1,
+            _text(root, '/inv:Invoice/cac:AccountingSupplierParty//cac:PartyLegalEntity/cbc:RegistrationName').encode(),
+        ),
+        (2, _text(root, '/inv:Invoice/cac:AccountingSupplierParty//cac:PartyTaxScheme/cbc:CompanyID').encode()),
+        (3, f'{issue_date}T{issue_time}'.encode()),
+        (4, _text(root, '/inv:Invoice/cac:LegalMonetaryTotal/cbc:TaxInclusiveAmount').encode()),
+        (5, _text(root, '/inv:Invoice/cac:TaxTotal/cbc:TaxAmount').encode()),
+        (6, invoice_hash.encode()),
+        (7, signature.encode()),
+        (
+            8,
+            certificate.public_key().public_bytes(
+                serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+            ),
+        ),
+    ]
+    # The certificate signature (stamp) is only required for simplified invoices
+    if _text(root, '/inv:Invoice/cbc:InvoiceTypeCode/@name').startswith('02'):
+        tags.append((9, certificate.signature))
+
+    tlv = b''.join(_tlv(tag, value) for tag, value in tags)
+    return base64.b64encode(tlv).decode()
+
+
+def parse_qr_code(qr_code: str) -> Dict[int, bytes]:
+    """Parses a base64 TLV QR code into a tag -> value mapping"""
+    data = base64.b64decode(qr_code)
+    tags = {}
+    i = 0
+    while i + 2 <= len(data):
+        tag, length = data[i], data[i + 1]
+        tags[tag] = data[i + 2 : i + 2 + length]
+        i += 2 + length
+    return tags
+
+
+def verify_signature(root: etree._Element) -> List[str]:
+    """
+    Verifies the signature of a signed invoice against the certificate embedded in it. Returns a list of problems,
+    which is empty if the signature is valid
+    """
+    invoice_hash = compute_invoice_hash(root)
+    if _text(root, "//ds:Reference[@Id='invoiceSignedData']/ds:DigestValue") != invoice_hash:
+        return ['Invoice hash does not match the signed digest value']
+
+    signed_properties = root.xpath('//xades:SignedProperties', namespaces=NS)
+    if not signed_properties:
+        return ['Missing signed properties']
+    signed_properties_digest = _signed_properties_digest(signed_properties[0])
+    if _text(root, "//ds:Reference[@URI='#xadesSignedProperties']/ds:DigestValue") != signed_properties_digest:
+        return ['Signed properties digest does not match']
+
+    try:
+        certificate = x509.load_der_x509_certificate(base64.b64decode(_text(root, '//ds:X509Certificate')))
+        certificate.public_key().verify(
+            base64.b64decode(_text(root, '//ds:SignatureValue')),
+            base64.b64decode(invoice_hash),
+            ec.ECDSA(hashes.SHA256()),
+        )
+    except (ValueError, TypeError, InvalidSignature) as e:
+        return [f'Invalid signature: {e or type(e).__name__}']
+
+    return []
+
+
+def verify_qr_code(root: etree._Element) -> List[str]:
+    """Verifies that the QR code of a signed invoice matches the invoice. Returns a list of problems, if any"""
+    qr_code = _text(root, QR_XPATH)
+    if not qr_code:
+        return ['Missing QR code']
+
+    try:
+        tags = parse_qr_code(qr_code)
+        certificate = x509.load_der_x509_certificate(base64.b64decode(_text(root, '//ds:X509Certificate')))
+    except ValueError as e:
+        return [f'Invalid QR code: {e}']
+
+    expected = parse_qr_code(
+        build_qr_code(root, compute_invoice_hash(root), _text(root, '//ds:SignatureValue'), certificate)
+    )
+    return [f'QR code tag {tag} does not match the invoice' for tag in expected if tags.get(tag) != expected[tag]]
+
+
+def load_credentials(cert_path: str, private_key_path: str) -> SigningCredentials:
+    """Loads signing credentials. Files are parsed once per worker and reloaded only if they change on disk"""
+    return _load_credentials(
+        cert_path, os.path.getmtime(cert_path), private_key_path, os.path.getmtime(private_key_path)
+    )
+
+
+@functools.lru_cache(maxsize=32)
+def _load_credentials(cert_path: str, cert_mtime: float, private_key_path: str, key_mtime: float) -> SigningCredentials:
+    with open(cert_path, 'rb') as f:
+        cert_content = f.read()
+    with open(private_key_path, 'rb') as f:
+        key_content = f.read()
+
+    certificate_base64 = _strip_pem(cert_content)
+    certificate = x509.load_der_x509_certificate(base64.b64decode(certificate_base64))
+
+    # Keys generated by the CLI (and the sandbox key) are stored as bare base64 DER, without PEM armor
+    if b'-----BEGIN' in key_content:
+        private_key = serialization.load_pem_private_key(key_content, password=None)
+    else:
+        private_key = serialization.load_der_private_key(base64.b64decode(_strip_pem(key_content)), password=None)
+
+    if not isinstance(private_key, ec.EllipticCurvePrivateKey):
+        raise ValueError(f'Expected an EC private key in {private_key_path}')
+
+    return SigningCredentials(private_key, certificate, certificate_base64)
+
+
+def _strip_pem(content: bytes) -> str:
+    lines = [line.strip() for line in content.decode().splitlines()]
+    return ''.join(line for line in lines if line and not line.startswith('-----'))
+
+
+def _format_issuer(certificate: x509.Certificate) -> str:
+    # Java's X500Principal.getName() order (most specific first), which is what the SDK embeds
+    return ', '.join(rdn.rfc4514_string() for rdn in reversed(certificate.issuer.rdns))
+
+
+def _hex_digest_base64(content: bytes) -> str:
+    # ZATCA digests for the certificate and signed properties are the base64 of the *hex* SHA-256 digest
+    return base64.b64encode(hashlib.sha256(content).hexdigest().encode()).decode()
+
+
+def _signed_properties_digest(signed_properties: etree._Element) -> str:
+    # The SDK digests the signed properties on their own, declaring only the xades and ds namespaces, rather than
+    # canonicalizing them in place (which would declare every namespace in scope from the invoice)
+    detached = _copy(signed_properties)
+    etree.cleanup_namespaces(
+        detached, top_nsmap={'ds': NS['ds'], 'xades': NS['xades']}, keep_ns_prefixes=['ds', 'xades']
+    )
+    return _hex_digest_base64(etree.tostring(detached, method='c14n'))
+
+
+def _tlv(tag: int, value: bytes) -> bytes:
+    # ZATCA QR codes encode the length of each value in a single byte
+    if len(value) > 255:
+        raise ValueError(f'QR code tag {tag} is {len(value)} bytes long, the maximum is 255 bytes')
+    return bytes([tag, len(value)]) + value
+
+
+def _parse(xml: str) -> etree._Element:
+    parser = etree.XMLParser(remove_blank_text=False, resolve_entities=False, no_network=True)
+    return etree.fromstring(xml.encode('utf-8'), parser)
+
+
+def _serialize(root: etree._Element) -> str:
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + etree.tostring(root, encoding='unicode')
+
+
+def _copy(root: etree._Element) -> etree._Element:
+    return etree.fromstring(etree.tostring(root))
+
+
+def _remove_signature_elements(root: etree._Element) -> None:
+    for element in root.xpath(HASH_EXCLUDED_XPATH, namespaces=NS):
+        _remove_keeping_tail(element)
+
+
+def _remove_keeping_tail(element: etree._Element) -> None:
+    parent = element.getparent()
+    if element.tail:
+        previous = element.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or '') + element.tail
+        else:
+            parent.text = (parent.text or '') + element.tail
+    parent.remove(element)
+
+
+def _insert_signature_elements(root: etree._Element) -> None:
+    root.insert(0, etree.fromstring(UBL_EXTENSIONS_TEMPLATE))
+
+    references = root.xpath('/inv:Invoice/cac:AdditionalDocumentReference', namespaces=NS)
+    references[-1].addnext(etree.fromstring(QR_REFERENCE_TEMPLATE))
+
+    supplier = _find(root, '/inv:Invoice/cac:AccountingSupplierParty')
+    supplier.addprevious(etree.fromstring(SIGNATURE_REFERENCE_TEMPLATE))
+
+
+def _find(root: etree._Element, xpath: str) -> etree._Element:
+    result = root.xpath(xpath, namespaces=NS)
+    if not result:
+        raise ValueError(f'Could not find {xpath} in invoice')
+    return result[0]
+
+
+def _text(root: etree._Element, xpath: str) -> str:
+    result = root.xpath(xpath, namespaces=NS)
+    if not result:
+        return ''
+    value = result[0]
+    return (value if isinstance(value, str) else value.text or '').strip()
+
+
+def _set_text(root: etree._Element, xpath: str, value: str) -> None:
+    _find(root, xpath).text = value
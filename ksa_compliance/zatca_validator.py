@@ -0,0 +1,158 @@
+"""
+In-process invoice validation, as an alternative to running 'zatca-cli validate' after signing.
+
+Validation covers the same ground as the ZATCA SDK:
+1. The UBL 2.1 invoice schema (XSD), bundled under output_models/xsd
+2. The EN16931 and ZATCA business rules. These are Schematron rules compiled to XSLT 2.0, which lxml can't run, so
+   they're executed with Saxon (saxonche). The rule stylesheets are taken from the ZATCA CLI's SDK data, so they stay
+   in sync with the installed CLI
+3. The signature, QR code and previous invoice hash
+
+Schemas and stylesheets are compiled once per worker.
+"""
+
+import functools
+import glob
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from lxml import etree
+from saxonche import PySaxonProcessor, PyXsltExecutable
+
+from ksa_compliance import logger
+from ksa_compliance import zatca_signer
+from ksa_compliance.zatca_cli import ValidationDetails, ValidationResult
+
+XSD_PATH = os.path.join(os.path.dirname(__file__), 'output_models', 'xsd', 'maindoc', 'UBL-Invoice-2.1.xsd')
+
+# Relative to the CLI base path (the parent of its bin directory)
+RULES_GLOB = os.path.join('**', 'Rules', 'Schematrons', '*.xsl')
+
+SVRL_NS = {'svrl': 'http://purl.oclc.org/dsdl/svrl'}
+
+_saxon_processor: Optional[PySaxonProcessor] = None
+
+# A compiled schema keeps the error log of its last validation, so it can't validate two invoices at once
+_schema_lock = threading.Lock()
+
+# Saxon isn't safe to use from multiple threads without attaching each one, so transformations are serialized. Each
+# takes a few milliseconds
+_saxon_lock = threading.Lock()
+
+
+def is_supported(zatca_cli_path: str) -> bool:
+    """Returns whether the business rules could be found for the given CLI"""
+    return bool(find_rules(zatca_cli_path))
+
+
+def find_rules(zatca_cli_path: str) -> List[str]:
+    base_path = os.path.normpath(os.path.join(os.path.dirname(zatca_cli_path), '../'))
+    return _find_rules(base_path, os.path.getmtime(base_path) if os.path.isdir(base_path) else 0)
+
+
+@functools.lru_cache(maxsize=8)
+def _find_rules(base_path: str, mtime: float) -> List[str]:
+    return sorted(glob.glob(os.path.join(base_path, RULES_GLOB), recursive=True))
+
+
+def validate_invoice(zatca_cli_path: str, invoice_xml: str, previous_invoice_hash: str) -> Optional[ValidationResult]:
+    """
+    Validates a signed invoice in-process. Returns None if the business rules for the given CLI can't be found, in
+    which case the caller should validate using the CLI
+    """
+    rules = find_rules(zatca_cli_path)
+    if not rules:
+        logger.warning(f'Could not find ZATCA validation rules for {zatca_cli_path}')
+        return None
+
+    root = etree.fromstring(invoice_xml.encode('utf-8'), etree.XMLParser(resolve_entities=False, no_network=True))
+    messages = []
+    errors: Dict[str, str] = {}
+    warnings: Dict[str, str] = {}
+
+    with _schema_lock:
+        schema = _get_schema()
+        schema_valid = schema.validate(root)
+        for error in schema.error_log:
+            _add(errors, f'XSD:{error.line}', error.message)
+    messages.append(_message('XSD', schema_valid))
+
+    rules_errors, rules_warnings = _run_rules(tuple(rules), invoice_xml)
+    errors.update(rules_errors)
+    warnings.update(rules_warnings)
+    messages.append(_message('EN/KSA rules', not rules_errors))
+
+    signature_problems = zatca_signer.verify_signature(root)
+    for problem in signature_problems:
+        _add(errors, 'SIGNATURE', problem)
+    messages.append(_message('Signature', not signature_problems))
+
+    qr_problems = zatca_signer.verify_qr_code(root)
+    for problem in qr_problems:
+        _add(errors, 'QR', problem)
+    messages.append(_message('QR', not qr_problems))
+
+    pih = zatca_signer.get_previous_invoice_hash(root)
+    pih_valid = pih == previous_invoice_hash
+    if not pih_valid:
+        _add(errors, 'PIH', f"Previous invoice hash '{pih}' does not match '{previous_invoice_hash}'")
+    messages.append(_message('PIH', pih_valid))
+
+    details = ValidationDetails(
+        is_valid=not errors,
+        is_valid_qr=not qr_problems,
+        is_valid_signature=not signature_problems,
+        errors=errors,
+        warnings=warnings,
+    )
+    errors_and_warnings = [f'{code}: {msg}' for code, msg in {**errors, **warnings}.items()]
+    return ValidationResult(messages, errors_and_warnings, details)
+
+
+@functools.cache
+def _get_schema() -> etree.XMLSchema:
+    return etree.XMLSchema(etree.parse(XSD_PATH))
+
+
+def _get_saxon_processor() -> PySaxonProcessor:
+    global _saxon_processor
+    if _saxon_processor is None:
+        _saxon_processor = PySaxonProcessor(license=False)
+    return _saxon_processor
+
+
+@functools.lru_cache(maxsize=8)
+def _compile_rules(rules: Tuple[str, ...]) -> List[PyXsltExecutable]:
+    processor = _get_saxon_processor()
+    executables = []
+    for path in rules:
+        logger.info(f'Compiling ZATCA validation rules: {path}')
+        executables.append(processor.new_xslt30_processor().compile_stylesheet(stylesheet_file=path))
+    return executables
+
+
+def _run_rules(rules: Tuple[str, ...], invoice_xml: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Runs the Schematron stylesheets on the invoice and returns the failed assertions as (errors, warnings)"""
+    errors: Dict[str, str] = {}
+    warnings: Dict[str, str] = {}
+    with _saxon_lock:
+        executables = _compile_rules(rules)
+        document = _get_saxon_processor().parse_xml(xml_text=invoice_xml)
+        reports = [executable.transform_to_string(xdm_node=document) for executable in executables]
+
+    for report in reports:
+        svrl = etree.fromstring(report.encode('utf-8'))
+        for failure in svrl.iterfind('.//svrl:failed-assert', SVRL_NS):
+            code = failure.get('id') or failure.get('location', '')
+            text = ' '.join(''.join(failure.itertext()).split())
+            _add(warnings if failure.get('flag') == 'warning' else errors, code, text)
+    return errors, warnings
+
+
+def _add(target: Dict[str, str], code: str, message: str) -> None:
+    target[code] = f'{target[code]}\n{message}' if code in target else message
+
+
+def _message(step: str, is_valid: bool) -> str:
+    return f'[{step}] validation result : {"PASSED" if is_valid else "FAILED"}'